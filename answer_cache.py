@@ -0,0 +1,104 @@
+"""Semantic cache of answers to first-turn questions"""
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+class SemanticAnswerCache:
+    """Answer near-duplicate questions from earlier answers
+
+    Entries are keyed by the normalized query embedding; a lookup hits when
+    the best cosine similarity reaches `threshold`. Entries expire after
+    `ttl` seconds, the least recently used is evicted beyond `max_entries`,
+    and everything is dropped when the index version changes, including
+    answers still being generated from lookups made before the change.
+    """
+
+    def __init__(self, embeddings, threshold=0.95, ttl=86400, max_entries=2000):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.index_version = None
+        self.hits = 0
+        self.misses = 0
+        self.latency_saved = 0.0
+        self._entries = OrderedDict()
+        self._next_id = 0
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _embed(self, question):
+        vector = np.asarray(self.embeddings.embed_query(question.strip()), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _expire(self, now):
+        expired = [entry_id for entry_id, entry in self._entries.items() if now - entry["created"] > self.ttl]
+        for entry_id in expired:
+            del self._entries[entry_id]
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, index_version=None):
+        """Drop every entry, e.g. after the index has been rebuilt"""
+        with self._lock:
+            self._entries.clear()
+            self.index_version = index_version
+            self._generation += 1
+
+    def lookup(self, question):
+        """Return (answer, key); answer is None on a miss, and the key is what `store` takes"""
+        vector = self._embed(question)
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            if self._entries:
+                ids = list(self._entries)
+                scores = np.stack([self._entries[entry_id]["vector"] for entry_id in ids]) @ vector
+                best = int(np.argmax(scores))
+                best_id, best_score = ids[best], float(scores[best])
+            else:
+                best_id, best_score = None, -1.0
+
+            if best_score >= self.threshold:
+                entry = self._entries[best_id]
+                self._entries.move_to_end(best_id)
+                self.hits += 1
+                self.latency_saved += entry["latency"]
+                return entry["answer"], (vector, self._generation)
+
+            self.misses += 1
+            return None, (vector, self._generation)
+
+    def store(self, key, answer, latency):
+        """Remember an answer and how long it took to produce
+
+        Answers to lookups made before the last `invalidate` are dropped.
+        """
+        vector, generation = key
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._entries[self._next_id] = {
+                "vector": vector,
+                "answer": answer,
+                "latency": latency,
+                "created": time.time()
+            }
+            self._next_id += 1
+            self._expire(time.time())
+
+    def stats(self):
+        """Hit rate and total latency saved by cache hits"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "latency_saved_seconds": self.latency_saved
+            }
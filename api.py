@@ -0,0 +1,204 @@
+"""Headless HTTP/JSON API for CareerGPT, for embedding on the website and load tests
+
+    OPENAI_API_KEY=... python api.py
+
+POST /chat           {"message": ..., "session_id": optional} -> JSON answer
+POST /chat/stream    same body -> Server-Sent Events: `session`, `token`..., `done` (or `error`)
+DELETE /sessions/ID  forget a session's conversation
+GET /health
+
+Session ids are issued by the API and signed, so a client can only
+continue or clear sessions it was given. A streamed turn is cancelled
+when its client disconnects.
+
+With TEQ3_METRICS_PORT set, a separate listener on TEQ3_METRICS_HOST
+(localhost by default) serves:
+
+GET /metrics         Prometheus metrics: per-stage latency, tokens, cache hits, retries
+GET /stats           cache, engine and retrieval counters
+GET /debug/profile   folded stacks from the sampling profiler (TEQ3_PROFILE=1)
+
+It serves the same shared bot as the Streamlit app (retriever, routing and
+session memory), without a browser session or Streamlit's per-rerun cost.
+"""
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import uuid
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+from chatbot import build_bot
+from routing import ERROR_RESPONSE, default_router, route_query
+from settings import (
+    API_CORS_ORIGINS, API_HOST, API_MAX_MESSAGE_CHARS, API_PORT, API_SESSION_SECRET, METRICS_HOST, METRICS_PORT
+)
+from tracing import METRICS, configure_logging, profile_report, serve_metrics, start_profiler
+
+logger = logging.getLogger(__name__)
+
+_session_key = API_SESSION_SECRET.encode("utf-8") or secrets.token_bytes(32)
+
+
+def new_session_id():
+    """A fresh session id: a random id and its signature"""
+    session = uuid.uuid4().hex
+    return f"{session}.{_signature(session)}"
+
+
+def _signature(session):
+    return hmac.new(_session_key, session.encode("utf-8"), hashlib.sha256).hexdigest()[:32]
+
+
+def valid_session_id(session_id):
+    """Whether `session_id` was issued by this API"""
+    session, _, signature = str(session_id).partition(".")
+    return bool(session) and hmac.compare_digest(signature, _signature(session))
+
+
+@asynccontextmanager
+async def lifespan(app):
+    start_profiler()
+    # Loading or building the index blocks, so keep it off the event loop
+    app.state.bot, failed = await run_in_threadpool(build_bot, os.environ["OPENAI_API_KEY"])
+    await run_in_threadpool(default_router)
+    for url in failed:
+        logger.warning("could not load %s", url)
+    if not API_SESSION_SECRET:
+        logger.warning("TEQ3_API_SESSION_SECRET is not set; session ids won't survive a restart")
+    if METRICS_PORT:
+        bot = app.state.bot
+        server = serve_metrics(METRICS_PORT, METRICS_HOST, {
+            "/stats": lambda query: (200, "application/json", json.dumps(bot.stats())),
+            "/debug/profile": profile_report
+        })
+    yield
+    if METRICS_PORT:
+        server.shutdown()
+        server.server_close()
+
+
+async def _read_turn(request):
+    """(session id, message, None) from the request body, or (None, None, error response)"""
+    try:
+        body = await request.json()
+    except ValueError:
+        return None, None, JSONResponse({"error": "body must be JSON"}, status_code=400)
+    message = body.get("message") if isinstance(body, dict) else None
+    if not isinstance(message, str) or not message.strip():
+        return None, None, JSONResponse({"error": "`message` is required"}, status_code=400)
+    if len(message) > API_MAX_MESSAGE_CHARS:
+        return None, None, JSONResponse({"error": "`message` is too long"}, status_code=413)
+    session_id = body.get("session_id")
+    if session_id is None:
+        session_id = new_session_id()
+    elif not valid_session_id(session_id):
+        return None, None, JSONResponse({"error": "unknown `session_id`"}, status_code=403)
+    return str(session_id), message.strip(), None
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def chat(request):
+    session_id, message, error = await _read_turn(request)
+    if error:
+        return error
+    route = route_query(message)
+    category = route.intent
+    if route.answer is not None:
+        return JSONResponse({"session_id": session_id, "category": category, "answer": route.answer})
+
+    stream = request.app.state.bot.astream_reply(session_id, message)
+    try:
+        async for _ in stream:
+            pass
+    except Exception:
+        logger.exception("chat turn failed for session %s", session_id)
+        METRICS.inc("teq3_reply_errors_total", surface="api")
+        return JSONResponse({"session_id": session_id, "category": category, "answer": ERROR_RESPONSE,
+                             "error": "failed to generate an answer"}, status_code=500)
+    return JSONResponse({"session_id": session_id, "category": category, "answer": stream.answer,
+                         "model": stream.model, "ttft": stream.ttft, "elapsed": stream.elapsed})
+
+
+async def chat_stream(request):
+    session_id, message, error = await _read_turn(request)
+    if error:
+        return error
+    route = route_query(message)
+    bot = request.app.state.bot
+
+    async def events():
+        yield _sse("session", {"session_id": session_id, "category": route.intent})
+        if route.answer is not None:
+            yield _sse("token", {"token": route.answer})
+            yield _sse("done", {"answer": route.answer})
+            return
+
+        stream = bot.astream_reply(session_id, message)
+        finished = False
+        try:
+            async for token in stream:
+                yield _sse("token", {"token": token})
+            finished = True
+        except Exception:
+            finished = True
+            logger.exception("chat turn failed for session %s", session_id)
+            METRICS.inc("teq3_reply_errors_total", surface="api_stream")
+            yield _sse("error", {"answer": ERROR_RESPONSE, "error": "failed to generate an answer"})
+            return
+        finally:
+            if not finished:
+                # The client went away mid-answer; don't keep paying for its tokens
+                logger.info("client disconnected, cancelling turn for session %s", session_id)
+                bot.cancel(session_id)
+        yield _sse("done", {"answer": stream.answer, "model": stream.model, "ttft": stream.ttft,
+                            "elapsed": stream.elapsed})
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+async def reset_session(request):
+    session_id = request.path_params["session_id"]
+    if not valid_session_id(session_id):
+        return JSONResponse({"error": "unknown `session_id`"}, status_code=403)
+    await run_in_threadpool(request.app.state.bot.reset, session_id)
+    return JSONResponse({"status": "cleared"})
+
+
+async def health(request):
+    return JSONResponse({"status": "ok"})
+
+
+app = Starlette(
+    routes=[
+        Route("/chat", chat, methods=["POST"]),
+        Route("/chat/stream", chat_stream, methods=["POST"]),
+        Route("/sessions/{session_id}", reset_session, methods=["DELETE"]),
+        Route("/health", health)
+    ],
+    middleware=[
+        Middleware(CORSMiddleware, allow_origins=API_CORS_ORIGINS, allow_methods=["GET", "POST", "DELETE"],
+                   allow_headers=["Content-Type"])
+    ],
+    lifespan=lifespan
+)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    configure_logging()
+    uvicorn.run(app, host=API_HOST, port=API_PORT)
@@ -0,0 +1 @@
+"""Offline benchmarks for CareerGPT: recorded pages, fake models, no network"""
@@ -0,0 +1,169 @@
+"""Deterministic stand-ins for the OpenAI embedding and chat models"""
+import asyncio
+import hashlib
+import re
+import threading
+import time
+from typing import Any
+
+import numpy as np
+from langchain.chat_models.base import BaseChatModel
+from langchain.embeddings.base import Embeddings
+from langchain.schema import AIMessage, ChatGeneration, ChatResult
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+FOLLOW_UP_PATTERN = re.compile(r"Follow Up Input:\s*(.+?)\s*(?:\n|$)")
+
+
+class FakeEmbeddings(Embeddings):
+    """Hashed bag-of-words vectors, so similar texts still land close together
+
+    Each call sleeps `latency` plus `per_text_latency` for every text, to
+    stand in for the round-trip to an embedding API.
+    """
+
+    def __init__(self, dimensions=256, latency=0.0, per_text_latency=0.0):
+        self.dimensions = dimensions
+        self.latency = latency
+        self.per_text_latency = per_text_latency
+
+    def _vector(self, text):
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for word in WORD_PATTERN.findall(text.lower()):
+            digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "big") % self.dimensions
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def _wait(self, count):
+        delay = self.latency + self.per_text_latency * count
+        if delay:
+            time.sleep(delay)
+
+    def embed_documents(self, texts):
+        self._wait(len(texts))
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        self._wait(1)
+        return self._vector(text)
+
+
+class TokenUsage:
+    """Thread-safe totals of calls and tokens across fake chat models"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def add(self, prompt_tokens, completion_tokens):
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+
+    def reset(self):
+        with self._lock:
+            self.calls = 0
+            self.prompt_tokens = 0
+            self.completion_tokens = 0
+
+    def snapshot(self):
+        with self._lock:
+            return {"calls": self.calls, "prompt_tokens": self.prompt_tokens,
+                    "completion_tokens": self.completion_tokens}
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat model with a fixed time to first token and per-token delay
+
+    Condense prompts get the follow-up question back, everything else a
+    deterministic answer of `answer_words` words drawn from the prompt.
+    Token counts (whitespace words) are added to `usage`, shared by every
+    instance made by one `FakeChatModelFactory`.
+    """
+
+    model_name: str = "fake"
+    streaming: bool = False
+    max_tokens: int = 256
+    latency: float = 0.0
+    token_latency: float = 0.0
+    answer_words: int = 120
+    usage: Any = None
+
+    @property
+    def _llm_type(self):
+        return "fake-chat"
+
+    def _reply(self, messages):
+        prompt = "\n".join(message.content for message in messages)
+        follow_up = FOLLOW_UP_PATTERN.search(prompt)
+        if follow_up:
+            return follow_up.group(1)
+        words = WORD_PATTERN.findall(prompt.lower())[-400:] or ["teq3"]
+        seed = int.from_bytes(hashlib.blake2b(prompt.encode("utf-8"), digest_size=8).digest(), "big")
+        count = min(self.answer_words, self.max_tokens)
+        return " ".join(words[(seed + i * 7) % len(words)] for i in range(count))
+
+    def _record(self, messages, reply):
+        prompt_tokens = sum(len(message.content.split()) for message in messages)
+        completion_tokens = len(reply.split())
+        if self.usage is not None:
+            self.usage.add(prompt_tokens, completion_tokens)
+        return {
+            "token_usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                            "total_tokens": prompt_tokens + completion_tokens},
+            "model_name": self.model_name
+        }
+
+    def _result(self, messages, reply):
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=reply))],
+                          llm_output=self._record(messages, reply))
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        reply = self._reply(messages)
+        time.sleep(self.latency)
+        if self.streaming:
+            for i, word in enumerate(reply.split(" ")):
+                if i:
+                    time.sleep(self.token_latency)
+                if run_manager:
+                    run_manager.on_llm_new_token(word if i == 0 else " " + word)
+        else:
+            time.sleep(self.token_latency * len(reply.split()))
+        return self._result(messages, reply)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        reply = self._reply(messages)
+        await asyncio.sleep(self.latency)
+        if self.streaming:
+            for i, word in enumerate(reply.split(" ")):
+                if i:
+                    await asyncio.sleep(self.token_latency)
+                if run_manager:
+                    await run_manager.on_llm_new_token(word if i == 0 else " " + word)
+        else:
+            await asyncio.sleep(self.token_latency * len(reply.split()))
+        return self._result(messages, reply)
+
+
+class FakeChatModelFactory:
+    """Called like `ChatOpenAI(...)` by `build_bot`; all models share one usage counter"""
+
+    def __init__(self, latency=0.3, token_latency=0.01, answer_words=120):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.answer_words = answer_words
+        self.usage = TokenUsage()
+
+    def __call__(self, model_name="fake", streaming=False, max_tokens=256, **kwargs):
+        return FakeChatModel(
+            model_name=model_name,
+            streaming=streaming,
+            max_tokens=max_tokens or 256,
+            latency=self.latency,
+            token_latency=self.token_latency,
+            answer_words=self.answer_words,
+            usage=self.usage
+        )
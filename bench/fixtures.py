@@ -0,0 +1,127 @@
+"""Recorded teq3.ai pages for offline runs, with a synthetic fallback corpus
+
+    python -m bench.fixtures record                          # fetch the live pages once
+    python -m bench.fixtures synthetic --pages-dir /tmp/x    # or generate stand-in pages
+
+Recorded pages live in bench/fixtures/pages (a local cache, not committed)
+with a manifest of the urls `record` fetched, so they are never confused
+with synthetic pages. A benchmark run assembles its corpus in its own
+scratch directory. Pages are stored under the names `crawler.fixture_name`
+expects, so either directory can be used as TEQ3_CRAWL_FIXTURE_DIR.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import time
+
+from crawler import Crawler, fixture_name, format_report
+from settings import URLS
+
+PAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "pages")
+MANIFEST = "manifest.json"
+
+TOPICS = [
+    ("Data Analytics", ["SQL", "Excel", "Power BI", "Tableau", "Python", "statistics", "dashboards"]),
+    ("Artificial Intelligence", ["machine learning", "deep learning", "LLMs", "prompt engineering", "MLOps"]),
+    ("Career Support", ["CV reviews", "mock interviews", "portfolio projects", "job placement", "mentoring"]),
+    ("Job Guarantee", ["eligibility", "refund terms", "job search", "career coaching", "hiring partners"]),
+    ("Schedule", ["evening classes", "weekend sessions", "12 weeks", "live cohorts", "self-paced modules"]),
+    ("Pricing", ["payment plans", "instalments", "scholarships", "early-bird discount", "corporate sponsorship"])
+]
+
+BOILERPLATE = """
+<header class="site-header"><nav class="main-nav"><a href="/">Home</a><a href="/about-us">About</a>
+<a href="/data-analytics">Data Analytics</a><a href="/artificial-intelligence">AI</a><a href="/contact">Contact</a></nav></header>
+"""
+FOOTER = """
+<footer class="site-footer"><p>TEQ3 - Transforming careers in tech. careers@teq3.ai | hello@teq3.ai</p>
+<p>Copyright TEQ3. All rights reserved.</p></footer>
+"""
+
+
+def synthetic_page(url, seed=0):
+    """Deterministic stand-in page for a url: boilerplate plus topical sections"""
+    rng = random.Random(f"{seed}:{url}")
+    title = url.rstrip("/").rsplit("/", 1)[-1].replace("-", " ").title() or "TEQ3"
+    sections = []
+    for heading, terms in rng.sample(TOPICS, 4):
+        paragraphs = []
+        for _ in range(rng.randint(2, 4)):
+            picked = rng.sample(terms, 3)
+            paragraphs.append(
+                f"<p>Our {heading.lower()} track covers {picked[0]}, {picked[1]} and {picked[2]}, "
+                f"taught by industry practitioners with hands-on projects and weekly feedback. "
+                f"Learners from non-technical backgrounds regularly move into {heading.lower()} roles "
+                f"within months of finishing the programme.</p>"
+            )
+        items = "".join(f"<li>{term.capitalize()} with guided practice</li>" for term in terms)
+        sections.append(f"<h2>{heading}</h2>{''.join(paragraphs)}<ul>{items}</ul>")
+    return (f"<html><head><title>{title} | TEQ3</title></head><body>{BOILERPLATE}"
+            f"<main><h1>{title}</h1>{''.join(sections)}</main>{FOOTER}</body></html>")
+
+
+def write_pages(pages, pages_dir=PAGES_DIR):
+    os.makedirs(pages_dir, exist_ok=True)
+    for url, html in pages:
+        with open(os.path.join(pages_dir, fixture_name(url)), "w", encoding="utf-8") as f:
+            f.write(html)
+
+
+def recorded_urls(pages_dir=PAGES_DIR):
+    """Urls `record` fetched into `pages_dir`, from its manifest"""
+    path = os.path.join(pages_dir, MANIFEST)
+    if not os.path.exists(path):
+        return set()
+    with open(path, encoding="utf-8") as f:
+        return set(json.load(f)["urls"])
+
+
+def record(urls=URLS, pages_dir=PAGES_DIR):
+    """Fetch the live pages into `pages_dir`; returns the urls that failed"""
+    results = Crawler().fetch_all(urls)
+    print(format_report(results))
+    fetched = [result for result in results if result.ok]
+    write_pages([(result.url, result.html) for result in fetched], pages_dir)
+    manifest = {
+        "urls": sorted(recorded_urls(pages_dir) | {result.url for result in fetched}),
+        "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    }
+    with open(os.path.join(pages_dir, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return [result.url for result in results if not result.ok]
+
+
+def prepare_pages(corpus_dir, urls=URLS, pages_dir=PAGES_DIR):
+    """Corpus for one run in `corpus_dir`: recorded pages where there are any, synthetic ones for the rest
+
+    Nothing is written to `pages_dir`. Returns (recorded, synthetic) page counts.
+    """
+    os.makedirs(corpus_dir, exist_ok=True)
+    recorded = recorded_urls(pages_dir)
+    copied, synthetic = 0, []
+    for url in urls:
+        source = os.path.join(pages_dir, fixture_name(url))
+        if url in recorded and os.path.exists(source):
+            shutil.copyfile(source, os.path.join(corpus_dir, fixture_name(url)))
+            copied += 1
+        else:
+            synthetic.append((url, synthetic_page(url)))
+    write_pages(synthetic, corpus_dir)
+    return copied, len(synthetic)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record or generate the benchmark page corpus")
+    parser.add_argument("mode", choices=["record", "synthetic"])
+    parser.add_argument("--pages-dir", help=f"default for record: {PAGES_DIR}; required for synthetic")
+    args = parser.parse_args()
+    if args.mode == "record":
+        failed = record(URLS, args.pages_dir or PAGES_DIR)
+        sys.exit(1 if failed else 0)
+    if not args.pages_dir:
+        parser.error("synthetic pages need their own --pages-dir, apart from the recorded ones")
+    write_pages([(url, synthetic_page(url)) for url in URLS], args.pages_dir)
+    print(f"wrote {len(URLS)} synthetic pages to {args.pages_dir}")
@@ -0,0 +1,102 @@
+"""Recall versus latency of the quantized indexes against the exact flat index
+
+    python -m bench.index_report --synthetic 100000 --dimension 1536
+    python -m bench.index_report --index-dir index_snapshot
+
+Synthetic corpora are clustered Gaussian vectors, as embeddings of many
+pages on a few topics are. With --index-dir the vectors come from a flat
+snapshot, and its chunk store is also written in the compressed layout to
+compare sizes. Queries are held-out vectors from the same corpus.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+from index_store import CHUNKS_FILE, INDEX_FILE, read_manifest
+from vector_index import CompressedDocstore, format_recall_report, ivf_pq_spec, recall_report, write_docstore
+
+
+def synthetic_vectors(count, dimension, clusters=64, spread=0.35, seed=0):
+    """Unit vectors scattered around `clusters` random topic directions"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dimension)).astype(np.float32)
+    vectors = centers[rng.integers(clusters, size=count)]
+    vectors += spread * rng.standard_normal((count, dimension)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def snapshot_vectors(index_dir):
+    import faiss
+
+    manifest = read_manifest(index_dir) or {}
+    if manifest.get("layout", "flat") != "flat":
+        sys.exit(f"{index_dir} is already quantized; point --index-dir at a flat snapshot")
+    index = faiss.read_index(os.path.join(index_dir, INDEX_FILE))
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def docstore_sizes(index_dir, block_size):
+    """(raw JSON-lines bytes, compressed store bytes) of a flat snapshot's chunks"""
+    from langchain.docstore.document import Document
+
+    chunks_path = os.path.join(index_dir, CHUNKS_FILE)
+    documents, ids, hashes = [], [], []
+    with open(chunks_path, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            documents.append(Document(page_content=record["text"], metadata=record["metadata"]))
+            ids.append(record["id"])
+            hashes.append(record["hash"])
+    with tempfile.TemporaryDirectory() as path:
+        write_docstore(path, documents, ids, hashes, block_size)
+        return os.path.getsize(chunks_path), CompressedDocstore(path).nbytes()
+
+
+def split_queries(vectors, count, seed=1):
+    """Hold out `count` vectors as queries"""
+    rows = np.random.default_rng(seed).permutation(len(vectors))
+    return vectors[rows[count:]], vectors[rows[:count]]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recall/latency of quantized indexes versus exact search")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--synthetic", type=int, metavar="N", help="number of synthetic vectors")
+    source.add_argument("--index-dir", help="flat index snapshot to take vectors from")
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--specs", help="comma-separated FAISS factory specs (default: HNSW + SQ8 and IVF + PQ)")
+    parser.add_argument("--block-size", type=int, default=32, help="chunks per compressed block")
+    parser.add_argument("--output", help="write the rows as JSON")
+    args = parser.parse_args(argv)
+
+    if args.synthetic:
+        vectors = synthetic_vectors(args.synthetic + args.queries, args.dimension)
+    else:
+        vectors = snapshot_vectors(args.index_dir)
+        raw, compressed = docstore_sizes(args.index_dir, args.block_size)
+        print(f"chunk store: {raw / 2 ** 20:.2f} MB as JSON lines, {compressed / 2 ** 20:.2f} MB compressed")
+    corpus, queries = split_queries(vectors, min(args.queries, len(vectors) // 10 or 1))
+
+    if args.specs:
+        specs = [spec.strip() for spec in args.specs.split(",")]
+    else:
+        specs = ["HNSW32_SQ8", ivf_pq_spec(*corpus.shape)]
+
+    print(f"{len(corpus)} vectors x {corpus.shape[1]} dims, {len(queries)} held-out queries")
+    rows = recall_report(corpus, queries, args.k, specs)
+    print(format_recall_report(rows, args.k))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
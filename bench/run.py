@@ -0,0 +1,232 @@
+"""Offline benchmark of ingestion, retrieval and chat turns
+
+    python -m bench.run --concurrency 1,4,16 --output bench_results.json
+
+Pages come from bench/fixtures/pages where they were recorded with
+`python -m bench.fixtures record`; the rest are synthetic, generated into
+the run's scratch directory. Conversations come from bench/conversations.jsonl.
+Embeddings and chat models are deterministic fakes with configurable
+latency, so results only move when the code does. Everything runs in a
+temporary directory; tiktoken's encodings must already be in its cache
+(TIKTOKEN_CACHE_DIR) on machines with no network.
+"""
+import argparse
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_PAGES_DIR = os.path.join(BENCH_DIR, "fixtures", "pages")
+DEFAULT_CONVERSATIONS = os.path.join(BENCH_DIR, "conversations.jsonl")
+
+
+def summarize(values):
+    """Mean and tail percentiles of a list of seconds, in milliseconds"""
+    if not values:
+        return {"n": 0}
+    ms = np.asarray(values) * 1000
+    return {
+        "n": len(values),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99))
+    }
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def load_conversations(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line)["turns"] for line in f if line.strip()]
+
+
+def configure(args, workdir):
+    """Point every setting at the fixtures and the scratch directory; must run before project imports"""
+    os.environ.update({
+        "TEQ3_CRAWL_FIXTURE_DIR": os.path.join(workdir, "pages"),
+        "TEQ3_CRAWL_STATE_DIR": os.path.join(workdir, "crawl_state"),
+        "TEQ3_INDEX_DIR": os.path.join(workdir, "index_snapshot"),
+        "TEQ3_EMBEDDING_CACHE": os.path.join(workdir, "embedding_cache.sqlite3"),
+        "TEQ3_EMBEDDING_MODEL": f"bench-fake-{args.embedding_dimensions}",
+        "TEQ3_REFRESH_INTERVAL": "0",
+        "TEQ3_SESSION_BACKEND": "memory",
+        "TEQ3_ANSWER_CACHE": "1" if args.answer_cache else "0",
+        "TEQ3_ENGINE": "0" if args.no_engine else "1"
+    })
+
+
+def run_conversation(bot, route_query, turns):
+    """Play one conversation in a fresh session; returns one record per turn"""
+    session_id = f"bench-{uuid.uuid4()}"
+    records = []
+    for question in turns:
+        start = time.perf_counter()
+        route = route_query(question)
+        if route.answer is not None:
+            records.append({"elapsed": time.perf_counter() - start, "ttft": None, "model": None, "canned": True})
+            continue
+        stream = bot.stream_reply(session_id, question)
+        for _ in stream:
+            pass
+        records.append({"elapsed": time.perf_counter() - start, "ttft": stream.ttft,
+                        "model": stream.model, "canned": False})
+    bot.reset(session_id)
+    return records
+
+
+def bench_turns(bot, route_query, usage, conversations, concurrency):
+    """End-to-end turns with `concurrency` conversations in flight at once"""
+    count = max(len(conversations), concurrency)
+    batch = [conversations[i % len(conversations)] for i in range(count)]
+    before = usage.snapshot()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        records = [record for result in pool.map(lambda turns: run_conversation(bot, route_query, turns), batch)
+                   for record in result]
+    wall = time.perf_counter() - start
+    after = usage.snapshot()
+
+    llm_turns = [record for record in records if not record["canned"]]
+    tokens = {key: after[key] - before[key] for key in after}
+    models = {}
+    for record in llm_turns:
+        models[record["model"]] = models.get(record["model"], 0) + 1
+    return {
+        "concurrency": concurrency,
+        "conversations": count,
+        "turns": len(records),
+        "canned_turns": len(records) - len(llm_turns),
+        "wall_seconds": wall,
+        "turns_per_second": len(records) / wall if wall else 0.0,
+        "turn_latency": summarize([record["elapsed"] for record in llm_turns]),
+        "ttft": summarize([record["ttft"] for record in llm_turns if record["ttft"] is not None]),
+        "llm_calls_per_turn": tokens["calls"] / len(llm_turns) if llm_turns else 0.0,
+        "prompt_tokens_per_turn": tokens["prompt_tokens"] / len(llm_turns) if llm_turns else 0.0,
+        "completion_tokens_per_turn": tokens["completion_tokens"] / len(llm_turns) if llm_turns else 0.0,
+        "models": models
+    }
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix="teq3-bench-")
+    configure(args, workdir)
+    results = {"config": {key: value for key, value in vars(args).items()}, "memory_mb": {}}
+
+    start = time.perf_counter()
+    import faiss
+    from chatbot import build_bot
+    from ingest import build_index
+    from routing import default_router, route_query
+    from bench.fakes import FakeChatModelFactory, FakeEmbeddings
+    from bench.fixtures import prepare_pages
+    results["import_seconds"] = time.perf_counter() - start
+    results["memory_mb"]["after_imports"] = peak_rss_mb()
+
+    recorded, synthetic = prepare_pages(os.path.join(workdir, "pages"), pages_dir=args.pages_dir)
+    results["recorded_pages"] = recorded
+    results["synthetic_pages"] = synthetic
+    embeddings = FakeEmbeddings(args.embedding_dimensions, args.embed_latency, args.embed_text_latency)
+    chat_models = FakeChatModelFactory(args.llm_latency, args.token_latency, args.answer_words)
+
+    start = time.perf_counter()
+    vectorstore, failed = build_index(embeddings, force=True)
+    results["index_build_seconds"] = time.perf_counter() - start
+    results["index"] = {
+        "chunks": vectorstore.index.ntotal,
+        "type": type(vectorstore.index).__name__,
+        "index_mb": len(faiss.serialize_index(vectorstore.index)) / 2 ** 20,
+        "failed_pages": failed
+    }
+    results["memory_mb"]["after_index_build"] = peak_rss_mb()
+
+    # Cold start as the app sees it: imports plus loading the snapshot and wiring the bot
+    start = time.perf_counter()
+    bot, _ = build_bot("bench", embeddings=embeddings, chat_model=chat_models)
+    default_router()
+    results["cold_start_seconds"] = results["import_seconds"] + time.perf_counter() - start
+    results["memory_mb"]["after_bot"] = peak_rss_mb()
+
+    conversations = load_conversations(args.conversations)
+    questions = [question for turns in conversations for question in turns]
+    retriever = bot.chain.retriever
+    timings = []
+    for _ in range(args.retrieval_rounds):
+        for question in questions:
+            start = time.perf_counter()
+            retriever.get_relevant_documents(question)
+            timings.append(time.perf_counter() - start)
+    results["retrieval"] = summarize(timings)
+
+    results["sweep"] = [
+        bench_turns(bot, route_query, chat_models.usage, conversations, concurrency)
+        for concurrency in args.concurrency
+    ]
+    results["memory_mb"]["peak"] = peak_rss_mb()
+    results["bot_stats"] = bot.stats()
+    return results
+
+
+def format_results(results):
+    lines = [
+        f"cold start       {results['cold_start_seconds']:.2f}s (imports {results['import_seconds']:.2f}s)",
+        f"index build      {results['index_build_seconds']:.2f}s, {results['index']['chunks']} chunks, "
+        f"{results['index']['index_mb']:.2f} MB {results['index']['type']} "
+        f"({results['recorded_pages']} recorded, {results['synthetic_pages']} synthetic pages)",
+        "retrieval        p50 {p50_ms:.2f} ms  p95 {p95_ms:.2f} ms  p99 {p99_ms:.2f} ms".format(**results["retrieval"]),
+        f"peak memory      {results['memory_mb']['peak']:.0f} MB",
+        "",
+        "concurrency  turns/s   p50 ms   p95 ms   p99 ms  ttft p50  tokens/turn  models"
+    ]
+    for level in results["sweep"]:
+        latency = level["turn_latency"]
+        if not latency["n"]:
+            continue
+        tokens = level["prompt_tokens_per_turn"] + level["completion_tokens_per_turn"]
+        lines.append(
+            f"{level['concurrency']:>11}  {level['turns_per_second']:7.2f}  {latency['p50_ms']:7.0f}  "
+            f"{latency['p95_ms']:7.0f}  {latency['p99_ms']:7.0f}  {level['ttft'].get('p50_ms', 0):8.0f}  "
+            f"{tokens:11.0f}  {level['models']}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline CareerGPT benchmark")
+    parser.add_argument("--pages-dir", default=DEFAULT_PAGES_DIR, help="recorded pages (bench.fixtures record)")
+    parser.add_argument("--conversations", default=DEFAULT_CONVERSATIONS)
+    parser.add_argument("--concurrency", type=lambda value: [int(level) for level in value.split(",")],
+                        default=[1, 4, 16], help="comma-separated concurrent conversations, e.g. 1,4,16")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="fake LLM seconds to first token")
+    parser.add_argument("--token-latency", type=float, default=0.005, help="fake LLM seconds per token")
+    parser.add_argument("--answer-words", type=int, default=120)
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="fake embedding seconds per call")
+    parser.add_argument("--embed-text-latency", type=float, default=0.0005, help="extra seconds per text")
+    parser.add_argument("--embedding-dimensions", type=int, default=256)
+    parser.add_argument("--retrieval-rounds", type=int, default=3)
+    parser.add_argument("--answer-cache", action="store_true", help="keep the semantic answer cache on")
+    parser.add_argument("--no-engine", action="store_true", help="run turns on the thread pool, not the engine")
+    parser.add_argument("--output", help="write the full results as JSON")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    results = run(args)
+    print(format_results(results))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
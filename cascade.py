@@ -0,0 +1,204 @@
+"""Model cascade: answer with a small, fast model and escalate to the large one when needed"""
+import asyncio
+import logging
+import re
+import threading
+from typing import Any
+
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain.chains.combine_documents.base import BaseCombineDocumentsChain
+from langchain.pydantic_v1 import PrivateAttr
+
+from prompts import ESCALATE_TOKEN
+from retrieval import tokenize
+
+logger = logging.getLogger(__name__)
+
+SMALL = "small"
+LARGE = "large"
+
+# Requests for reasoning or synthesis rather than a look-up
+COMPLEX_PATTERN = re.compile(
+    r"\b(compare|comparison|difference between|differences|versus|vs\.?|pros and cons|trade-?offs?|"
+    r"roadmap|step by step|plan for|explain why|which is better|should i choose)\b",
+    re.IGNORECASE
+)
+
+
+class CascadePolicy:
+    """Decide up front which model a turn goes to
+
+    Long or multi-part questions and ones asking for comparison or
+    planning go to the large model, as do questions whose content words
+    are mostly missing from the retrieved context (low retrieval
+    confidence). Short turns (greetings, one-line follow-ups) and
+    well-covered look-ups go to the small model.
+    """
+
+    def __init__(self, max_question_words=30, short_question_words=4, min_term_coverage=0.5):
+        self.max_question_words = max_question_words
+        self.short_question_words = short_question_words
+        self.min_term_coverage = min_term_coverage
+
+    def choose(self, question, documents):
+        """(SMALL or LARGE, reason)"""
+        words = len(question.split())
+        if words > self.max_question_words:
+            return LARGE, "long question"
+        if question.count("?") > 1 or COMPLEX_PATTERN.search(question):
+            return LARGE, "complex question"
+        if words <= self.short_question_words:
+            return SMALL, "short question"
+        terms = set(tokenize(question))
+        if terms:
+            if not documents:
+                return LARGE, "no context"
+            context_terms = set(tokenize(" ".join(doc.page_content for doc in documents)))
+            coverage = len(terms & context_terms) / len(terms)
+            if coverage < self.min_term_coverage:
+                return LARGE, f"retrieval coverage {coverage:.2f}"
+        return SMALL, "simple question"
+
+
+def _streams_tokens(handler):
+    method = type(handler).on_llm_new_token
+    return method is not BaseCallbackHandler.on_llm_new_token and not asyncio.iscoroutinefunction(method)
+
+
+class EscalationGate(BaseCallbackHandler):
+    """Hold the small model's token stream until it can't be the escalation reply
+
+    Streaming handlers are taken off the small model's call and fed
+    through this gate instead: tokens are released as soon as the answer
+    stops looking like `ESCALATE_TOKEN`, so a turn that is handed to the
+    large model never shows the small model's output.
+    """
+
+    run_inline = True
+
+    def __init__(self, handlers):
+        self.handlers = handlers
+        self.text = ""
+        self.open = False
+        self._held = []
+
+    def _forward(self, event, args, kwargs):
+        for handler in self.handlers:
+            getattr(handler, event)(*args, **kwargs)
+
+    def _hold(self, event, *args, **kwargs):
+        if self.open:
+            self._forward(event, args, kwargs)
+        else:
+            self._held.append((event, args, kwargs))
+
+    def release(self):
+        """Pass on everything held back"""
+        self.open = True
+        for event, args, kwargs in self._held:
+            self._forward(event, args, kwargs)
+        self._held = []
+
+    def on_llm_new_token(self, token, **kwargs):
+        self._hold("on_llm_new_token", token, **kwargs)
+        if not self.open:
+            self.text += token
+            head = self.text.lstrip()
+            if head and not ESCALATE_TOKEN.startswith(head[:len(ESCALATE_TOKEN)]):
+                self.release()
+
+    def on_llm_end(self, response, **kwargs):
+        self._hold("on_llm_end", response, **kwargs)
+
+
+def escalation_requested(answer):
+    """Self-check on the small model's answer"""
+    answer = answer.strip()
+    return not answer or answer.startswith(ESCALATE_TOKEN)
+
+
+def _gated(callbacks):
+    """Copy of a callback manager whose streaming handlers sit behind a gate"""
+    if callbacks is None:
+        return None, None
+    streaming = [handler for handler in callbacks.handlers if _streams_tokens(handler)]
+    gate = EscalationGate(streaming)
+    handlers = [handler for handler in callbacks.handlers if handler not in streaming] + [gate]
+    inheritable = [handler for handler in callbacks.inheritable_handlers if handler not in streaming] + [gate]
+    gated = callbacks.__class__(
+        handlers,
+        inheritable,
+        callbacks.parent_run_id,
+        tags=list(callbacks.tags),
+        inheritable_tags=list(callbacks.inheritable_tags),
+        metadata=dict(callbacks.metadata),
+        inheritable_metadata=dict(callbacks.inheritable_metadata)
+    )
+    return gate, gated
+
+
+class ModelCascade(BaseCombineDocumentsChain):
+    """Combine-docs chain that picks the small or large answer chain per turn
+
+    `small` and `large` are stuff chains over the same documents. With
+    `self_check`, the small chain's prompt lets it reply `ESCALATE_TOKEN`
+    when the context isn't enough, and the turn is re-run on `large`.
+    """
+
+    small: BaseCombineDocumentsChain
+    large: BaseCombineDocumentsChain
+    policy: Any
+    self_check: bool = True
+
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _counts: Any = PrivateAttr(default_factory=lambda: {SMALL: 0, LARGE: 0, "escalated": 0})
+
+    def _record(self, tier, reason):
+        with self._lock:
+            self._counts[tier] += 1
+            if reason == "self-check":
+                self._counts["escalated"] += 1
+        logger.info("cascade model=%s reason=%s", tier, reason)
+
+    def _accept(self, answer, gate):
+        if self.self_check and escalation_requested(answer):
+            return False
+        if gate is not None:
+            gate.release()
+        return True
+
+    def combine_docs(self, docs, callbacks=None, **kwargs):
+        tier, reason = self.policy.choose(kwargs.get("question", ""), docs)
+        if tier == SMALL:
+            gate, gated = _gated(callbacks) if self.self_check else (None, callbacks)
+            answer, extra = self.small.combine_docs(docs, callbacks=gated, **kwargs)
+            if self._accept(answer, gate):
+                self._record(SMALL, reason)
+                return answer, extra
+            reason = "self-check"
+        self._record(LARGE, reason)
+        return self.large.combine_docs(docs, callbacks=callbacks, **kwargs)
+
+    async def acombine_docs(self, docs, callbacks=None, **kwargs):
+        tier, reason = self.policy.choose(kwargs.get("question", ""), docs)
+        if tier == SMALL:
+            gate, gated = _gated(callbacks) if self.self_check else (None, callbacks)
+            answer, extra = await self.small.acombine_docs(docs, callbacks=gated, **kwargs)
+            if self._accept(answer, gate):
+                self._record(SMALL, reason)
+                return answer, extra
+            reason = "self-check"
+        self._record(LARGE, reason)
+        return await self.large.acombine_docs(docs, callbacks=callbacks, **kwargs)
+
+    @property
+    def _chain_type(self):
+        return "model_cascade"
+
+    def stats(self):
+        """Turns answered by each model and how many the small one handed up"""
+        with self._lock:
+            counts = dict(self._counts)
+        total = counts[SMALL] + counts[LARGE]
+        counts["small_rate"] = counts[SMALL] / total if total else 0.0
+        return counts
@@ -0,0 +1,75 @@
+"""Rendering of the chat transcript in the Streamlit app"""
+import html
+import logging
+import re
+import time
+from functools import lru_cache
+
+import streamlit as st
+
+logger = logging.getLogger(__name__)
+
+SPEAKERS = {"user": ("user-message", "You"), "assistant": ("bot-message", "TEQ3AI")}
+
+# Render timings kept per browser session
+RENDER_HISTORY = 50
+
+# Fenced blocks (possibly still open while streaming) and code spans, which markdown shows verbatim
+CODE = re.compile(r"(```.*?(?:```|$)|`[^`\n]*`)", re.DOTALL)
+AUTOLINK = re.compile(r"<(https?://[^\s<>]+)>")
+SOFT_BREAK = re.compile(r"(?<!\n)\n(?!\n)")
+
+
+def sanitize_markdown(text):
+    """Markdown with raw HTML neutralized; lists, emphasis, links and code still render"""
+    parts = CODE.split(text)
+    # Even parts are prose; "<" there could open a tag, so it becomes text,
+    # and single line breaks are kept as hard breaks
+    for i in range(0, len(parts), 2):
+        prose = AUTOLINK.sub(r"\1", parts[i]).replace("<", "&lt;")
+        parts[i] = SOFT_BREAK.sub("  \n", prose)
+    text = "".join(parts)
+    if text.count("```") % 2:
+        # Close a fence that is still streaming, or it would swallow the closing </div>
+        text += "\n```"
+    return text
+
+
+def bubble_html(role, content):
+    """HTML for a chat bubble
+
+    The assistant's markdown is sanitized and left for Streamlit to render:
+    the blank lines around it end the HTML block, so it is parsed as
+    markdown inside the bubble. What the user typed is shown as plain text.
+    """
+    css_class, speaker = SPEAKERS[role]
+    if role == "assistant":
+        return f'<div class="{css_class}"><strong>{speaker}:</strong>\n\n{sanitize_markdown(content)}\n\n</div>'
+    body = html.escape(content).replace("\n", "<br>")
+    return f'<div class="{css_class}"><strong>{speaker}:</strong> {body}</div>'
+
+
+@lru_cache(maxsize=4096)
+def message_html(role, content):
+    """`bubble_html` of a finished message; computed once per message"""
+    return bubble_html(role, content)
+
+
+def render_message(message, container=st):
+    container.markdown(message_html(message["role"], message["content"]), unsafe_allow_html=True)
+
+
+def visible_messages(messages, limit):
+    """The last `limit` messages, and how many earlier ones are hidden"""
+    hidden = max(len(messages) - limit, 0)
+    return messages[hidden:], hidden
+
+
+def record_render(scope, started, message_count):
+    """Log how long a rerun took to render and keep it in the session"""
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    logger.info("render scope=%s messages=%d %.1f ms", scope, message_count, elapsed_ms)
+    timings = st.session_state.setdefault("render_times", [])
+    timings.append({"scope": scope, "ms": elapsed_ms, "messages": message_count})
+    del timings[:-RENDER_HISTORY]
+    return elapsed_ms
@@ -0,0 +1,349 @@
+"""CareerGPT chatbot, shared by every chat session"""
+import asyncio
+import contextvars
+import functools
+import logging
+import threading
+import time
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+from langchain.chains import ConversationalRetrievalChain
+from langchain.chains.conversational_retrieval.prompts import CONDENSE_QUESTION_PROMPT
+from langchain.chains.question_answering import load_qa_chain
+from langchain.chat_models import ChatOpenAI
+
+from answer_cache import SemanticAnswerCache
+from cascade import CascadePolicy, ModelCascade
+from context_packing import ContextPacker, PackedRetriever
+from history import HistoryManager
+from embedding_backends import make_embeddings
+from engine import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, RequestEngine, limited_chat_model
+from ingest import build_index
+from prompts import CASCADE_CHAT_PROMPT, CHAT_PROMPT, PromptCacheReporter
+from question_rewriter import QuestionRewriter
+from refresher import IndexRefresher
+from retrieval import HybridRetriever
+from retrieval_service import RemoteEmbeddings, RemoteRetriever, make_client
+from sessions import make_session_store
+from settings import (
+    ANSWER_CACHE_ENABLED, ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_TTL,
+    CASCADE_ENABLED, CASCADE_MAX_QUESTION_WORDS, CASCADE_MIN_TERM_COVERAGE, CASCADE_SELF_CHECK, CASCADE_SMALL_MODEL,
+    CONTEXT_MAX_K, CONTEXT_TOKEN_BUDGET, ENGINE_ENABLED, ENGINE_WORKERS,
+    HISTORY_KEEP_TURNS, HISTORY_MAX_TOKENS, OPENAI_API_BASE, OPENAI_BACKOFF,
+    OPENAI_MAX_CONCURRENCY, OPENAI_RETRIES, OPENAI_RPM, OPENAI_TPM, REFRESH_INTERVAL, RERANKER_ENABLED,
+    RETRIEVAL_SERVICE_ADDRESS, SUMMARY_MODEL
+)
+from streaming import AsyncReplyStream, ReplyStream
+from tracing import METRICS, StageTracer, cache_result, stage, turn
+
+logger = logging.getLogger(__name__)
+
+
+def _log_compact_failure(future):
+    # A reset cancels the session's pending fold along with its turns
+    if not future.cancelled() and not isinstance(future.exception(), (type(None), CancelledError)):
+        logger.error("history summary failed", exc_info=future.exception())
+
+
+class CareerBot:
+    """Shared, immutable chain plus per-session history
+
+    One instance serves every session: the chain holds no memory, and each
+    session's history is loaded from the session store for every turn.
+    A turn is saved as soon as it is answered; folding old turns into the
+    summary takes another LLM call, so it runs after the reply, in the
+    background, and its result is stored when it completes.
+    """
+
+    def __init__(self, chain, history, sessions, answer_cache=None, engine=None, max_workers=8):
+        self.chain = chain
+        self.history = history
+        self.sessions = sessions
+        self.answer_cache = answer_cache
+        self.engine = engine
+        self.refresher = None
+        self._lock = threading.Lock()
+        self._history_lock = threading.Lock()
+        self._model_usage = {}
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="careerbot")
+
+    def _cached_answer(self, state, question):
+        """(cached answer or None, cache key) for a session's opening question"""
+        # Opening questions don't depend on any history, so they can be shared
+        if self.answer_cache is None or state["turns"] or state["summary"]:
+            return None, None
+        with stage("answer_cache"):
+            cached, cache_key = self.answer_cache.lookup(question)
+        cache_result("answer", cached is not None)
+        if cached is not None:
+            logger.info("answer cache hit %s", self.answer_cache.stats())
+        return cached, cache_key
+
+    def _finish(self, cache_key, answer, start, prompt_cache):
+        elapsed = time.perf_counter() - start
+        report = prompt_cache.report
+        if report:
+            logger.info("answer model=%(model)s prompt tokens %(prompt_tokens)d: %(cached_tokens)s cached, "
+                        "%(cacheable_tokens)d cacheable (%(source)s, %(prompt_version)s)", report)
+            with self._lock:
+                usage = self._model_usage.setdefault(report["model"], {"turns": 0, "seconds": 0.0, "prompt_tokens": 0})
+                usage["turns"] += 1
+                usage["seconds"] += elapsed
+                usage["prompt_tokens"] += report["prompt_tokens"]
+            METRICS.inc("teq3_prompt_cacheable_tokens_total", report["cacheable_tokens"], model=report["model"])
+            # Only what the provider reported; streamed answers don't say
+            if report["cached_tokens"] is not None:
+                METRICS.inc("teq3_prompt_cached_tokens_total", report["cached_tokens"], model=report["model"])
+        if cache_key is not None:
+            self.answer_cache.store(cache_key, answer, elapsed)
+
+    def _save_turn(self, session_id, state, question, answer):
+        with stage("history"):
+            with self._history_lock:
+                state = self.history.append_turn(state, question, answer)
+                self.sessions.save(session_id, state)
+        if self.history.needs_compacting(state):
+            if self.engine is not None:
+                future = self.engine.submit(session_id, lambda: self._acompact(session_id, state), PRIORITY_BACKGROUND)
+            else:
+                future = self.executor.submit(self._compact, session_id, state)
+            future.add_done_callback(_log_compact_failure)
+
+    def _compact(self, session_id, state):
+        self._store_compacted(session_id, state, self.history.compact(state))
+
+    async def _acompact(self, session_id, state):
+        self._store_compacted(session_id, state, await self.history.acompact(state))
+
+    def _store_compacted(self, session_id, before, compacted):
+        # Turns saved while the summary was being written are kept
+        with self._history_lock:
+            state = self.history.rebase(compacted, before, self.sessions.get(session_id))
+            if state is not None:
+                self.sessions.save(session_id, state)
+
+    def reply(self, session_id, question, callbacks=None):
+        """Answer a question in the context of the session's conversation"""
+        with turn(session_id) as trace:
+            state = self.sessions.get(session_id)
+            cached, cache_key = self._cached_answer(state, question)
+            if cached is not None:
+                self._save_turn(session_id, state, question, cached)
+                return cached
+
+            start = time.perf_counter()
+            inputs = {"question": question, "chat_history": self.history.chat_history(state)}
+            prompt_cache = PromptCacheReporter()
+            handlers = list(callbacks or []) + [prompt_cache, StageTracer(trace)]
+            answer = self.chain(inputs, callbacks=handlers)["answer"]
+            self._finish(cache_key, answer, start, prompt_cache)
+            self._save_turn(session_id, state, question, answer)
+            return answer
+
+    async def areply(self, session_id, question, callbacks=None):
+        """Async `reply`; LLM calls go through the request engine's limiter"""
+        loop = asyncio.get_running_loop()
+        with turn(session_id) as trace:
+            state = self.sessions.get(session_id)
+            # The cache lookup embeds the question with a blocking client
+            context = contextvars.copy_context()
+            cached, cache_key = await loop.run_in_executor(
+                self.executor, context.run, self._cached_answer, state, question
+            )
+            if cached is not None:
+                self._save_turn(session_id, state, question, cached)
+                return cached
+
+            start = time.perf_counter()
+            inputs = {"question": question, "chat_history": self.history.chat_history(state)}
+            prompt_cache = PromptCacheReporter()
+            handlers = list(callbacks or []) + [prompt_cache, StageTracer(trace)]
+            answer = (await self.chain.acall(inputs, callbacks=handlers))["answer"]
+            self._finish(cache_key, answer, start, prompt_cache)
+            self._save_turn(session_id, state, question, answer)
+            return answer
+
+    def stats(self):
+        """Counters from the caches and shortcuts in front of the LLM"""
+        stats = {
+            "question_rewriter": self.chain.question_generator.stats(),
+            "retriever": self.chain.retriever.stats()
+        }
+        if self.answer_cache is not None:
+            stats["answer_cache"] = self.answer_cache.stats()
+        if self.engine is not None:
+            stats["engine"] = self.engine.stats()
+        if isinstance(self.chain.combine_docs_chain, ModelCascade):
+            stats["cascade"] = self.chain.combine_docs_chain.stats()
+        with self._lock:
+            stats["models"] = {
+                model: dict(usage, mean_seconds=usage["seconds"] / usage["turns"])
+                for model, usage in self._model_usage.items()
+            }
+        return stats
+
+    @property
+    def vectorstore(self):
+        """The index the live retriever searches"""
+        return self.chain.retriever.vectorstore
+
+    def swap_index(self, vectorstore, index_version):
+        """Atomically point retrieval at a newly built index
+
+        The new retriever (including its BM25 index) is fully built before
+        the single assignment that publishes it, so a turn sees either the
+        old index or the new one, never a mix.
+        """
+        self.chain.retriever = self.chain.retriever.with_vectorstore(vectorstore)
+        self.index_rebuilt(index_version)
+
+    def index_rebuilt(self, index_version):
+        """Cached answers were grounded in the old index, so drop them"""
+        if self.answer_cache is not None:
+            self.answer_cache.invalidate(index_version)
+
+    def _submitter(self, session_id, question, priority):
+        if self.engine is not None:
+            return lambda callbacks: self.engine.submit(
+                session_id, lambda: self.areply(session_id, question, callbacks), priority
+            )
+        return lambda callbacks: self.executor.submit(self.reply, session_id, question, callbacks)
+
+    def stream_reply(self, session_id, question, priority=PRIORITY_INTERACTIVE):
+        """Run the turn in the background and stream the answer's tokens"""
+        return ReplyStream(self._submitter(session_id, question, priority))
+
+    def astream_reply(self, session_id, question, priority=PRIORITY_INTERACTIVE):
+        """`stream_reply` for asyncio callers; iterate with `async for`"""
+        return AsyncReplyStream(self._submitter(session_id, question, priority))
+
+    def cancel(self, session_id):
+        """Cancel a session's queued and running turns; turns on the thread pool run to the end"""
+        if self.engine is not None:
+            self.engine.cancel(session_id)
+
+    def reset(self, session_id):
+        """Forget a session's conversation, cancelling any turn still in progress"""
+        self.cancel(session_id)
+        self.sessions.clear(session_id)
+
+
+def build_bot(api_key, embeddings=None, chat_model=None):
+    """Build the shared chatbot, returning it with any urls that failed to load
+
+    `embeddings` and `chat_model` (called like `ChatOpenAI`) replace the
+    OpenAI models, e.g. with the benchmark's fakes. With a retrieval
+    service configured, the index and embedding model stay in its worker
+    pool and this process only holds a client.
+    """
+    client = None
+    if RETRIEVAL_SERVICE_ADDRESS:
+        client = make_client()
+        if embeddings is None:
+            embeddings = RemoteEmbeddings(client)
+        retriever = RemoteRetriever(client=client)
+        failed = client.call("status")["failed"]
+    else:
+        # Load the index snapshot, crawling and embedding only when it is stale
+        if embeddings is None:
+            embeddings = make_embeddings(api_key)
+        vectorstore, failed = build_index(embeddings)
+        retriever = HybridRetriever(vectorstore=vectorstore, k=CONTEXT_MAX_K, use_reranker=RERANKER_ENABLED)
+
+    # Turns run on the async request engine, which rate-limits every LLM call
+    engine = None
+    make_llm = ChatOpenAI
+    if ENGINE_ENABLED:
+        engine = RequestEngine(
+            workers=ENGINE_WORKERS,
+            max_concurrency=OPENAI_MAX_CONCURRENCY,
+            rpm=OPENAI_RPM,
+            tpm=OPENAI_TPM
+        )
+        make_llm = functools.partial(limited_chat_model, engine.limiter, OPENAI_RETRIES, OPENAI_BACKOFF)
+    if chat_model is not None:
+        make_llm = chat_model
+
+    # Initialize LLM; only the answer is streamed, the condensed question isn't shown
+    llm = make_llm(
+        model_name="gpt-4-turbo-preview",
+        temperature=0.7,
+        max_tokens=600,
+        streaming=True,
+        openai_api_key=api_key,
+        openai_api_base=OPENAI_API_BASE
+    )
+    condense_llm = make_llm(
+        model_name="gpt-4-turbo-preview",
+        temperature=0,
+        max_tokens=200,
+        openai_api_key=api_key,
+        openai_api_base=OPENAI_API_BASE
+    )
+
+    # Simple turns go to a small model first; the large one takes the rest
+    answer_chain = load_qa_chain(llm, chain_type="stuff", prompt=CHAT_PROMPT)
+    if CASCADE_ENABLED:
+        small_llm = make_llm(
+            model_name=CASCADE_SMALL_MODEL,
+            temperature=0.7,
+            max_tokens=600,
+            streaming=True,
+            openai_api_key=api_key,
+            openai_api_base=OPENAI_API_BASE
+        )
+        small_prompt = CASCADE_CHAT_PROMPT if CASCADE_SELF_CHECK else CHAT_PROMPT
+        answer_chain = ModelCascade(
+            small=load_qa_chain(small_llm, chain_type="stuff", prompt=small_prompt),
+            large=answer_chain,
+            policy=CascadePolicy(
+                max_question_words=CASCADE_MAX_QUESTION_WORDS,
+                min_term_coverage=CASCADE_MIN_TERM_COVERAGE
+            ),
+            self_check=CASCADE_SELF_CHECK
+        )
+
+    # Follow-ups are only sent to the LLM for condensing when they refer back
+    chain = ConversationalRetrievalChain(
+        retriever=PackedRetriever(
+            base=retriever,
+            packer=ContextPacker(token_budget=CONTEXT_TOKEN_BUDGET, max_k=CONTEXT_MAX_K)
+        ),
+        combine_docs_chain=answer_chain,
+        question_generator=QuestionRewriter(llm=condense_llm, prompt=CONDENSE_QUESTION_PROMPT),
+        return_source_documents=False,
+        verbose=False
+    )
+
+    # A small, cheap model is plenty for folding old turns into a summary
+    summary_llm = make_llm(
+        model_name=SUMMARY_MODEL,
+        temperature=0,
+        max_tokens=300,
+        openai_api_key=api_key,
+        openai_api_base=OPENAI_API_BASE
+    )
+    history = HistoryManager(
+        summary_llm,
+        keep_turns=HISTORY_KEEP_TURNS,
+        max_tokens=HISTORY_MAX_TOKENS
+    )
+
+    answer_cache = None
+    if ANSWER_CACHE_ENABLED:
+        answer_cache = SemanticAnswerCache(
+            embeddings,
+            threshold=ANSWER_CACHE_THRESHOLD,
+            ttl=ANSWER_CACHE_TTL,
+            max_entries=ANSWER_CACHE_MAX_ENTRIES
+        )
+    bot = CareerBot(chain, history, make_session_store(), answer_cache, engine)
+
+    if client is not None:
+        # The service refreshes the index; answers cached from the old one are dropped when it does
+        client.on_index_change = bot.index_rebuilt
+    elif REFRESH_INTERVAL > 0:
+        # Pick up site changes in the background instead of on the next cold start
+        bot.refresher = IndexRefresher(bot, embeddings, REFRESH_INTERVAL)
+        bot.refresher.start()
+    return bot, failed
@@ -0,0 +1,196 @@
+"""Structure-aware chunking of HTML pages with boilerplate deduplication"""
+import hashlib
+import re
+
+import tiktoken
+from bs4 import BeautifulSoup
+from langchain.docstore.document import Document
+
+# Elements that are site chrome rather than page content
+BOILERPLATE_TAGS = ["script", "style", "noscript", "svg", "nav", "header", "footer", "aside", "form", "iframe"]
+BOILERPLATE_PATTERN = re.compile(r"(^|[-_\s])(nav|menu|footer|header|cookie|banner|sidebar|breadcrumb)", re.I)
+HEADING_TAGS = ["h1", "h2", "h3"]
+BLOCK_TAGS = ["h1", "h2", "h3", "h4", "h5", "h6", "p", "li", "td", "th", "blockquote", "pre", "dt", "dd"]
+
+WHITESPACE_PATTERN = re.compile(r"\s+")
+SHINGLE_PATTERN = re.compile(r"\w+")
+
+
+def _is_boilerplate(tag):
+    if tag.name in BOILERPLATE_TAGS:
+        return True
+    attrs = getattr(tag, "attrs", None) or {}
+    marker = " ".join(attrs.get("class", [])) + " " + (attrs.get("id") or "") + " " + (attrs.get("role") or "")
+    return bool(BOILERPLATE_PATTERN.search(marker))
+
+
+def _parse(html):
+    """Page title and main-content root with site chrome removed"""
+    soup = BeautifulSoup(html, "html.parser")
+    title = soup.title.get_text().strip() if soup.title else None
+    for tag in soup.find_all(_is_boilerplate):
+        tag.decompose()
+    return title, soup.find("main") or soup.find("article") or soup.body or soup
+
+
+def _sections(root):
+    """Block-level text grouped under the nearest preceding h1-h3"""
+    sections = []
+    heading, lines = "", []
+    for block in root.find_all(BLOCK_TAGS):
+        # Nested blocks (p inside li) would otherwise be emitted twice
+        if block.find_parent(BLOCK_TAGS):
+            continue
+        text = WHITESPACE_PATTERN.sub(" ", block.get_text(" ")).strip()
+        if not text:
+            continue
+        if block.name in HEADING_TAGS:
+            if lines:
+                sections.append((heading, "\n".join(lines)))
+            heading, lines = text, []
+        else:
+            lines.append(text)
+    if lines:
+        sections.append((heading, "\n".join(lines)))
+
+    # Page builders often put text straight into divs with no block tags
+    if not sections:
+        lines = (WHITESPACE_PATTERN.sub(" ", line).strip() for line in root.get_text("\n").splitlines())
+        text = "\n".join(line for line in lines if line)
+        if text:
+            sections.append(("", text))
+    return sections
+
+
+def extract_sections(html):
+    """Main-content text of a page, grouped as (heading, text) sections"""
+    return _sections(_parse(html)[1])
+
+
+def page_text(html):
+    """Main-content text of a page, for change detection"""
+    return "\n\n".join(f"{heading}\n{text}" for heading, text in extract_sections(html))
+
+
+def simhash(text, bits=64):
+    """64-bit SimHash over word 3-shingles"""
+    words = SHINGLE_PATTERN.findall(text.lower())
+    shingles = [" ".join(words[i:i + 3]) for i in range(max(len(words) - 2, 1))]
+    weights = [0] * bits
+    for shingle in shingles:
+        value = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(bits):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit in range(bits) if weights[bit] > 0)
+
+
+class DuplicateFilter:
+    """Remembers chunk texts and tells whether a new one repeats any of them
+
+    Near-duplicates are found without comparing against every earlier
+    fingerprint: the 64 bits are cut into `max_bits + 1` bands, and two
+    fingerprints within `max_bits` bits of each other must agree exactly
+    on at least one band, so only fingerprints sharing a band are compared.
+    Texts under `min_words` words only match exactly: a few bits are too
+    little tolerance to tell apart short, templated chunks ("Duration: 12
+    weeks" and "Duration: 16 weeks").
+    """
+
+    def __init__(self, max_bits=3, bits=64, min_words=32):
+        self.max_bits = max_bits
+        self.min_words = min_words
+        bands = max_bits + 1
+        edges = [bits * i // bands for i in range(bands + 1)]
+        self._bands = [(start, (1 << end - start) - 1) for start, end in zip(edges, edges[1:])]
+        self._exact = set()
+        self._buckets = [{} for _ in self._bands]
+
+    def __len__(self):
+        return len(self._exact)
+
+    def is_new(self, text):
+        """True the first time a text (or a near-duplicate of it) is seen"""
+        normalized = WHITESPACE_PATTERN.sub(" ", text.lower()).strip()
+        digest = hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+        if digest in self._exact:
+            return False
+        if len(SHINGLE_PATTERN.findall(normalized)) < self.min_words:
+            self._exact.add(digest)
+            return True
+        fingerprint = simhash(normalized)
+        keys = [fingerprint >> start & mask for start, mask in self._bands]
+        for buckets, key in zip(self._buckets, keys):
+            for other in buckets.get(key, ()):
+                if bin(fingerprint ^ other).count("1") <= self.max_bits:
+                    return False
+        self._exact.add(digest)
+        for buckets, key in zip(self._buckets, keys):
+            buckets.setdefault(key, []).append(fingerprint)
+        return True
+
+
+class StructuredChunker:
+    """Split pages on headings into token-sized chunks and drop duplicates
+
+    Sections are packed into chunks of at most `chunk_tokens` tokens
+    (counted with tiktoken), each prefixed with its heading for context.
+    Chunks whose text repeats across pages, exactly or within
+    `near_duplicate_bits` SimHash bits, are kept only once; chunks under
+    `near_duplicate_min_words` words only count if repeated exactly.
+    """
+
+    def __init__(self, chunk_tokens=300, overlap_tokens=30, near_duplicate_bits=3, model_name="gpt-4",
+                 near_duplicate_min_words=32):
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = overlap_tokens
+        self.near_duplicate_bits = near_duplicate_bits
+        self.near_duplicate_min_words = near_duplicate_min_words
+        self.encoding = tiktoken.encoding_for_model(model_name)
+
+    def _split_section(self, heading, text):
+        prefix = f"{heading}\n" if heading else ""
+        budget = self.chunk_tokens - len(self.encoding.encode(prefix))
+        tokens = self.encoding.encode(text)
+        if len(tokens) <= budget:
+            return [prefix + text]
+        chunks = []
+        step = max(budget - self.overlap_tokens, 1)
+        for start in range(0, len(tokens), step):
+            chunks.append(prefix + self.encoding.decode(tokens[start:start + budget]).strip())
+            if start + budget >= len(tokens):
+                break
+        return chunks
+
+    def split_page(self, url, html):
+        """Chunks of one page as documents"""
+        title, root = _parse(html)
+        metadata = {"source": url}
+        if title:
+            metadata["title"] = title
+        documents = []
+        for heading, text in _sections(root):
+            for chunk in self._split_section(heading, text):
+                documents.append(Document(page_content=chunk, metadata=dict(metadata, section=heading)))
+        return documents
+
+    def duplicate_filter(self, existing=()):
+        """A `DuplicateFilter` that has already seen the texts in `existing`"""
+        seen = DuplicateFilter(self.near_duplicate_bits, min_words=self.near_duplicate_min_words)
+        for text in existing:
+            seen.is_new(text)
+        return seen
+
+    def deduplicate(self, documents, existing=()):
+        """Drop exact and near-duplicate chunks, keeping the first occurrence
+
+        Texts in `existing` (chunks already indexed) count as seen.
+        """
+        seen = self.duplicate_filter(existing)
+        return [doc for doc in documents if seen.is_new(doc.page_content)]
+
+    def split_pages(self, pages, existing=()):
+        """Chunk (url, html) pages and deduplicate across all of them"""
+        documents = []
+        for url, html in pages:
+            documents.extend(self.split_page(url, html))
+        return self.deduplicate(documents, existing)
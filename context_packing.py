@@ -0,0 +1,154 @@
+"""Fit retrieved chunks into a token budget before they are stuffed into the prompt"""
+import logging
+import threading
+from typing import Any
+
+import tiktoken
+from langchain.docstore.document import Document
+from langchain.pydantic_v1 import PrivateAttr
+from langchain.schema import BaseRetriever
+
+from tracing import stage
+
+logger = logging.getLogger(__name__)
+
+
+def _split_heading(doc):
+    """(heading line, body) of a chunk produced by the structured chunker"""
+    section = doc.metadata.get("section")
+    if section and doc.page_content.startswith(section + "\n"):
+        return section + "\n", doc.page_content[len(section) + 1:]
+    return "", doc.page_content
+
+
+def _overlap(earlier, later, min_overlap):
+    """Length of the longest suffix of `earlier` that is a prefix of `later`"""
+    if len(later) < min_overlap:
+        return 0
+    probe = later[:min_overlap]
+    start = earlier.find(probe)
+    while start != -1:
+        if later.startswith(earlier[start:]):
+            return len(earlier) - start
+        start = earlier.find(probe, start + 1)
+    return 0
+
+
+class ContextPacker:
+    """Choose, de-overlap and trim retrieved chunks to a token budget
+
+    k adapts to the score distribution: chunks scoring below
+    `relative_cutoff` of the best one are dropped (keeping at least `min_k`).
+    Text repeated from the splitter's overlap is cut from later chunks, and
+    chunks are added in rank order until `token_budget` is used up, the last
+    one truncated if at least `min_tail_tokens` still fit.
+    """
+
+    def __init__(self, token_budget=1200, min_k=2, max_k=8, relative_cutoff=0.5,
+                 min_overlap_chars=40, min_tail_tokens=60, model_name="gpt-4"):
+        self.token_budget = token_budget
+        self.min_k = min_k
+        self.max_k = max_k
+        self.relative_cutoff = relative_cutoff
+        self.min_overlap_chars = min_overlap_chars
+        self.min_tail_tokens = min_tail_tokens
+        self.encoding = tiktoken.encoding_for_model(model_name)
+
+    def _select(self, documents):
+        documents = documents[:self.max_k]
+        if not documents:
+            return []
+        top = documents[0].metadata.get("retrieval_score", 1.0) or 1.0
+        selected = []
+        for doc in documents:
+            score = doc.metadata.get("retrieval_score", top)
+            if len(selected) >= self.min_k and score < self.relative_cutoff * top:
+                break
+            selected.append(doc)
+        return selected
+
+    def _dedupe(self, documents):
+        kept = []
+        for doc in documents:
+            heading, body = _split_heading(doc)
+            contained = False
+            for earlier in kept:
+                if body in earlier.page_content:
+                    contained = True
+                    break
+                if earlier.metadata.get("source") == doc.metadata.get("source"):
+                    cut = _overlap(_split_heading(earlier)[1], body, self.min_overlap_chars)
+                    body = body[cut:]
+            if contained or not body.strip():
+                continue
+            kept.append(Document(page_content=heading + body.lstrip(), metadata=doc.metadata))
+        return kept
+
+    def pack(self, documents):
+        """Return (packed documents, tokens before packing, tokens after)"""
+        tokens_before = sum(len(self.encoding.encode(doc.page_content)) for doc in documents)
+        packed = []
+        remaining = self.token_budget
+        for doc in self._dedupe(self._select(documents)):
+            tokens = self.encoding.encode(doc.page_content)
+            if len(tokens) <= remaining:
+                packed.append(doc)
+                remaining -= len(tokens)
+                continue
+            if remaining >= self.min_tail_tokens:
+                text = self.encoding.decode(tokens[:remaining])
+                packed.append(Document(page_content=text, metadata=doc.metadata))
+                remaining = 0
+            break
+        return packed, tokens_before, self.token_budget - remaining
+
+
+class PackedRetriever(BaseRetriever):
+    """Retriever wrapper that hands the combine step a packed context"""
+
+    base: Any
+    packer: Any
+
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _counts: Any = PrivateAttr(default_factory=lambda: {"requests": 0, "tokens_retrieved": 0, "tokens_saved": 0})
+
+    @property
+    def vectorstore(self):
+        return self.base.vectorstore
+
+    def with_vectorstore(self, vectorstore):
+        """Same packing over a retriever for a different index"""
+        retriever = self.__class__(base=self.base.with_vectorstore(vectorstore), packer=self.packer)
+        retriever._lock = self._lock
+        retriever._counts = self._counts
+        return retriever
+
+    def _pack(self, documents):
+        with stage("pack"):
+            packed, tokens_before, tokens_after = self.packer.pack(documents)
+        saved = tokens_before - tokens_after
+        with self._lock:
+            self._counts["requests"] += 1
+            self._counts["tokens_retrieved"] += tokens_before
+            self._counts["tokens_saved"] += saved
+        logger.info("context packed %d -> %d chunks, %d -> %d tokens (saved %d)",
+                    len(documents), len(packed), tokens_before, tokens_after, saved)
+        return packed
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        documents = self.base.get_relevant_documents(
+            query, callbacks=run_manager.get_child() if run_manager else None
+        )
+        return self._pack(documents)
+
+    async def _aget_relevant_documents(self, query, *, run_manager=None):
+        documents = await self.base.aget_relevant_documents(
+            query, callbacks=run_manager.get_child() if run_manager else None
+        )
+        return self._pack(documents)
+
+    def stats(self):
+        """Retriever counters plus tokens saved by packing"""
+        with self._lock:
+            packing = dict(self._counts)
+        return dict(self.base.stats(), packing=packing)
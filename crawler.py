@@ -0,0 +1,193 @@
+"""Concurrent page fetcher for knowledge base ingestion"""
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+STATE_FILE = "state.json"
+
+
+@dataclass
+class FetchResult:
+    """Outcome of fetching one page"""
+    url: str
+    status: str
+    http_status: int = None
+    html: str = None
+    elapsed: float = 0.0
+    attempts: int = 0
+    error: str = None
+
+    @property
+    def ok(self):
+        return self.html is not None
+
+
+def fixture_name(url):
+    """File name a page is stored under in a fixture directory"""
+    path = urlparse(url).path.strip("/")
+    return (path.replace("/", "__") or "index") + ".html"
+
+
+class Crawler:
+    """Fetch pages concurrently over one pooled session
+
+    Validators (ETag/Last-Modified) and the last good body of every page are
+    kept in `state_dir`, so unchanged pages come back as cheap 304s. With
+    `fixture_dir` set, pages are read from local files instead of the network.
+    """
+
+    def __init__(self, max_workers=8, timeout=10, retries=3, backoff=0.5,
+                 state_dir=None, fixture_dir=None):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.state_dir = state_dir
+        self.fixture_dir = fixture_dir
+        self._lock = threading.Lock()
+        self._state = self._load_state()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["User-Agent"] = "TEQ3AI-CareerGPT/1.0"
+
+    def _load_state(self):
+        if not self.state_dir:
+            return {}
+        try:
+            with open(os.path.join(self.state_dir, STATE_FILE), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_state(self):
+        """Persist the validators collected so far"""
+        if not self.state_dir:
+            return
+        os.makedirs(self.state_dir, exist_ok=True)
+        tmp_path = os.path.join(self.state_dir, STATE_FILE + ".tmp")
+        with self._lock:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._state, f, indent=2)
+        os.replace(tmp_path, os.path.join(self.state_dir, STATE_FILE))
+
+    def _body_path(self, url):
+        return os.path.join(self.state_dir, hashlib.sha1(url.encode("utf-8")).hexdigest() + ".html")
+
+    def cached_body(self, url):
+        """Last good body fetched for a url, or None"""
+        if not self.state_dir:
+            return None
+        try:
+            with open(self._body_path(url), encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _remember(self, url, response):
+        os.makedirs(self.state_dir, exist_ok=True)
+        with open(self._body_path(url), "w", encoding="utf-8") as f:
+            f.write(response.text)
+        with self._lock:
+            self._state[url] = {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified")
+            }
+
+    def _conditional_headers(self, url):
+        with self._lock:
+            validators = self._state.get(url, {})
+        headers = {}
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+        return headers
+
+    def _fetch_fixture(self, url):
+        start = time.perf_counter()
+        try:
+            with open(os.path.join(self.fixture_dir, fixture_name(url)), encoding="utf-8") as f:
+                html = f.read()
+        except OSError as e:
+            # A page that was never recorded is as good as missing from the site
+            return FetchResult(url, "error", 404, elapsed=time.perf_counter() - start, attempts=1, error=str(e))
+        return FetchResult(url, "ok", 200, html, time.perf_counter() - start, 1)
+
+    def _fetch_remote(self, url):
+        start = time.perf_counter()
+        headers = self._conditional_headers(url) if self.state_dir else {}
+        error = None
+        http_status = None
+        for attempt in range(1, self.retries + 1):
+            try:
+                response = self.session.get(url, headers=headers, timeout=self.timeout)
+                http_status = response.status_code
+                if response.status_code == 304:
+                    html = self.cached_body(url)
+                    if html is not None:
+                        return FetchResult(url, "not_modified", 304, html, time.perf_counter() - start, attempt)
+                    # Lost the cached body, so ask for the full page again
+                    headers = {}
+                    error = "missing cached body for 304"
+                elif response.status_code in RETRY_STATUSES:
+                    error = f"HTTP {response.status_code}"
+                elif response.ok:
+                    if self.state_dir:
+                        self._remember(url, response)
+                    return FetchResult(url, "ok", response.status_code, response.text,
+                                       time.perf_counter() - start, attempt)
+                else:
+                    return FetchResult(url, "error", response.status_code, elapsed=time.perf_counter() - start,
+                                       attempts=attempt, error=f"HTTP {response.status_code}")
+            except requests.RequestException as e:
+                error = str(e)
+
+            if attempt < self.retries:
+                time.sleep(self.backoff * (2 ** (attempt - 1)) * (1 + random.random()))
+
+        return FetchResult(url, "error", http_status, elapsed=time.perf_counter() - start,
+                           attempts=self.retries, error=error)
+
+    def fetch(self, url):
+        """Fetch a single page"""
+        if self.fixture_dir:
+            result = self._fetch_fixture(url)
+        else:
+            result = self._fetch_remote(url)
+        logger.info("fetched %s status=%s http=%s attempts=%d elapsed=%.3fs",
+                    url, result.status, result.http_status, result.attempts, result.elapsed)
+        return result
+
+    def fetch_all(self, urls):
+        """Fetch all pages concurrently, returning results in url order"""
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            results = list(pool.map(self.fetch, urls))
+        self.save_state()
+        return results
+
+
+def format_report(results):
+    """One line per url with status and timing"""
+    lines = []
+    for result in results:
+        line = f"{result.status:<13} {result.elapsed * 1000:8.1f} ms  x{result.attempts}  {result.url}"
+        if result.error:
+            line += f"  ({result.error})"
+        lines.append(line)
+    return "\n".join(lines)
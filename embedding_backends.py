@@ -0,0 +1,85 @@
+"""Pluggable embedding backends selected by TEQ3_EMBEDDING_BACKEND"""
+from langchain.embeddings import OpenAIEmbeddings
+from langchain.embeddings.base import Embeddings
+
+from embedding_cache import CachedEmbeddings
+from settings import (
+    EMBEDDING_BACKEND, EMBEDDING_CACHE_PATH, EMBEDDING_MODEL, LOCAL_EMBEDDING_BATCH_SIZE,
+    LOCAL_EMBEDDING_QUANTIZE, LOCAL_EMBEDDING_THREADS, QUERY_EMBEDDING_CACHE_SIZE
+)
+
+
+class LocalEmbeddings(Embeddings):
+    """Sentence embeddings computed on CPU with a Hugging Face transformers model
+
+    Texts are encoded in batches with mean pooling over the attention mask.
+    `num_threads` sets torch's intra-op thread pool, and `quantize` applies
+    dynamic int8 quantization to the linear layers for faster CPU inference.
+    """
+
+    def __init__(self, model_name, batch_size=32, num_threads=None, quantize=False, max_length=512):
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        self.torch = torch
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self.num_threads = torch.get_num_threads()
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModel.from_pretrained(model_name)
+        model.eval()
+        if quantize:
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.model = model
+
+    def reopen(self):
+        """Start a fresh intra-op thread pool, e.g. in a process forked after the model was loaded"""
+        self.torch.set_num_threads(self.num_threads)
+
+    def _encode(self, texts):
+        torch = self.torch
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = self.tokenizer(
+                texts[start:start + self.batch_size],
+                padding=True,
+                truncation=True,
+                max_length=self.max_length,
+                return_tensors="pt"
+            )
+            with torch.inference_mode():
+                hidden = self.model(**batch).last_hidden_state
+            mask = batch["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+            pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+            pooled = torch.nn.functional.normalize(pooled, p=2, dim=1)
+            vectors.extend(pooled.tolist())
+        return vectors
+
+    def embed_documents(self, texts):
+        return self._encode(list(texts))
+
+    def embed_query(self, text):
+        return self._encode([text])[0]
+
+
+def make_embeddings(api_key=None):
+    """Configured embedding backend behind the persistent content-hash cache"""
+    if EMBEDDING_BACKEND == "local":
+        underlying = LocalEmbeddings(
+            EMBEDDING_MODEL,
+            batch_size=LOCAL_EMBEDDING_BATCH_SIZE,
+            num_threads=LOCAL_EMBEDDING_THREADS,
+            quantize=LOCAL_EMBEDDING_QUANTIZE
+        )
+    elif EMBEDDING_BACKEND == "openai":
+        underlying = OpenAIEmbeddings(model=EMBEDDING_MODEL, openai_api_key=api_key)
+    else:
+        raise ValueError(f"Unknown embedding backend: {EMBEDDING_BACKEND}")
+    return CachedEmbeddings(
+        underlying,
+        EMBEDDING_MODEL,
+        EMBEDDING_CACHE_PATH,
+        query_cache_size=QUERY_EMBEDDING_CACHE_SIZE
+    )
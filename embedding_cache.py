@@ -0,0 +1,132 @@
+"""Persistent content-hash cache in front of an embedding provider"""
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+from tracing import cache_result
+
+# SQLite caps the number of bound parameters per statement
+_LOOKUP_BATCH = 500
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only sends unseen chunk texts to the provider
+
+    Query embeddings are kept in a small in-process LRU instead, since most
+    queries are one-off but the same query is often embedded several times
+    per turn (answer cache, retrieval).
+    """
+
+    def __init__(self, underlying, model_name, path, batch_size=256, query_cache_size=1024):
+        self.underlying = underlying
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.query_cache_size = query_cache_size
+        self.hits = 0
+        self.misses = 0
+        self.query_hits = 0
+        self.query_misses = 0
+        self._queries = OrderedDict()
+        self.path = path
+        self.reopen()
+
+    def reopen(self):
+        """Open a fresh database connection, e.g. in a process forked from this one
+
+        SQLite connections must not be shared across a fork; the wrapped
+        model is, so forked workers don't each load their own copy. A
+        model with its own thread pool resets it here too.
+        """
+        if hasattr(self.underlying, "reopen"):
+            self.underlying.reopen()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+        self._conn.commit()
+
+    def _key(self, text):
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, keys):
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), _LOOKUP_BATCH):
+                batch = keys[start:start + _LOOKUP_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                )
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+
+    def _store(self, items):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in items]
+            )
+            self._conn.commit()
+
+    def embed_documents(self, texts):
+        """Embed texts, serving repeats from the cache and batching the misses"""
+        keys = [self._key(text) for text in texts]
+        cached = self._lookup(list(set(keys)))
+
+        # Deduplicate misses so identical chunks are only embedded once
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+
+        with self._lock:
+            self.hits += len(texts) - sum(1 for key in keys if key in missing)
+            self.misses += len(missing)
+
+        missing_items = list(missing.items())
+        for start in range(0, len(missing_items), self.batch_size):
+            batch = missing_items[start:start + self.batch_size]
+            vectors = self.underlying.embed_documents([text for _, text in batch])
+            new_items = [(key, vector) for (key, _), vector in zip(batch, vectors)]
+            self._store(new_items)
+            cached.update(new_items)
+
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text):
+        """Embed a query, reusing recent results"""
+        with self._lock:
+            vector = self._queries.get(text)
+            if vector is not None:
+                self._queries.move_to_end(text)
+                self.query_hits += 1
+            else:
+                self.query_misses += 1
+        cache_result("query_embedding", vector is not None)
+        if vector is not None:
+            return vector
+
+        vector = self.underlying.embed_query(text)
+        with self._lock:
+            self._queries[text] = vector
+            while len(self._queries) > self.query_cache_size:
+                self._queries.popitem(last=False)
+        return vector
+
+    def stats(self):
+        """Hit and miss counters since startup"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "query_hits": self.query_hits,
+                "query_misses": self.query_misses
+            }
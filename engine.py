@@ -0,0 +1,382 @@
+"""Async request engine: fair per-session scheduling and rate-limited OpenAI calls
+
+Turns from every chat session run as tasks on one event loop in a
+background thread. A fair queue decides which turn starts next, and every
+upstream chat completion goes through a shared limiter (concurrency,
+requests per minute, tokens per minute) with jittered retries.
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import CancelledError, Future
+
+import aiohttp
+import openai
+from langchain.chat_models import ChatOpenAI
+
+from tracing import count
+
+logger = logging.getLogger(__name__)
+
+# Lower runs first; chat turns a user is waiting on go ahead of background work
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+RETRY_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.ServiceUnavailableError,
+    openai.error.APIConnectionError,
+    openai.error.Timeout
+)
+
+
+def is_retryable(error):
+    """429s, 5xx and connection problems are worth retrying; other API errors aren't"""
+    if isinstance(error, openai.error.APIError):
+        return error.http_status is None or error.http_status >= 500
+    return isinstance(error, RETRY_ERRORS)
+
+
+def estimate_tokens(kwargs):
+    """Rough prompt plus completion tokens of a chat completion request"""
+    chars = sum(len(message.get("content") or "") for message in kwargs.get("messages", ()))
+    return chars // 4 + (kwargs.get("max_tokens") or 256)
+
+
+class TokenBucket:
+    """Continuously refilled budget of `per_minute` units
+
+    Not thread-safe; used only from the engine's event loop.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount):
+        """Seconds until `amount` is available"""
+        self._refill()
+        # Requests larger than the whole bucket wait for a full bucket
+        amount = min(amount, self.capacity)
+        return max(amount - self.level, 0.0) / self.rate
+
+    def take(self, amount):
+        self._refill()
+        self.level -= amount
+
+    def give(self, amount):
+        self._refill()
+        self.level = min(self.capacity, self.level + amount)
+
+    def drain(self):
+        self._refill()
+        self.level = min(self.level, 0.0)
+
+
+class RateLimiter:
+    """Concurrency cap plus requests-per-minute and tokens-per-minute buckets
+
+    A 429 from the provider drains both buckets and pauses new calls for
+    its Retry-After, so the limiter settles at what the account allows.
+    """
+
+    def __init__(self, max_concurrency=8, rpm=500, tpm=30000):
+        self.max_concurrency = max_concurrency
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.paused_until = 0.0
+        self._semaphore = None
+        self._counts = {"calls": 0, "throttled": 0, "wait_seconds": 0.0, "rate_limited": 0}
+
+    async def acquire(self, tokens):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        await self._semaphore.acquire()
+        start = time.monotonic()
+        try:
+            while True:
+                delay = max(self.requests.delay(1), self.tokens.delay(tokens), self.paused_until - time.monotonic())
+                if delay <= 0:
+                    break
+                await asyncio.sleep(delay)
+        except BaseException:
+            # Cancelled while throttled: the slot was never used
+            self._semaphore.release()
+            raise
+        self.requests.take(1)
+        self.tokens.take(tokens)
+        waited = time.monotonic() - start
+        self._counts["calls"] += 1
+        if waited > 0.001:
+            self._counts["throttled"] += 1
+            self._counts["wait_seconds"] += waited
+
+    def release(self, estimated=0, actual=None):
+        """Free the slot, crediting back tokens that were over-estimated"""
+        if actual is not None and actual < estimated:
+            self.tokens.give(estimated - actual)
+        self._semaphore.release()
+
+    def rate_limited(self, retry_after=None):
+        self._counts["rate_limited"] += 1
+        self.requests.drain()
+        self.tokens.drain()
+        if retry_after:
+            self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+
+    def stats(self):
+        return dict(self._counts)
+
+
+def _retry_after(error):
+    try:
+        return float((getattr(error, "headers", None) or {}).get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class LimitedChatCompletion:
+    """Drop-in for `openai.ChatCompletion` that rate-limits and retries calls
+
+    Async calls (the engine's) go through the limiter; a streamed response
+    keeps its slot until the stream is consumed. Sync calls only get the
+    retries. Errors are retried before any token is returned, never mid-stream.
+    """
+
+    def __init__(self, limiter, retries=4, backoff=0.5, client=openai.ChatCompletion):
+        self.limiter = limiter
+        # Always at least one attempt
+        self.retries = max(1, retries)
+        self.backoff = backoff
+        self.client = client
+
+    def _delay(self, attempt):
+        return self.backoff * (2 ** (attempt - 1)) * (1 + random.random())
+
+    def create(self, **kwargs):
+        for attempt in range(1, self.retries + 1):
+            try:
+                return self.client.create(**kwargs)
+            except Exception as e:
+                if attempt == self.retries or not is_retryable(e):
+                    raise
+                delay = self._delay(attempt)
+                logger.warning("chat completion failed (%s), retry %d in %.2fs", e, attempt, delay)
+                count("teq3_openai_retries_total", "retries", error=type(e).__name__)
+                time.sleep(delay)
+
+    async def acreate(self, **kwargs):
+        estimated = estimate_tokens(kwargs)
+        for attempt in range(1, self.retries + 1):
+            await self.limiter.acquire(estimated)
+            try:
+                response = await self.client.acreate(**kwargs)
+            except BaseException as e:
+                self.limiter.release()
+                if attempt == self.retries or not isinstance(e, Exception) or not is_retryable(e):
+                    raise
+                if isinstance(e, openai.error.RateLimitError):
+                    self.limiter.rate_limited(_retry_after(e))
+                delay = self._delay(attempt)
+                logger.warning("chat completion failed (%s), retry %d in %.2fs", e, attempt, delay)
+                count("teq3_openai_retries_total", "retries", error=type(e).__name__)
+                await asyncio.sleep(delay)
+                continue
+            if kwargs.get("stream"):
+                return self._hold(response)
+            usage = response.get("usage") or {}
+            self.limiter.release(estimated, usage.get("total_tokens"))
+            return response
+
+    async def _hold(self, stream):
+        try:
+            async for chunk in stream:
+                yield chunk
+        finally:
+            self.limiter.release()
+
+
+def limited_chat_model(limiter, retries=4, backoff=0.5, **kwargs):
+    """ChatOpenAI whose calls go through `limiter`, with the engine doing the retries"""
+    llm = ChatOpenAI(max_retries=1, **kwargs)
+    llm.client = LimitedChatCompletion(limiter, retries, backoff)
+    return llm
+
+
+class _Job:
+    __slots__ = ("session_id", "fn", "future")
+
+    def __init__(self, session_id, fn, future):
+        self.session_id = session_id
+        self.fn = fn
+        self.future = future
+
+
+class FairQueue:
+    """Round-robin over sessions within each priority level
+
+    One chatty session can't starve the others: each session gets one turn
+    started per round, and lower priority values always go first.
+    """
+
+    def __init__(self):
+        self._levels = {}
+        self._ready = asyncio.Event()
+
+    def __len__(self):
+        return sum(len(jobs) for level in self._levels.values() for jobs in level.values())
+
+    def put(self, job, priority=PRIORITY_INTERACTIVE):
+        level = self._levels.setdefault(priority, OrderedDict())
+        level.setdefault(job.session_id, deque()).append(job)
+        self._ready.set()
+
+    async def get(self):
+        while True:
+            for priority in sorted(self._levels):
+                level = self._levels[priority]
+                if not level:
+                    continue
+                session_id, jobs = next(iter(level.items()))
+                job = jobs.popleft()
+                if jobs:
+                    level.move_to_end(session_id)
+                else:
+                    del level[session_id]
+                return job
+            self._ready.clear()
+            await self._ready.wait()
+
+    def remove(self, session_id):
+        """Take a session's queued jobs out of the queue"""
+        removed = []
+        for level in self._levels.values():
+            removed.extend(level.pop(session_id, ()))
+        return removed
+
+
+class RequestEngine:
+    """Run chat turns on a background event loop with bounded concurrency
+
+    `submit` is thread-safe and returns a `concurrent.futures.Future`, so
+    the sync Streamlit handlers can wait on it; `cancel` drops a session's
+    queued turns and cancels the ones in flight (including their HTTP
+    requests). All OpenAI calls share one pooled aiohttp session.
+    """
+
+    def __init__(self, workers=16, max_concurrency=8, rpm=500, tpm=30000):
+        self.workers = workers
+        self.max_concurrency = max_concurrency
+        self.limiter = RateLimiter(max_concurrency, rpm, tpm)
+        self._loop = None
+        self._queue = None
+        self._running = {}
+        self._started = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._lock = threading.Lock()
+        self._counts = {"submitted": 0, "completed": 0, "failed": 0, "cancelled": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run_loop, name="request-engine", daemon=True)
+            self._thread.start()
+            self._started.wait()
+        return self
+
+    def _run_loop(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(self._main())
+
+    async def _main(self):
+        self._queue = FairQueue()
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency, keepalive_timeout=60)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            # Context is inherited by the workers and every task they start
+            openai.aiosession.set(session)
+            workers = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+            self._started.set()
+            try:
+                await asyncio.gather(*workers)
+            except asyncio.CancelledError:
+                pass
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            if not job.future.set_running_or_notify_cancel():
+                continue
+            task = asyncio.create_task(job.fn())
+            self._running.setdefault(job.session_id, set()).add(task)
+            try:
+                result = await task
+            except asyncio.CancelledError:
+                self._count("cancelled")
+                # A running Future can't be cancelled, so waiters get the error instead
+                job.future.set_exception(CancelledError())
+                if self._stopping:
+                    # The worker itself is being cancelled, not just the turn
+                    raise
+            except Exception as e:
+                self._count("failed")
+                job.future.set_exception(e)
+            else:
+                self._count("completed")
+                job.future.set_result(result)
+            finally:
+                tasks = self._running.get(job.session_id)
+                tasks.discard(task)
+                if not tasks:
+                    del self._running[job.session_id]
+
+    def submit(self, session_id, fn, priority=PRIORITY_INTERACTIVE):
+        """Queue coroutine function `fn` for a session; returns a Future of its result"""
+        self.start()
+        future = Future()
+        self._count("submitted")
+        self._loop.call_soon_threadsafe(self._queue.put, _Job(session_id, fn, future), priority)
+        return future
+
+    def _cancel(self, session_id):
+        for job in self._queue.remove(session_id):
+            self._count("cancelled")
+            job.future.cancel()
+        for task in self._running.get(session_id, ()):
+            task.cancel()
+
+    def cancel(self, session_id):
+        """Cancel a session's queued and running turns"""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._cancel, session_id)
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+        if self._queue is not None:
+            counts["queued"] = len(self._queue)
+        counts["running"] = sum(len(tasks) for tasks in self._running.values())
+        counts["limiter"] = self.limiter.stats()
+        return counts
+
+    def stop(self):
+        """Cancel everything on the loop and wait for its thread to finish"""
+        if self._loop is not None:
+            self._stopping = True
+            self._loop.call_soon_threadsafe(lambda: [task.cancel() for task in asyncio.all_tasks()])
+        if self._thread is not None:
+            self._thread.join()
@@ -0,0 +1,121 @@
+"""Token-budgeted chat history with a rolling summary of older turns"""
+import tiktoken
+from langchain.chains import LLMChain
+from langchain.memory.prompt import SUMMARY_PROMPT
+from langchain.schema import AIMessage, HumanMessage, SystemMessage
+
+
+class HistoryManager:
+    """Keep recent turns verbatim and fold older ones into a summary
+
+    Session state is a plain dict `{"summary": str, "turns": [[q, a], ...]}`
+    so it can be stored by any session backend. Older turns are folded in
+    batches of `fold_batch` to avoid a summarization call on every turn, and
+    the summary plus verbatim turns never exceed `max_tokens`.
+
+    A chat turn can save `append_turn` right away and `compact` afterwards,
+    so the summarization call doesn't hold up the answer; `rebase` then
+    keeps any turns saved while the fold ran.
+    """
+
+    def __init__(self, llm, keep_turns=4, fold_batch=2, max_tokens=1500, model_name="gpt-4"):
+        self.summarizer = LLMChain(llm=llm, prompt=SUMMARY_PROMPT)
+        self.keep_turns = keep_turns
+        self.fold_batch = fold_batch
+        self.max_tokens = max_tokens
+        self.encoding = tiktoken.encoding_for_model(model_name)
+
+    def count_tokens(self, text):
+        return len(self.encoding.encode(text))
+
+    def _turn_tokens(self, turn):
+        return self.count_tokens(f"Human: {turn[0]}\nAssistant: {turn[1]}")
+
+    def _total_tokens(self, state):
+        return self.count_tokens(state["summary"]) + sum(self._turn_tokens(turn) for turn in state["turns"])
+
+    def _pop_turns(self, state, count):
+        old_turns, state["turns"] = state["turns"][:count], state["turns"][count:]
+        return "\n".join(f"Human: {q}\nAI: {a}" for q, a in old_turns)
+
+    def _fold(self, state, count):
+        new_lines = self._pop_turns(state, count)
+        state["summary"] = self.summarizer.run(summary=state["summary"], new_lines=new_lines).strip()
+
+    async def _afold(self, state, count):
+        new_lines = self._pop_turns(state, count)
+        state["summary"] = (await self.summarizer.arun(summary=state["summary"], new_lines=new_lines)).strip()
+
+    def _truncate_summary(self, state):
+        budget = self.max_tokens - sum(self._turn_tokens(turn) for turn in state["turns"])
+        tokens = self.encoding.encode(state["summary"])
+        if len(tokens) > budget:
+            state["summary"] = self.encoding.decode(tokens[-max(budget, 0):]) if budget > 0 else ""
+
+    def _folds(self, state):
+        """Turn counts to fold, one at a time, until `state` is within budget"""
+        if len(state["turns"]) >= self.keep_turns + self.fold_batch:
+            yield len(state["turns"]) - self.keep_turns
+        # Over budget even with few turns (long answers): fold until it fits
+        while len(state["turns"]) > 1 and self._total_tokens(state) > self.max_tokens:
+            yield 1
+
+    def _copy(self, state):
+        return {"summary": state.get("summary", ""), "turns": [list(turn) for turn in state["turns"]]}
+
+    def append_turn(self, state, question, answer):
+        """Return new session state with the turn appended, without folding anything"""
+        state = self._copy(state)
+        state["turns"].append([question, answer])
+        return state
+
+    def needs_compacting(self, state):
+        """Whether `compact` would change `state`"""
+        if len(state["turns"]) >= self.keep_turns + self.fold_batch:
+            return True
+        return self._total_tokens(state) > self.max_tokens
+
+    def compact(self, state):
+        """Return new session state with old turns folded into the summary and the budget enforced"""
+        state = self._copy(state)
+        for count in self._folds(state):
+            self._fold(state, count)
+        self._truncate_summary(state)
+        return state
+
+    async def acompact(self, state):
+        """Async `compact`, for turns run on the request engine"""
+        state = self._copy(state)
+        for count in self._folds(state):
+            await self._afold(state, count)
+        self._truncate_summary(state)
+        return state
+
+    def rebase(self, compacted, before, current):
+        """`compacted` (made from `before`) plus the turns `current` gained since
+
+        None if `current` no longer continues `before`, e.g. the session was
+        cleared or another fold was stored first.
+        """
+        turns = before["turns"]
+        if current.get("summary", "") != before.get("summary", "") or current["turns"][:len(turns)] != turns:
+            return None
+        return {"summary": compacted["summary"], "turns": compacted["turns"] + current["turns"][len(turns):]}
+
+    def add_turn(self, state, question, answer):
+        """Return new session state with the turn appended and the budget enforced"""
+        return self.compact(self.append_turn(state, question, answer))
+
+    async def aadd_turn(self, state, question, answer):
+        """Async `add_turn`"""
+        return await self.acompact(self.append_turn(state, question, answer))
+
+    def chat_history(self, state):
+        """Messages to send as `chat_history`, summary first"""
+        messages = []
+        if state.get("summary"):
+            messages.append(SystemMessage(content=f"Summary of the earlier conversation: {state['summary']}"))
+        for question, answer in state["turns"]:
+            messages.append(HumanMessage(content=question))
+            messages.append(AIMessage(content=answer))
+        return messages
@@ -0,0 +1,241 @@
+"""Versioned on-disk snapshots of the FAISS index"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import faiss
+from langchain.docstore.document import Document
+from langchain.docstore.in_memory import InMemoryDocstore
+from langchain.vectorstores import FAISS
+
+from vector_index import CompressedDocstore, DocstoreWriter, VectorSpool
+
+# Bump when the on-disk layout changes so old snapshots get rebuilt
+SNAPSHOT_FORMAT = 2
+
+INDEX_FILE = "index.faiss"
+CHUNKS_FILE = "chunks.jsonl"
+MANIFEST_FILE = "manifest.json"
+# Vectors of a compressed snapshot while it is being written; removed once the index is built
+VECTORS_SPOOL_FILE = "vectors.spool"
+
+# Snapshot layouts: chunk texts in a JSON-lines file loaded into memory, or a compressed, memory-mapped store
+FLAT_LAYOUT = "flat"
+COMPRESSED_LAYOUT = "compressed"
+
+
+def content_hash(text):
+    """Stable hash of a piece of text"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def source_fingerprint(urls, chunk_size, chunk_overlap, embedding_model):
+    """Hash everything that decides what goes into the index"""
+    payload = json.dumps({
+        "format": SNAPSHOT_FORMAT,
+        "urls": list(urls),
+        "chunk_size": chunk_size,
+        "chunk_overlap": chunk_overlap,
+        "embedding_model": embedding_model
+    }, sort_keys=True)
+    return content_hash(payload)
+
+
+def read_manifest(path):
+    """Return the snapshot manifest, or None if there is no readable snapshot"""
+    try:
+        with open(os.path.join(path, MANIFEST_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_snapshot(vectorstore, path, fingerprint, embedding_model, page_hashes=None, failed=()):
+    """Write the index, chunk texts and manifest, replacing any previous snapshot
+
+    `page_hashes` maps each source url to the hash of its text, so later
+    refreshes can tell which pages changed; `failed` lists the urls that
+    couldn't be loaded into it.
+    """
+    tmp_path = _make_tmp(path)
+
+    # Chunks are written in FAISS row order so row i maps to line i
+    chunk_hashes = []
+    with open(os.path.join(tmp_path, CHUNKS_FILE), "w", encoding="utf-8") as f:
+        for i in range(vectorstore.index.ntotal):
+            doc_id = vectorstore.index_to_docstore_id[i]
+            doc = vectorstore.docstore.search(doc_id)
+            digest = content_hash(doc.page_content)
+            chunk_hashes.append(digest)
+            f.write(json.dumps({
+                "id": doc_id,
+                "text": doc.page_content,
+                "metadata": doc.metadata,
+                "hash": digest
+            }) + "\n")
+
+    faiss.write_index(vectorstore.index, os.path.join(tmp_path, INDEX_FILE))
+    return _publish(tmp_path, path, vectorstore.index, content_hash("".join(chunk_hashes)), len(chunk_hashes),
+                    fingerprint, embedding_model, page_hashes, layout=FLAT_LAYOUT, failed=sorted(failed))
+
+
+class CompressedSnapshotWriter:
+    """Stream chunks and their vectors into a new compressed snapshot
+
+    Chunk texts go straight into the compressed store and vectors into a
+    spool file beside it, so neither is held in memory; `publish` writes
+    the index built from the spool and swaps the snapshot into place.
+    """
+
+    def __init__(self, path, block_size=32):
+        self.path = path
+        self.tmp_path = _make_tmp(path)
+        self.docs = DocstoreWriter(self.tmp_path, block_size)
+        self.vectors = VectorSpool(os.path.join(self.tmp_path, VECTORS_SPOOL_FILE))
+        self._version = hashlib.sha256()
+
+    def __len__(self):
+        return len(self.docs)
+
+    def add(self, documents, ids, vectors):
+        """Append chunks, with their ids and vectors, in the order they become index rows"""
+        for doc_id, document in zip(ids, documents):
+            digest = content_hash(document.page_content)
+            self.docs.add(doc_id, document, digest)
+            self._version.update(digest.encode("ascii"))
+        self.vectors.append(vectors)
+
+    def finish(self):
+        """Close the chunk store; returns the spooled vectors, memory-mapped (None if empty)"""
+        self.docs.close()
+        return self.vectors.close()
+
+    def publish(self, index, fingerprint, embedding_model, page_hashes=None, index_spec=None, failed=()):
+        """Write `index` and the manifest, replacing any previous snapshot"""
+        faiss.write_index(index, os.path.join(self.tmp_path, INDEX_FILE))
+        os.remove(self.vectors.path)
+        return _publish(self.tmp_path, self.path, index, self._version.hexdigest(), len(self.docs), fingerprint,
+                        embedding_model, page_hashes, layout=COMPRESSED_LAYOUT, index_spec=index_spec,
+                        failed=sorted(failed))
+
+    def discard(self):
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+
+def _make_tmp(path):
+    # Unique per build, so a refresh and a full build in one process don't share a directory
+    parent, name = os.path.split(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    return tempfile.mkdtemp(prefix=f"{name}.tmp-{os.getpid()}-", dir=parent)
+
+
+def _publish(tmp_path, path, index, version, chunk_count, fingerprint, embedding_model, page_hashes, **extra):
+    """Write the manifest and move the finished snapshot into place
+
+    `version` is the hash of the chunk hashes concatenated in row order.
+    """
+    manifest = {
+        "format": SNAPSHOT_FORMAT,
+        "fingerprint": fingerprint,
+        "embedding_model": embedding_model,
+        "version": version,
+        "chunk_count": chunk_count,
+        "dimension": index.d,
+        "pages": page_hashes or {},
+        "created_at": time.time(),
+        **extra
+    }
+    with open(os.path.join(tmp_path, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+    # `path` is a symlink to the snapshot's directory, swapped with one atomic
+    # replace, so readers always find a complete snapshot there. Processes that
+    # still have the old one open or memory-mapped keep reading it until they let go.
+    snapshot_path = os.path.join(os.path.dirname(tmp_path), os.path.basename(tmp_path).replace(".tmp-", ".v-", 1))
+    os.rename(tmp_path, snapshot_path)
+    old_path = os.path.realpath(path) if os.path.islink(path) else None
+    if os.path.isdir(path) and not os.path.islink(path):
+        # A snapshot published before snapshots were linked
+        old_path = f"{snapshot_path}.old"
+        os.rename(path, old_path)
+    link_path = f"{snapshot_path}.link"
+    os.symlink(os.path.basename(snapshot_path), link_path)
+    os.replace(link_path, path)
+    if old_path is not None:
+        shutil.rmtree(old_path, ignore_errors=True)
+    return manifest
+
+
+def _read_index(index_path):
+    """Memory-map the index where FAISS supports it for this index type"""
+    try:
+        return faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    except RuntimeError:
+        return faiss.read_index(index_path)
+
+
+def load_snapshot(path, embeddings, fingerprint, embedding_model, layout=None):
+    """Load a snapshot as a FAISS vector store, or None if it is missing or stale
+
+    With `layout`, a snapshot in the other layout counts as stale. The link
+    at `path` is resolved once, so every file comes from the same snapshot;
+    if a new one is published and the old one removed mid-load, the load
+    is retried on the new one.
+    """
+    snapshot_path = os.path.realpath(path)
+    vectorstore = _load_snapshot(snapshot_path, embeddings, fingerprint, embedding_model, layout)
+    if vectorstore is None and os.path.realpath(path) != snapshot_path:
+        vectorstore = _load_snapshot(os.path.realpath(path), embeddings, fingerprint, embedding_model, layout)
+    return vectorstore
+
+
+def _load_snapshot(path, embeddings, fingerprint, embedding_model, layout):
+    manifest = read_manifest(path)
+    if manifest is None:
+        return None
+    if (manifest.get("format") != SNAPSHOT_FORMAT
+            or manifest.get("fingerprint") != fingerprint
+            or manifest.get("embedding_model") != embedding_model
+            or layout not in (None, manifest.get("layout", FLAT_LAYOUT))):
+        return None
+    if manifest.get("layout") == COMPRESSED_LAYOUT:
+        return _load_compressed(path, embeddings, manifest)
+
+    try:
+        index = _read_index(os.path.join(path, INDEX_FILE))
+        docs = {}
+        index_to_docstore_id = {}
+        with open(os.path.join(path, CHUNKS_FILE), encoding="utf-8") as f:
+            for i, line in enumerate(f):
+                record = json.loads(line)
+                docs[record["id"]] = Document(
+                    page_content=record["text"],
+                    metadata=record["metadata"]
+                )
+                index_to_docstore_id[i] = record["id"]
+    except (OSError, RuntimeError, ValueError, KeyError):
+        return None
+
+    if index.ntotal != len(index_to_docstore_id) or index.ntotal != manifest.get("chunk_count"):
+        return None
+
+    return FAISS(
+        embeddings.embed_query,
+        index,
+        InMemoryDocstore(docs),
+        index_to_docstore_id
+    )
+
+
+def _load_compressed(path, embeddings, manifest):
+    try:
+        index = _read_index(os.path.join(path, INDEX_FILE))
+        docstore = CompressedDocstore(path)
+    except (OSError, RuntimeError, ValueError, KeyError):
+        return None
+    if index.ntotal != len(docstore) or index.ntotal != manifest.get("chunk_count"):
+        return None
+    return FAISS(embeddings.embed_query, index, docstore, docstore.index_to_docstore_id)
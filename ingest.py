@@ -0,0 +1,261 @@
+"""Build or load the CareerGPT knowledge base index
+
+A build streams: pages are chunked as they arrive from the crawler,
+chunks are embedded in batches, and each batch goes straight to an
+on-disk spool (compressed chunk store plus raw vectors), so memory
+doesn't grow with the size of the site until the index itself is built.
+"""
+import logging
+import os
+from itertools import islice
+
+from langchain.vectorstores import FAISS
+
+from chunking import StructuredChunker, page_text
+from crawler import Crawler, format_report
+from embedding_backends import make_embeddings
+from index_store import (
+    COMPRESSED_LAYOUT, FLAT_LAYOUT, CompressedSnapshotWriter, content_hash, load_snapshot, read_manifest,
+    save_snapshot, source_fingerprint
+)
+from settings import (
+    CHUNK_DUPLICATE_BITS, CHUNK_DUPLICATE_MIN_WORDS, CHUNK_OVERLAP_TOKENS, CHUNK_TOKENS, CRAWL_DISCOVERY,
+    CRAWL_FIXTURE_DIR, CRAWL_FOLLOW_LINKS, CRAWL_FRONTIER_PATH, CRAWL_HOST_CONCURRENCY, CRAWL_HOST_DELAY,
+    CRAWL_MAX_DEPTH, CRAWL_MAX_PAGES, CRAWL_RECRAWL_AFTER, CRAWL_RESPECT_ROBOTS, CRAWL_RETRIES, CRAWL_SITEMAPS,
+    CRAWL_STATE_DIR, CRAWL_TIMEOUT, CRAWL_WORKERS, DOCSTORE_BLOCK_SIZE, EMBEDDING_MODEL, INDEX_BUILD_BATCH,
+    INDEX_DIR, INDEX_EF_SEARCH, INDEX_FLAT_MAX, INDEX_HNSW_MAX, INDEX_MODE, INDEX_NPROBE, URLS
+)
+from retrieval import BM25Writer
+from site_crawler import Frontier, SiteCrawler
+from vector_index import CompressedDocstore, build_vector_index, choose_index_spec, set_search_params
+
+logger = logging.getLogger(__name__)
+
+
+def make_crawler():
+    """Crawler configured from settings"""
+    return Crawler(
+        max_workers=CRAWL_WORKERS,
+        timeout=CRAWL_TIMEOUT,
+        retries=CRAWL_RETRIES,
+        state_dir=CRAWL_STATE_DIR,
+        fixture_dir=CRAWL_FIXTURE_DIR
+    )
+
+
+def make_site_crawler(urls):
+    """Site crawler seeded from `urls` and the sitemaps, configured from settings"""
+    os.makedirs(os.path.dirname(CRAWL_FRONTIER_PATH) or ".", exist_ok=True)
+    return SiteCrawler(
+        make_crawler(),
+        Frontier(CRAWL_FRONTIER_PATH, recrawl_after=CRAWL_RECRAWL_AFTER),
+        seeds=urls,
+        sitemaps=CRAWL_SITEMAPS,
+        max_pages=CRAWL_MAX_PAGES,
+        max_depth=CRAWL_MAX_DEPTH,
+        follow_links=CRAWL_FOLLOW_LINKS,
+        host_concurrency=CRAWL_HOST_CONCURRENCY,
+        host_delay=CRAWL_HOST_DELAY,
+        respect_robots=CRAWL_RESPECT_ROBOTS
+    )
+
+
+def make_chunker():
+    """Chunker configured from settings"""
+    return StructuredChunker(
+        chunk_tokens=CHUNK_TOKENS,
+        overlap_tokens=CHUNK_OVERLAP_TOKENS,
+        near_duplicate_bits=CHUNK_DUPLICATE_BITS,
+        near_duplicate_min_words=CHUNK_DUPLICATE_MIN_WORDS
+    )
+
+
+def _closing_pages(crawler):
+    # The frontier's connection is closed once the pages are drained or the iterator is dropped
+    try:
+        yield from crawler.pages()
+    finally:
+        crawler.frontier.close()
+
+
+def stream_pages(urls):
+    """(iterator of (url, html) pages, list of failed urls)
+
+    With discovery on, pages come from the site crawl as they are fetched
+    and the failed list fills in as the iterator is consumed.
+    """
+    if CRAWL_DISCOVERY:
+        crawler = make_site_crawler(urls)
+        return _closing_pages(crawler), crawler.failed
+    results = make_crawler().fetch_all(urls)
+    logger.info("crawl report\n%s", format_report(results))
+    failed = [result.url for result in results if not result.ok]
+    return ((result.url, result.html) for result in results if result.ok), failed
+
+
+def load_pages(urls):
+    """Fetch pages from the TEQ3 website, returning (url, html) pairs and failed urls"""
+    pages, failed = stream_pages(urls)
+    return list(pages), failed
+
+
+def split_pages(pages, existing=()):
+    """Chunk pages on their headings, dropping boilerplate repeated across pages"""
+    return make_chunker().split_pages(pages, existing)
+
+
+def page_hashes(pages):
+    """Hash of each page's main-content text, keyed by url"""
+    return {url: content_hash(page_text(html)) for url, html in pages}
+
+
+def iter_chunks(pages, hashes=None, existing=()):
+    """(chunk, id) pairs of each page as it arrives, deduplicated against everything before it
+
+    Each page's text hash is recorded in `hashes` on the way through.
+    """
+    chunker = make_chunker()
+    seen = chunker.duplicate_filter(existing)
+    for url, html in pages:
+        if hashes is not None:
+            hashes[url] = content_hash(page_text(html))
+        chunks = [chunk for chunk in chunker.split_page(url, html) if seen.is_new(chunk.page_content)]
+        # Positions only count within a page, so a page's ids don't depend on what came before it
+        yield from zip(chunks, chunk_ids(chunks))
+
+
+def iter_embedded(chunks, embeddings, batch_size=INDEX_BUILD_BATCH):
+    """(chunks, ids, vectors) batches of a stream of (chunk, id) pairs"""
+    chunks = iter(chunks)
+    while True:
+        batch = list(islice(chunks, batch_size))
+        if not batch:
+            return
+        documents = [chunk for chunk, _ in batch]
+        vectors = embeddings.embed_documents([chunk.page_content for chunk in documents])
+        yield documents, [chunk_id for _, chunk_id in batch], vectors
+
+
+def chunk_ids(chunks):
+    """Stable ids for chunks, derived from their page, position and text"""
+    positions = {}
+    ids = []
+    for chunk in chunks:
+        source = chunk.metadata.get("source", "")
+        position = positions.get(source, 0)
+        positions[source] = position + 1
+        ids.append(content_hash(f"{source}\0{position}\0{chunk.page_content}"))
+    return ids
+
+
+def use_compressed_layout(chunk_count):
+    """Whether an index of this many chunks gets the compressed layout"""
+    return INDEX_MODE == COMPRESSED_LAYOUT or (INDEX_MODE == "auto" and chunk_count > INDEX_FLAT_MAX)
+
+
+def open_snapshot(embeddings, index_dir, fingerprint):
+    """Load the snapshot in the configured layout, with the configured search parameters"""
+    layout = INDEX_MODE if INDEX_MODE in (FLAT_LAYOUT, COMPRESSED_LAYOUT) else None
+    vectorstore = load_snapshot(index_dir, embeddings, fingerprint, EMBEDDING_MODEL, layout)
+    if vectorstore is not None:
+        set_search_params(vectorstore.index, INDEX_EF_SEARCH, INDEX_NPROBE)
+    return vectorstore
+
+
+def partial_dir(index_dir):
+    """Where a build that missed pages is saved, beside the live snapshot"""
+    return f"{index_dir}.partial"
+
+
+def open_latest_snapshot(embeddings, index_dir, fingerprint):
+    """(vector store, path) of the complete snapshot, else of the partial one; (None, None) if neither loads"""
+    for path in (index_dir, partial_dir(index_dir)):
+        vectorstore = open_snapshot(embeddings, path, fingerprint)
+        if vectorstore is not None:
+            return vectorstore, path
+    return None, None
+
+
+def build_from_pages(pages, embeddings, index_dir, fingerprint, failed=(), build_if=None):
+    """Chunk, embed and index a stream of pages; returns the vector store and page hashes
+
+    Batches are spooled to disk as they are embedded, and the layout is
+    picked once the chunk count is known. `failed` is read after the
+    stream is drained: only complete crawls are saved as the snapshot, so
+    a flaky page doesn't get baked in. After a partial crawl the index is
+    saved beside it, in `partial_dir(index_dir)`, so a restart can start
+    from it instead of crawling and embedding everything again.
+
+    A compressed snapshot also gets the chunks' BM25 postings, collected
+    as they stream past, so retrievers memory-map them instead of reading
+    every chunk back to build a lexical index.
+
+    `build_if(hashes, failed)`, if given, is called once the stream is
+    drained; when it returns False nothing is indexed or saved and the
+    vector store is None.
+    """
+    hashes = {}
+    writer = CompressedSnapshotWriter(index_dir, DOCSTORE_BLOCK_SIZE)
+    lexical = BM25Writer()
+    try:
+        for documents, ids, vectors in iter_embedded(iter_chunks(pages, hashes), embeddings):
+            writer.add(documents, ids, vectors)
+            lexical.add(doc.page_content for doc in documents)
+        vectors = writer.finish()
+        if build_if is not None and not build_if(hashes, failed):
+            return None, hashes
+        if vectors is None:
+            raise RuntimeError(f"no chunks to index: {len(hashes)} pages loaded, {len(failed)} failed")
+        if use_compressed_layout(len(vectors)):
+            spec = choose_index_spec(len(vectors), vectors.shape[1], INDEX_FLAT_MAX, INDEX_HNSW_MAX)
+            logger.info("building %s index over %d chunks", spec, len(vectors))
+            index = build_vector_index(vectors, spec)
+            del vectors
+            lexical.save(writer.tmp_path)
+            if failed:
+                writer.path = partial_dir(index_dir)
+            writer.publish(index, fingerprint, EMBEDDING_MODEL, hashes, spec, failed)
+            return open_snapshot(embeddings, writer.path, fingerprint), hashes
+
+        # Few enough chunks for an exact index with the texts in memory
+        docstore = CompressedDocstore(writer.tmp_path)
+        documents = [docstore.document(row) for row in range(len(docstore))]
+        ids = [docstore.index_to_docstore_id[row] for row in range(len(docstore))]
+        text_embeddings = list(zip((doc.page_content for doc in documents), vectors))
+        vectorstore = FAISS.from_embeddings(text_embeddings, embeddings, [doc.metadata for doc in documents], ids)
+        del docstore, vectors
+    finally:
+        writer.discard()
+    save_snapshot(vectorstore, partial_dir(index_dir) if failed else index_dir, fingerprint, EMBEDDING_MODEL,
+                  hashes, failed)
+    return vectorstore, hashes
+
+
+def build_index(embeddings, urls=URLS, index_dir=INDEX_DIR, force=False):
+    """Load the index snapshot, rebuilding it only when the manifest doesn't match
+
+    Returns the vector store and the list of urls that could not be loaded.
+    Without a complete snapshot, the one saved after a partial crawl is
+    used; the refresher fills in the pages it missed.
+    """
+    fingerprint = source_fingerprint(urls, CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS, EMBEDDING_MODEL)
+    if not force:
+        vectorstore, path = open_latest_snapshot(embeddings, index_dir, fingerprint)
+        if vectorstore is not None:
+            return vectorstore, (read_manifest(path) or {}).get("failed", [])
+
+    pages, failed = stream_pages(urls)
+    vectorstore, _ = build_from_pages(pages, embeddings, index_dir, fingerprint, failed)
+    return vectorstore, failed
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    # The local backend builds the index fully offline, without an API key
+    embeddings = make_embeddings(os.environ.get("OPENAI_API_KEY"))
+    vectorstore, failed = build_index(embeddings, force=True)
+    for url in failed:
+        print(f"Could not load {url}")
+    stats = embeddings.stats()
+    print(f"Indexed {vectorstore.index.ntotal} chunks into {INDEX_DIR}")
+    print(f"Embedding cache: {stats['hits']} hits, {stats['misses']} misses")
@@ -0,0 +1,108 @@
+"""Local stand-in for the OpenAI chat completions API, for load tests
+
+    python mock_llm_server.py --port 8001 --latency 0.3 --error-rate 0.1
+    TEQ3_OPENAI_API_BASE=http://127.0.0.1:8001/v1 streamlit run app.py
+
+Replies are canned text, streamed word by word when asked to. A fraction
+of requests fail with 429 (with Retry-After) or 503 so retries and rate
+limiting can be exercised, and --rpm enforces a requests-per-minute limit.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from collections import deque
+
+from aiohttp import web
+
+REPLY = ("TEQ3 offers hands-on training in data analytics, cloud engineering and product management, "
+         "with mentoring and career support throughout. Tell me a bit about your background and goals "
+         "and I can suggest where to start.")
+
+
+def _error(status, message, headers=None):
+    body = {"error": {"message": message, "type": "mock_error", "code": status}}
+    return web.json_response(body, status=status, headers=headers)
+
+
+def make_app(latency=0.2, token_delay=0.01, error_rate=0.0, rpm=0):
+    recent = deque()
+    stats = {"requests": 0, "rate_limited": 0, "errors": 0}
+
+    def over_limit():
+        now = time.monotonic()
+        while recent and recent[0] < now - 60:
+            recent.popleft()
+        if rpm and len(recent) >= rpm:
+            return True
+        recent.append(now)
+        return False
+
+    async def chat_completions(request):
+        body = await request.json()
+        stats["requests"] += 1
+        if over_limit():
+            stats["rate_limited"] += 1
+            return _error(429, "Rate limit reached (mock)", {"Retry-After": "1"})
+        if random.random() < error_rate:
+            stats["errors"] += 1
+            if random.random() < 0.5:
+                stats["rate_limited"] += 1
+                return _error(429, "Rate limit reached (mock)", {"Retry-After": "0.5"})
+            return _error(503, "Service unavailable (mock)")
+
+        await asyncio.sleep(latency)
+        model = body.get("model", "gpt-4-turbo-preview")
+        completion_id = "chatcmpl-" + uuid.uuid4().hex
+        words = REPLY.split(" ")[:body.get("max_tokens") or None]
+        prompt_tokens = sum(len((m.get("content") or "").split()) for m in body.get("messages", []))
+
+        if not body.get("stream"):
+            return web.json_response({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": " ".join(words)}}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(words),
+                          "total_tokens": prompt_tokens + len(words)}
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+
+        async def send(delta, finish_reason=None):
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+
+        await send({"role": "assistant", "content": ""})
+        for i, word in enumerate(words):
+            await send({"content": word if i == 0 else " " + word})
+            await asyncio.sleep(token_delay)
+        await send({}, "stop")
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+    async def get_stats(request):
+        return web.json_response(stats)
+
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    app.router.add_get("/stats", get_stats)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds before the first token")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="seconds between streamed tokens")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests failing with 429/503")
+    parser.add_argument("--rpm", type=int, default=0, help="requests per minute before 429s (0 = unlimited)")
+    args = parser.parse_args()
+    web.run_app(make_app(args.latency, args.token_delay, args.error_rate, args.rpm), host=args.host, port=args.port)
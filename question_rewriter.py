@@ -0,0 +1,131 @@
+"""Condense follow-up questions only when they actually need it"""
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from typing import Any
+
+from langchain.chains import LLMChain
+from langchain.pydantic_v1 import PrivateAttr
+
+from tracing import count
+
+# Phrases that point back at something said earlier, wherever they appear
+REFERENCE_PATTERN = re.compile(
+    r"\b(what about|how about|tell me more|more about (?:it|that|this|them)|the other|the former|the latter|"
+    r"the same|which ones?|(?:this|that|these|those) ones?|the (?:first|second|third|last) one|"
+    r"you (?:mentioned|said|just said))\b",
+    re.IGNORECASE
+)
+
+# Follow-ups that continue the previous sentence
+CONTINUATION_PATTERN = re.compile(r"^\s*(and|but|so|or|also|then|what if)\b", re.IGNORECASE)
+
+WORD_PATTERN = re.compile(r"[a-z0-9']+")
+
+# Pronouns that stand in for something named earlier. They only count near
+# the start of the question or as its last word ("is it online?", "how much
+# does it cost?", "can I pay for it?"). Further in, they usually refer to
+# something in the same question ("... if it's my first tech job").
+PRONOUNS = {"it", "its", "it's", "they", "them", "their", "theirs", "he", "she", "him", "his", "her"}
+DEMONSTRATIVES = {"this", "that", "these", "those"}
+# A demonstrative followed by one of these stands alone ("does that include ..."),
+# followed by anything else it is a determiner ("is this course ...")
+PRONOUN_FOLLOWERS = {
+    "is", "are", "was", "were", "'s", "does", "do", "did", "has", "have", "had", "will", "would", "can",
+    "could", "should", "cost", "costs", "include", "includes", "mean", "means", "sound", "sounds",
+    "work", "works", "take", "takes", "cover", "covers", "require", "requires", "apply", "applies"
+}
+REFERENCE_WINDOW = 5
+
+# Questions this short rarely stand on their own ("how long?", "any discounts?")
+MIN_STANDALONE_WORDS = 4
+
+
+def _refers_back(words):
+    for i, word in enumerate(words):
+        if i >= REFERENCE_WINDOW and i != len(words) - 1:
+            continue
+        if word in PRONOUNS:
+            return True
+        if word in DEMONSTRATIVES and (i == len(words) - 1 or words[i + 1] in PRONOUN_FOLLOWERS):
+            return True
+    return False
+
+
+def needs_rewrite(question):
+    """Cheap local check for whether a follow-up depends on the earlier conversation"""
+    if REFERENCE_PATTERN.search(question) or CONTINUATION_PATTERN.search(question):
+        return True
+    words = WORD_PATTERN.findall(question.lower())
+    return len(words) < MIN_STANDALONE_WORDS or _refers_back(words)
+
+
+class QuestionRewriter(LLMChain):
+    """Question generator that skips the LLM for self-contained follow-ups
+
+    Drop-in replacement for the condense-question LLMChain. Questions that
+    pass `needs_rewrite` are returned unchanged; the rest go to the LLM,
+    with results cached by (recent history, question).
+    """
+
+    cache_size: int = 512
+    history_window: int = 2000
+
+    _cache: Any = PrivateAttr(default_factory=OrderedDict)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _counts: Any = PrivateAttr(default_factory=lambda: {"skipped": 0, "cache_hits": 0, "rewritten": 0})
+
+    def _cache_key(self, inputs):
+        # The tail of the history is what the question can refer to
+        text = f"{inputs['chat_history'][-self.history_window:]}\0{inputs['question']}"
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _local(self, inputs):
+        """Answer from local checks or the cache; returns (outputs or None, cache key)"""
+        if not needs_rewrite(inputs["question"]):
+            self._count("skipped")
+            return {self.output_key: inputs["question"]}, None
+        key = self._cache_key(inputs)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+        if cached is not None:
+            self._count("cache_hits")
+            return {self.output_key: cached}, key
+        return None, key
+
+    def _remember(self, key, outputs):
+        with self._lock:
+            self._cache[key] = outputs[self.output_key]
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        self._count("rewritten")
+
+    def _count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+        count("teq3_condense_total", f"condense_{name}", result=name)
+
+    def _call(self, inputs, run_manager=None):
+        outputs, key = self._local(inputs)
+        if outputs is None:
+            outputs = super()._call(inputs, run_manager=run_manager)
+            self._remember(key, outputs)
+        return outputs
+
+    async def _acall(self, inputs, run_manager=None):
+        outputs, key = self._local(inputs)
+        if outputs is None:
+            outputs = await super()._acall(inputs, run_manager=run_manager)
+            self._remember(key, outputs)
+        return outputs
+
+    def stats(self):
+        """How often the condense call was skipped or served from cache"""
+        with self._lock:
+            counts = dict(self._counts)
+        total = sum(counts.values())
+        counts["skip_rate"] = (counts["skipped"] + counts["cache_hits"]) / total if total else 0.0
+        return counts
@@ -0,0 +1,166 @@
+"""Background re-indexing with an atomic swap of the live index"""
+import logging
+import threading
+
+import faiss
+from langchain.docstore.in_memory import InMemoryDocstore
+from langchain.vectorstores import FAISS
+
+from index_store import read_manifest, save_snapshot, source_fingerprint
+from ingest import build_from_pages, chunk_ids, load_pages, page_hashes, partial_dir, split_pages, stream_pages
+from vector_index import CompressedDocstore
+from settings import CHUNK_OVERLAP_TOKENS, CHUNK_TOKENS, EMBEDDING_MODEL, INDEX_DIR, URLS
+
+logger = logging.getLogger(__name__)
+
+
+def copy_vectorstore(vectorstore):
+    """Private, writable copy of a vector store that the live one won't see changes to"""
+    index_to_docstore_id = dict(vectorstore.index_to_docstore_id)
+    documents = {doc_id: vectorstore.docstore.search(doc_id) for doc_id in index_to_docstore_id.values()}
+    return FAISS(
+        vectorstore.embedding_function,
+        faiss.clone_index(vectorstore.index),
+        InMemoryDocstore(documents),
+        index_to_docstore_id
+    )
+
+
+class IndexRefresher:
+    """Re-crawl on a schedule and re-embed only pages whose text changed
+
+    Changes are applied to a copy of the live index (remove the changed
+    pages' chunks by id, add their new chunks), which is then saved as the
+    new snapshot and swapped into the bot in one step. Requests already in
+    flight keep using the index they started with.
+
+    The refresh starts from the complete snapshot, or from the partial one
+    if that is all there is; it is saved as complete once every page the
+    crawl found is in it.
+
+    A compressed index can't be edited in place, so it is rebuilt from the
+    whole crawl instead (unchanged chunks come from the embedding cache);
+    that waits for a crawl in which every page loaded. The crawl is
+    streamed once: pages are hashed as they are chunked into the spool,
+    and the index is only built if one of them changed.
+    """
+
+    def __init__(self, bot, embeddings, interval, urls=URLS, index_dir=INDEX_DIR):
+        self.bot = bot
+        self.embeddings = embeddings
+        self.interval = interval
+        self.urls = urls
+        self.index_dir = index_dir
+        self.fingerprint = source_fingerprint(urls, CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS, EMBEDDING_MODEL)
+        # The pages of the snapshot `build_index` would have loaded
+        manifests = [read_manifest(path) for path in (index_dir, partial_dir(index_dir))]
+        manifest = next((m for m in manifests if m and m.get("fingerprint") == self.fingerprint), {})
+        self.page_hashes = manifest.get("pages", {})
+        # Urls the last crawl couldn't load
+        self.failed = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Run refreshes on a daemon thread every `interval` seconds"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="index-refresher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.refresh_once()
+            except Exception:
+                logger.exception("index refresh failed")
+
+    def refresh_once(self):
+        """Crawl, apply changed pages to a copy of the index and swap it in
+
+        Returns True if the live index was replaced.
+        """
+        if isinstance(self.bot.vectorstore.docstore, CompressedDocstore):
+            return self._rebuild()
+        pages, failed = load_pages(self.urls)
+        self.failed = list(failed)
+        new_hashes = page_hashes(pages)
+        changed = [(url, html) for url, html in pages if self.page_hashes.get(url) != new_hashes[url]]
+        # Pages no longer on the site (as opposed to failing to load) drop out of the index
+        removed = set(self.page_hashes) - set(new_hashes) - set(failed)
+        if not changed and not removed:
+            logger.info("index refresh: no changed pages")
+            return False
+
+        changed_urls = {url for url, _ in changed} | removed
+        vectorstore = copy_vectorstore(self.bot.vectorstore)
+
+        stale_ids = [
+            doc_id for doc_id in vectorstore.index_to_docstore_id.values()
+            if vectorstore.docstore.search(doc_id).metadata.get("source") in changed_urls
+        ]
+        if stale_ids:
+            vectorstore.delete(stale_ids)
+
+        # Boilerplate already indexed from unchanged pages isn't added again.
+        # A chunk shared by several pages was only indexed under the first of
+        # them, so when that copy goes the unchanged pages are chunked again
+        # too: everything of theirs still indexed is filtered out, leaving
+        # the copies that were dropped as duplicates.
+        existing = [vectorstore.docstore.search(doc_id).page_content
+                    for doc_id in vectorstore.index_to_docstore_id.values()]
+        unchanged = [(url, html) for url, html in pages if url not in changed_urls] if stale_ids else []
+        chunks = split_pages(changed + unchanged, existing)
+        texts = [chunk.page_content for chunk in chunks]
+        vectors = self.embeddings.embed_documents(texts)
+        vectorstore.add_embeddings(
+            list(zip(texts, vectors)),
+            metadatas=[chunk.metadata for chunk in chunks],
+            ids=chunk_ids(chunks)
+        )
+
+        # Pages that failed to fetch keep their old chunks and hashes
+        hashes = {url: digest for url, digest in self.page_hashes.items() if url not in removed}
+        hashes.update(new_hashes)
+        # Failed pages that were never indexed leave the snapshot partial
+        missing = [url for url in failed if url not in hashes]
+        path = partial_dir(self.index_dir) if missing else self.index_dir
+        manifest = save_snapshot(vectorstore, path, self.fingerprint, EMBEDDING_MODEL, hashes, missing)
+
+        self.bot.swap_index(vectorstore, manifest["version"])
+        self.page_hashes = hashes
+        logger.info("index refresh: %d changed pages, %d chunks removed, %d added",
+                    len(changed_urls), len(stale_ids), len(chunks))
+        if missing:
+            logger.warning("index refresh: %d pages never loaded, saved as a partial snapshot", len(missing))
+        return True
+
+    def _rebuild(self):
+        changed = 0
+
+        def worth_building(new_hashes, failed):
+            nonlocal changed
+            self.failed = list(failed)
+            changed = sum(1 for url, digest in new_hashes.items() if self.page_hashes.get(url) != digest)
+            changed += len(set(self.page_hashes) - set(new_hashes) - set(failed))
+            if not changed:
+                logger.info("index refresh: no changed pages")
+                return False
+            if failed:
+                logger.warning("index refresh: %d pages changed, rebuild postponed until all pages load", changed)
+                return False
+            return True
+
+        pages, failed = stream_pages(self.urls)
+        vectorstore, hashes = build_from_pages(
+            pages, self.embeddings, self.index_dir, self.fingerprint, failed, worth_building
+        )
+        if vectorstore is None:
+            return False
+        self.bot.swap_index(vectorstore, read_manifest(self.index_dir)["version"])
+        self.page_hashes = hashes
+        logger.info("index refresh: %d changed pages, compressed index rebuilt with %d chunks",
+                    changed, vectorstore.index.ntotal)
+        return True
@@ -0,0 +1,353 @@
+"""Hybrid lexical + dense retrieval over the knowledge base chunks"""
+import asyncio
+import contextvars
+import logging
+import math
+import os
+import re
+import threading
+from array import array
+from collections import Counter, defaultdict
+from typing import Any
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain.pydantic_v1 import PrivateAttr
+from langchain.schema import BaseRetriever
+
+from tracing import stage
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+# BM25 postings persisted beside a compressed snapshot's chunk store
+BM25_TERMS_FILE = "bm25.terms.npy"
+BM25_OFFSETS_FILE = "bm25.offsets.npy"
+BM25_DOCS_FILE = "bm25.docs.npy"
+BM25_TFS_FILE = "bm25.tfs.npy"
+BM25_LENGTHS_FILE = "bm25.lengths.npy"
+
+STOPWORDS = frozenset("""
+a an and are as at be but by can do does for from have how i in is it me my of on or our
+so that the their this to was what when where which who why will with you your about tell
+""".split())
+
+
+def tokenize(text):
+    """Lowercased content words"""
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+class BM25Index:
+    """In-process inverted index scored with Okapi BM25"""
+
+    def __init__(self, texts, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(list)
+        self.doc_lengths = []
+        for doc_idx, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            self.doc_lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                self.postings[term].append((doc_idx, tf))
+        self.avg_length = (sum(self.doc_lengths) / len(self.doc_lengths)) if self.doc_lengths else 0.0
+        n_docs = len(self.doc_lengths)
+        self.idf = {
+            term: math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()
+        }
+
+    def search(self, query, k):
+        """Return (doc_idx, score, matched_term_count) for the top k documents"""
+        terms = set(tokenize(query))
+        scores = defaultdict(float)
+        matched = Counter()
+        for term in terms:
+            for doc_idx, tf in self.postings.get(term, ()):
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_idx] / self.avg_length)
+                scores[doc_idx] += self.idf[term] * tf * (self.k1 + 1) / (tf + norm)
+                matched[doc_idx] += 1
+        top = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(doc_idx, score, matched[doc_idx]) for doc_idx, score in top]
+
+
+class BM25Writer:
+    """Collect the postings of chunk texts as they stream in, for `MappedBM25Index`
+
+    Postings are kept in flat int arrays rather than per-term lists, so an
+    ingest of the whole site stays small; `save` sorts them by term.
+    """
+
+    def __init__(self):
+        self.vocabulary = {}
+        self.term_ids = array("i")
+        self.docs = array("i")
+        self.tfs = array("i")
+        self.lengths = array("i")
+
+    def add(self, texts):
+        """Append texts in the order they become index rows"""
+        for text in texts:
+            counts = Counter(tokenize(text))
+            doc_idx = len(self.lengths)
+            self.lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                self.term_ids.append(self.vocabulary.setdefault(term, len(self.vocabulary)))
+                self.docs.append(doc_idx)
+                self.tfs.append(tf)
+
+    def save(self, path):
+        width = max(map(len, self.vocabulary), default=1)
+        terms = np.array([term.encode("ascii") for term in self.vocabulary], dtype=f"S{width}")
+        order = np.argsort(terms, kind="stable")
+        sorted_ids = np.empty(len(order), dtype=np.int64)
+        sorted_ids[order] = np.arange(len(order))
+        term_ids = sorted_ids[np.frombuffer(self.term_ids, dtype=np.int32)]
+        # Stable, so each term's postings stay in row order
+        postings = np.argsort(term_ids, kind="stable")
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(terms)), out=offsets[1:])
+        np.save(os.path.join(path, BM25_TERMS_FILE), terms[order])
+        np.save(os.path.join(path, BM25_OFFSETS_FILE), offsets)
+        np.save(os.path.join(path, BM25_DOCS_FILE), np.frombuffer(self.docs, dtype=np.int32)[postings])
+        np.save(os.path.join(path, BM25_TFS_FILE), np.frombuffer(self.tfs, dtype=np.int32)[postings])
+        np.save(os.path.join(path, BM25_LENGTHS_FILE), np.frombuffer(self.lengths, dtype=np.int32))
+
+
+def has_bm25_index(path):
+    return os.path.exists(os.path.join(path, BM25_LENGTHS_FILE))
+
+
+class MappedBM25Index:
+    """BM25 over postings saved by `BM25Writer`, memory-mapped
+
+    Opening it reads no chunk text, and a query only touches the postings
+    of its own terms, so every worker shares the pages of one index.
+    """
+
+    def __init__(self, path, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.terms = np.load(os.path.join(path, BM25_TERMS_FILE), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, BM25_OFFSETS_FILE), mmap_mode="r")
+        self.docs = np.load(os.path.join(path, BM25_DOCS_FILE), mmap_mode="r")
+        self.tfs = np.load(os.path.join(path, BM25_TFS_FILE), mmap_mode="r")
+        self.doc_lengths = np.load(os.path.join(path, BM25_LENGTHS_FILE), mmap_mode="r")
+        self.n_docs = len(self.doc_lengths)
+        self.avg_length = float(self.doc_lengths.mean()) if self.n_docs else 0.0
+
+    def _postings(self, term):
+        key = term.encode("ascii")
+        position = int(np.searchsorted(self.terms, key))
+        if position == len(self.terms) or self.terms[position] != key:
+            return None
+        return slice(int(self.offsets[position]), int(self.offsets[position + 1]))
+
+    def idf(self, term):
+        """Inverse document frequency of a term, 0 if no chunk has it"""
+        postings = self._postings(term)
+        if postings is None:
+            return 0.0
+        df = postings.stop - postings.start
+        return math.log(1 + (self.n_docs - df + 0.5) / (df + 0.5))
+
+    def search(self, query, k):
+        """Return (doc_idx, score, matched_term_count) for the top k documents"""
+        docs, contributions = [], []
+        for term in set(tokenize(query)):
+            postings = self._postings(term)
+            if postings is None:
+                continue
+            term_docs = np.asarray(self.docs[postings])
+            tf = self.tfs[postings].astype(np.float64)
+            norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[term_docs] / self.avg_length)
+            docs.append(term_docs)
+            contributions.append(self.idf(term) * tf * (self.k1 + 1) / (tf + norm))
+        if not docs:
+            return []
+        rows, inverse = np.unique(np.concatenate(docs), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(contributions))
+        matched = np.bincount(inverse)
+        top = np.argsort(-scores, kind="stable")[:k]
+        return [(int(rows[i]), float(scores[i]), int(matched[i])) for i in top]
+
+
+class IdfReranker:
+    """Re-rank candidates by TF-IDF cosine similarity, with idf from a `MappedBM25Index`
+
+    Only the candidates' texts are read, so nothing is fitted over the
+    whole store; it scores single terms, not the bigrams `TfidfReranker` adds.
+    """
+
+    def __init__(self, bm25, text):
+        self.bm25 = bm25
+        self.text = text
+
+    def _vector(self, text):
+        counts = Counter(tokenize(text))
+        vector = {term: (1 + math.log(tf)) * self.bm25.idf(term) for term, tf in counts.items()}
+        norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+        return {term: weight / norm for term, weight in vector.items()} if norm else {}
+
+    def scores(self, query, doc_indices):
+        query_vector = self._vector(query)
+        scores = []
+        for doc_idx in doc_indices:
+            vector = self._vector(self.text(doc_idx))
+            scores.append(sum(weight * vector.get(term, 0.0) for term, weight in query_vector.items()))
+        return np.array(scores)
+
+
+class TfidfReranker:
+    """Re-rank candidates by TF-IDF cosine similarity to the query"""
+
+    def __init__(self, texts):
+        from sklearn.feature_extraction.text import TfidfVectorizer
+
+        self.vectorizer = TfidfVectorizer(ngram_range=(1, 2), sublinear_tf=True, stop_words="english")
+        self.matrix = self.vectorizer.fit_transform(texts)
+
+    def scores(self, query, doc_indices):
+        query_vector = self.vectorizer.transform([query])
+        return (self.matrix[doc_indices] @ query_vector.T).toarray().ravel()
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Fuse several ranked lists of doc indices into one score per doc"""
+    fused = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_idx in enumerate(ranking):
+            fused[doc_idx] += 1.0 / (k + rank + 1)
+    return fused
+
+
+class HybridRetriever(BaseRetriever):
+    """BM25 first, dense FAISS search only when the lexical match is not decisive
+
+    Keyword-heavy queries whose terms are all found in a clearly leading
+    chunk are answered from BM25 alone, with no embedding call. Otherwise
+    both rankings are merged with reciprocal-rank fusion, and optionally
+    re-ranked locally. Each returned document carries `retrieval_score`
+    (0-1, best first) and `retrieval_mode` in its metadata.
+
+    Chunk texts are read from the vector store's docstore by row when they
+    are returned, so a memory-mapped store is never copied into memory.
+    A compressed snapshot carries its BM25 postings, which are memory-mapped
+    too; only a store without them is tokenized into an in-process index.
+    """
+
+    vectorstore: Any
+    k: int = 5
+    fetch_k: int = 20
+    rrf_k: int = 60
+    lexical_max_terms: int = 6
+    lexical_margin: float = 1.2
+    rerank_weight: float = 0.5
+    use_reranker: bool = False
+
+    _size: int = PrivateAttr()
+    _bm25: Any = PrivateAttr()
+    _reranker: Any = PrivateAttr(default=None)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _counts: Any = PrivateAttr(default_factory=lambda: {"lexical": 0, "hybrid": 0})
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._size = self.vectorstore.index.ntotal
+        path = getattr(self.vectorstore.docstore, "path", None)
+        if path is not None and has_bm25_index(path):
+            self._bm25 = MappedBM25Index(path)
+            if self.use_reranker and self._size:
+                self._reranker = IdfReranker(self._bm25, lambda row: self._document(row).page_content)
+            return
+        if path is not None:
+            logger.warning("no BM25 postings in %s, indexing %d chunks in process", path, self._size)
+        self._bm25 = BM25Index(self._texts())
+        if self.use_reranker and self._size:
+            self._reranker = TfidfReranker(self._texts())
+
+    def _document(self, row):
+        store = self.vectorstore
+        return store.docstore.search(store.index_to_docstore_id[row])
+
+    def _texts(self):
+        return (self._document(row).page_content for row in range(self._size))
+
+    def with_vectorstore(self, vectorstore):
+        """Same retriever settings over a different index"""
+        params = {name: getattr(self, name) for name in self.__fields__ if name != "vectorstore"}
+        retriever = self.__class__(vectorstore=vectorstore, **params)
+        # Counters cover every index served, not just the current one
+        retriever._lock = self._lock
+        retriever._counts = self._counts
+        return retriever
+
+    def _lexical_is_decisive(self, query, lexical):
+        terms = set(tokenize(query))
+        if not lexical or not terms or len(terms) > self.lexical_max_terms:
+            return False
+        top_idx, top_score, top_matched = lexical[0]
+        if top_matched < len(terms):
+            return False
+        return len(lexical) == 1 or top_score >= self.lexical_margin * lexical[1][1]
+
+    def _dense(self, query):
+        with stage("embed"):
+            vector = np.array([self.vectorstore.embedding_function(query)], dtype=np.float32)
+        with stage("vector_search"):
+            _, rows = self.vectorstore.index.search(vector, min(self.fetch_k, self._size))
+        return [int(row) for row in rows[0] if row >= 0]
+
+    def _count(self, mode):
+        with self._lock:
+            self._counts[mode] += 1
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        if not self._size:
+            return []
+        with stage("bm25"):
+            lexical = self._bm25.search(query, self.fetch_k)
+
+        if self._lexical_is_decisive(query, lexical):
+            mode = "lexical"
+            scores = {doc_idx: score for doc_idx, score, _ in lexical}
+        else:
+            mode = "hybrid"
+            scores = reciprocal_rank_fusion(
+                [[doc_idx for doc_idx, _, _ in lexical], self._dense(query)], k=self.rrf_k
+            )
+        self._count(mode)
+
+        ranked = sorted(scores, key=scores.get, reverse=True)[:self.fetch_k]
+        top = scores[ranked[0]] if ranked else 1.0
+        normalized = {doc_idx: scores[doc_idx] / top for doc_idx in ranked}
+
+        if self._reranker is not None and ranked:
+            with stage("rerank"):
+                rerank = self._reranker.scores(query, ranked)
+            for doc_idx, score in zip(ranked, rerank):
+                normalized[doc_idx] = (1 - self.rerank_weight) * normalized[doc_idx] + self.rerank_weight * score
+            ranked.sort(key=normalized.get, reverse=True)
+
+        results = []
+        for doc_idx in ranked[:self.k]:
+            doc = self._document(doc_idx)
+            metadata = dict(doc.metadata, retrieval_score=float(normalized[doc_idx]), retrieval_mode=mode)
+            results.append(Document(page_content=doc.page_content, metadata=metadata))
+        return results
+
+    async def _aget_relevant_documents(self, query, *, run_manager=None):
+        loop = asyncio.get_running_loop()
+        # Carry the turn's trace over to the executor thread
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(None, context.run, lambda: self._get_relevant_documents(query))
+
+    def stats(self):
+        """How many queries were served lexically versus with a dense search"""
+        with self._lock:
+            counts = dict(self._counts)
+        total = counts["lexical"] + counts["hybrid"]
+        counts["lexical_rate"] = counts["lexical"] / total if total else 0.0
+        return counts
@@ -0,0 +1,537 @@
+"""Retrieval and embedding worker pool shared by the UI and API processes
+
+    python retrieval_service.py
+
+The supervisor loads the index snapshot, the embedding model and the
+retriever once, then forks `RETRIEVAL_SERVICE_WORKERS` processes that
+accept connections on one unix socket, each on its own core. Large
+buffers stay shared copy-on-write: the FAISS index, the model's weights,
+and a compressed snapshot's memory-mapped chunk store. Python objects do
+not. CPython writes reference counts into every object it touches, so
+each worker gradually gets its own copy of the pages holding the BM25
+postings, docstore dicts and other Python structures it reads.
+`gc.freeze()` before forking keeps the garbage collector from dirtying
+all of them at once. UI and API processes set TEQ3_RETRIEVAL_SERVICE to
+the socket path and query the pool through `RemoteRetriever` and
+`RemoteEmbeddings` instead of holding an index.
+
+Index builds and refreshes run in a separate spawned process, in the
+background while the workers keep serving. When a new snapshot is
+published the supervisor loads it and forks a new generation of workers.
+The old generation then stops accepting connections, finishes the
+requests it has already received, and exits. Clients reconnect on their
+own.
+"""
+import asyncio
+import contextvars
+import gc
+import logging
+import multiprocessing
+import os
+import queue
+import secrets
+import signal
+import threading
+import time
+from multiprocessing.connection import AuthenticationError, Client, Listener
+from typing import Any
+
+from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
+from langchain.schema import BaseRetriever
+
+from settings import (
+    CHUNK_OVERLAP_TOKENS, CHUNK_TOKENS, CONTEXT_MAX_K, EMBEDDING_MODEL, INDEX_DIR, REFRESH_INTERVAL,
+    RERANKER_ENABLED, RETRIEVAL_SERVICE_ADDRESS, RETRIEVAL_SERVICE_AUTHKEY, RETRIEVAL_SERVICE_TIMEOUT,
+    RETRIEVAL_SERVICE_WORKERS, URLS
+)
+from tracing import collect, configure_logging, record_stage
+
+logger = logging.getLogger(__name__)
+
+# How often an idle worker connection checks whether its worker is draining
+DRAIN_POLL = 0.5
+
+
+def service_authkey(address, create=False):
+    """Shared secret for the socket: TEQ3_RETRIEVAL_SERVICE_AUTHKEY, or the key file beside it"""
+    if RETRIEVAL_SERVICE_AUTHKEY:
+        return RETRIEVAL_SERVICE_AUTHKEY.encode("utf-8")
+    path = f"{address}.key"
+    if create and not os.path.exists(path):
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "w") as f:
+            f.write(secrets.token_hex(32))
+    with open(path, "rb") as f:
+        return f.read().strip()
+
+
+class RetrievalClient:
+    """Calls into the retrieval service over a small pool of connections
+
+    Each call takes an idle connection (or opens one), so concurrent turns
+    don't queue behind each other. A call that finds its connection
+    closed, e.g. because its worker was retired after an index refresh,
+    is retried once on a new one. Stages timed in the worker are recorded
+    into the caller's turn trace, and `on_index_change` is called with the
+    new version when the service starts answering from a different index.
+    """
+
+    def __init__(self, address, authkey=None, timeout=30.0, max_idle=8):
+        self.address = address
+        self.authkey = authkey if authkey is not None else service_authkey(address)
+        self.timeout = timeout
+        self.on_index_change = None
+        self.index_version = None
+        self._idle = queue.LifoQueue(maxsize=max_idle)
+        self._lock = threading.Lock()
+        self._counts = {"calls": 0, "reconnects": 0, "errors": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def _acquire(self, fresh=False):
+        if not fresh:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+        return Client(self.address, family="AF_UNIX", authkey=self.authkey)
+
+    def _drop_idle(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def _release(self, conn):
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def _exchange(self, conn, method, args):
+        conn.send((method, args))
+        if not conn.poll(self.timeout):
+            raise TimeoutError(f"no reply to {method} within {self.timeout}s")
+        return conn.recv()
+
+    def call(self, method, *args):
+        """Run `method` in a worker and return its result"""
+        self._count("calls")
+        for attempt in range(2):
+            conn = None
+            try:
+                conn = self._acquire(fresh=attempt > 0)
+                status, value, stages, version = self._exchange(conn, method, args)
+                break
+            except TimeoutError:
+                conn.close()
+                self._count("errors")
+                raise
+            except (EOFError, OSError) as e:
+                if conn is not None:
+                    conn.close()
+                if attempt:
+                    self._count("errors")
+                    raise ConnectionError(f"retrieval service at {self.address}: {e}") from e
+                # The other idle connections most likely went to the same retired worker generation
+                self._drop_idle()
+                self._count("reconnects")
+        self._release(conn)
+
+        for name, seconds in stages:
+            record_stage(name, seconds)
+        self._check_version(version)
+        if status == "error":
+            self._count("errors")
+            raise RuntimeError(f"retrieval service {method} failed: {value}")
+        return value
+
+    def _check_version(self, version):
+        with self._lock:
+            changed = self.index_version is not None and version != self.index_version
+            self.index_version = version
+        if changed and self.on_index_change is not None:
+            self.on_index_change(version)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counts, index_version=self.index_version)
+
+
+def make_client():
+    """Client of the service at TEQ3_RETRIEVAL_SERVICE"""
+    return RetrievalClient(RETRIEVAL_SERVICE_ADDRESS, timeout=RETRIEVAL_SERVICE_TIMEOUT)
+
+
+class RemoteRetriever(BaseRetriever):
+    """`HybridRetriever` running in the retrieval service
+
+    Returns the same documents, with `retrieval_score` and
+    `retrieval_mode` in their metadata.
+    """
+
+    client: Any
+
+    @property
+    def vectorstore(self):
+        # The index lives in the service, which also refreshes it
+        return None
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        return [Document(page_content=text, metadata=metadata)
+                for text, metadata in self.client.call("retrieve", query)]
+
+    async def _aget_relevant_documents(self, query, *, run_manager=None):
+        loop = asyncio.get_running_loop()
+        # Carry the turn's trace over to the executor thread
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(None, context.run, lambda: self._get_relevant_documents(query))
+
+    def stats(self):
+        """Retrieval counters of the worker that answered, plus this client's connection counters"""
+        return dict(self.client.call("stats"), client=self.client.stats())
+
+
+class RemoteEmbeddings(Embeddings):
+    """The service's embedding model and cache, for the answer cache and anything else that embeds"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def embed_documents(self, texts):
+        return self.client.call("embed_documents", list(texts))
+
+    def embed_query(self, text):
+        return self.client.call("embed_query", text)
+
+    def stats(self):
+        return self.client.call("embedding_stats")
+
+
+class _SnapshotHolder:
+    """Stands in for the bot when refreshing a snapshot outside of it"""
+
+    def __init__(self, vectorstore):
+        self.vectorstore = vectorstore
+
+    def swap_index(self, vectorstore, index_version):
+        self.vectorstore = vectorstore
+
+
+def _index_fingerprint():
+    from index_store import source_fingerprint
+
+    return source_fingerprint(URLS, CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS, EMBEDDING_MODEL)
+
+
+def _build_snapshot():
+    """Load or build the snapshot, in a child process; returns the urls that failed to load
+
+    A build that missed pages is saved as `<index_dir>.partial` rather than
+    as the live snapshot; the service serves it until a refresh completes it.
+    """
+    from embedding_backends import make_embeddings
+    from ingest import build_index
+
+    configure_logging()
+    _, failed = build_index(make_embeddings(os.environ.get("OPENAI_API_KEY")))
+    return failed
+
+
+def _refresh_snapshot():
+    """Re-crawl and update the snapshot, in a child process; returns the failed urls, or None if unchanged"""
+    from embedding_backends import make_embeddings
+    from ingest import open_latest_snapshot
+    from refresher import IndexRefresher
+
+    configure_logging()
+    embeddings = make_embeddings(os.environ.get("OPENAI_API_KEY"))
+    vectorstore, _ = open_latest_snapshot(embeddings, INDEX_DIR, _index_fingerprint())
+    if vectorstore is None:
+        return _build_snapshot()
+    # A partial snapshot gets the pages it missed added
+    refresher = IndexRefresher(_SnapshotHolder(vectorstore), embeddings, 0)
+    if refresher.refresh_once():
+        return refresher.failed
+    return None
+
+
+def _run_step(fn, conn):
+    """Body of a build step's process: send back (True, result) or (False, error)"""
+    try:
+        conn.send((True, fn()))
+    except Exception as e:
+        logger.exception("retrieval service build step failed")
+        conn.send((False, f"{type(e).__name__}: {e}"))
+    finally:
+        conn.close()
+
+
+class _BuildStep:
+    """A build step running in a freshly spawned process
+
+    The supervisor polls it from its loop, so it keeps replacing dead
+    workers during a long re-crawl, and it starts no threads that a later
+    fork would copy.
+    """
+
+    def __init__(self, fn):
+        context = multiprocessing.get_context("spawn")
+        self._conn, child_conn = context.Pipe(duplex=False)
+        self.process = context.Process(target=_run_step, args=(fn, child_conn), name="retrieval-build")
+        self.process.start()
+        child_conn.close()
+
+    def done(self):
+        # Also true once the process died without replying: that reads as EOF
+        return self._conn.poll()
+
+    def result(self):
+        try:
+            ok, value = self._conn.recv()
+        except EOFError:
+            raise RuntimeError(f"build process exited with {self.process.exitcode}") from None
+        finally:
+            self._conn.close()
+            self.process.join()
+        if not ok:
+            raise RuntimeError(value)
+        return value
+
+    def cancel(self):
+        self.process.terminate()
+        self.process.join()
+        self._conn.close()
+
+
+class _Draining(Exception):
+    """Raised in a worker's accept loop when the supervisor retires it"""
+
+
+def _serve_connection(conn, handlers, version, draining):
+    with conn:
+        while True:
+            # Idle connections close once the worker drains; a request already sent is still answered
+            while not conn.poll(DRAIN_POLL):
+                if draining.is_set():
+                    return
+            try:
+                method, args = conn.recv()
+            except (EOFError, OSError):
+                return
+            with collect() as trace:
+                try:
+                    status, value = "ok", handlers[method](*args)
+                except Exception as e:
+                    logger.exception("retrieval service %s failed", method)
+                    status, value = "error", f"{type(e).__name__}: {e}"
+            stages = [(entry["stage"], entry["ms"] / 1000) for entry in trace.stages]
+            try:
+                conn.send((status, value, stages, version))
+            except OSError:
+                return
+
+
+def _worker_main(listener, retriever, embeddings, status):
+    """Accept connections and serve each on its own thread
+
+    On SIGTERM the worker stops accepting, answers the requests it has
+    already received, closes idle connections and exits.
+    """
+    draining = threading.Event()
+
+    def drain(*_):
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        draining.set()
+        raise _Draining()
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, drain)
+    embeddings.reopen()
+    status = dict(status, pid=os.getpid())
+
+    def retrieve(query):
+        return [(doc.page_content, doc.metadata) for doc in retriever.get_relevant_documents(query)]
+
+    handlers = {
+        "retrieve": retrieve,
+        "embed_query": embeddings.embed_query,
+        "embed_documents": embeddings.embed_documents,
+        "embedding_stats": embeddings.stats,
+        "stats": lambda: dict(retriever.stats(), worker=status),
+        "status": lambda: status
+    }
+    threads = []
+    try:
+        while True:
+            try:
+                conn = listener.accept()
+            except (AuthenticationError, EOFError, ConnectionError) as e:
+                logger.warning("rejected retrieval service connection: %s", e)
+                continue
+            thread = threading.Thread(target=_serve_connection,
+                                      args=(conn, handlers, status["index_version"], draining),
+                                      name="retrieval-conn", daemon=True)
+            thread.start()
+            threads = [thread for thread in threads if thread.is_alive()] + [thread]
+    except _Draining:
+        pass
+    for thread in threads:
+        thread.join()
+
+
+class RetrievalService:
+    """Supervisor of the retrieval worker pool
+
+    Workers are forked after the retriever is built, so they start
+    instantly and share its large buffers. Dead workers are replaced, and
+    each index refresh rolls over to a new generation of workers.
+
+    The supervisor loads the embedding model so that workers share its
+    weights, but never runs it or any crawl: builds and refreshes run in
+    spawned processes. Each worker resets the model's thread pool after
+    the fork (`CachedEmbeddings.reopen`).
+    """
+
+    def __init__(self, address, workers, index_dir=INDEX_DIR, refresh_interval=0.0, drain_timeout=None):
+        self.address = address
+        self.workers = workers
+        self.index_dir = index_dir
+        self.refresh_interval = refresh_interval
+        self.drain_timeout = RETRIEVAL_SERVICE_TIMEOUT if drain_timeout is None else drain_timeout
+        self._stop = threading.Event()
+        self._processes = []
+        self._retiring = []
+        self._listener = None
+        self._generation = None
+        self._refreshing = None
+        self._failed = []
+
+    def _load(self):
+        """(retriever, embeddings, status) over the newest servable snapshot"""
+        from embedding_backends import make_embeddings
+        from index_store import read_manifest
+        from ingest import open_latest_snapshot
+        from retrieval import HybridRetriever
+
+        embeddings = make_embeddings(os.environ.get("OPENAI_API_KEY"))
+        vectorstore, path = open_latest_snapshot(embeddings, self.index_dir, _index_fingerprint())
+        if vectorstore is None:
+            raise RuntimeError(f"no index snapshot to serve in {self.index_dir}")
+        retriever = HybridRetriever(vectorstore=vectorstore, k=CONTEXT_MAX_K, use_reranker=RERANKER_ENABLED)
+        status = {
+            "index_version": read_manifest(path)["version"],
+            "chunks": vectorstore.index.ntotal,
+            "failed": list(self._failed)
+        }
+        return retriever, embeddings, status
+
+    def _start_generation(self):
+        retriever, embeddings, status = self._load()
+        self._generation = (retriever, embeddings, status)
+        # Free the previous generation, then keep the collector from touching
+        # (and so un-sharing) everything the workers inherit
+        gc.unfreeze()
+        gc.collect()
+        gc.freeze()
+        context = multiprocessing.get_context("fork")
+        processes = []
+        for _ in range(self.workers):
+            process = context.Process(target=_worker_main, args=(self._listener, retriever, embeddings, status),
+                                      name="retrieval-worker", daemon=True)
+            process.start()
+            processes.append(process)
+        old, self._processes = self._processes, processes
+        self._retire(old)
+        logger.info("retrieval service: %d workers on %s, index %s (%d chunks)",
+                    self.workers, self.address, status["index_version"][:12], status["chunks"])
+
+    def _retire(self, processes):
+        """Tell workers to drain; `_reap` kills any still running after `drain_timeout`"""
+        deadline = time.monotonic() + self.drain_timeout
+        for process in processes:
+            process.terminate()
+            self._retiring.append((process, deadline))
+
+    def _reap(self, wait=False):
+        retiring = []
+        for process, deadline in self._retiring:
+            if wait:
+                process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive() and time.monotonic() >= deadline:
+                logger.warning("retrieval worker %d still busy after %.0fs, killing it", process.pid, self.drain_timeout)
+                process.kill()
+                process.join()
+            elif process.is_alive():
+                retiring.append((process, deadline))
+            else:
+                process.join()
+        self._retiring = retiring
+
+    def _replace_dead(self):
+        retriever, embeddings, status = self._generation
+        context = multiprocessing.get_context("fork")
+        for i, process in enumerate(self._processes):
+            if not process.is_alive():
+                logger.warning("retrieval worker %d exited with %s, restarting", process.pid, process.exitcode)
+                process = context.Process(target=_worker_main, args=(self._listener, retriever, embeddings, status),
+                                          name="retrieval-worker", daemon=True)
+                process.start()
+                self._processes[i] = process
+
+    def serve_forever(self):
+        self._failed = _BuildStep(_build_snapshot).result()
+        for url in self._failed:
+            logger.warning("could not load %s", url)
+
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+        self._listener = Listener(self.address, family="AF_UNIX", authkey=service_authkey(self.address, create=True))
+        os.chmod(self.address, 0o600)
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda *_: self._stop.set())
+        try:
+            self._start_generation()
+            next_refresh = time.monotonic() + self.refresh_interval
+            while not self._stop.wait(1.0):
+                self._replace_dead()
+                self._reap()
+                if self._refreshing is not None and self._refreshing.done():
+                    self._finish_refresh()
+                if self.refresh_interval > 0 and self._refreshing is None and time.monotonic() >= next_refresh:
+                    next_refresh = time.monotonic() + self.refresh_interval
+                    self._refreshing = _BuildStep(_refresh_snapshot)
+        finally:
+            if self._refreshing is not None:
+                self._refreshing.cancel()
+            self._listener.close()
+            self._retire(self._processes)
+            self._reap(wait=True)
+            logger.info("retrieval service stopped")
+
+    def _finish_refresh(self):
+        step, self._refreshing = self._refreshing, None
+        try:
+            failed = step.result()
+        except Exception:
+            logger.exception("index refresh failed")
+            return
+        if failed is not None:
+            self._failed = failed
+            self._start_generation()
+
+    def stop(self):
+        self._stop.set()
+
+
+if __name__ == "__main__":
+    configure_logging()
+    RetrievalService(
+        RETRIEVAL_SERVICE_ADDRESS or "retrieval.sock",
+        RETRIEVAL_SERVICE_WORKERS,
+        refresh_interval=REFRESH_INTERVAL
+    ).serve_forever()
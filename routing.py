@@ -0,0 +1,329 @@
+"""Routing of user queries shared by the Streamlit UI and the HTTP API
+
+Queries are scored by a small TF-IDF + logistic regression classifier
+trained on `intent_examples.jsonl`, with matches of compiled per-intent
+phrases added to the scores as extra evidence. Only requests for a
+consultant or for contact details get a canned reply, and only when the
+classifier is confident; everything else goes to the RAG chain, including
+technical issues and complaints, which the system prompt troubleshoots
+before escalating.
+"""
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+
+import numpy as np
+
+from settings import ROUTER_CANNED_CONFIDENCE, ROUTER_CANNED_INTENTS, ROUTER_EXAMPLES_PATH, ROUTER_MIN_CONFIDENCE
+from tracing import METRICS, record_stage
+
+logger = logging.getLogger(__name__)
+
+# Shown when answering fails, so the user still has somewhere to go
+ERROR_RESPONSE = "I encountered an error processing your request. Let me connect you with our support team who can help:\n\n📧 Email: support@teq3.ai\n💬 Live Chat: teq3.ai (fastest option!)\n⏰ Response time: Usually within 2-4 hours"
+
+GENERAL = "general"
+
+# Phrases that point at an intent. They are evidence for the classifier, not
+# a verdict: each match adds PHRASE_WEIGHT to that intent's score. Keep them
+# specific; single words like "cost" or "refund" also show up in questions
+# the knowledge base answers.
+INTENT_PHRASES = {
+    "consultant_interest": [
+        "speak to someone", "talk to human", "talk to a human", "human advisor", "real person",
+        "schedule call", "schedule a call", "book consultation", "book a consultation",
+        "arrange meeting", "arrange a meeting", "connect me with"
+    ],
+    "technical": [
+        "payment failed", "can't buy", "cannot buy", "can't log in", "cannot log in", "can't login",
+        "forgot my password", "reset my password", "not loading", "website is not working",
+        "website is down", "error message", "charged twice"
+    ],
+    "complaint": [
+        "make a complaint", "file a complaint", "terrible experience", "terrible service",
+        "awful service", "poor service", "bad service"
+    ],
+    "contact": [
+        "contact you", "contact details", "contact information", "contact email", "your email address",
+        "your phone number", "get in touch", "reach you", "your office", "where are you located"
+    ],
+    "pricing": [
+        "payment plan", "payment plans", "installments", "tuition fees"
+    ],
+    "schedule": [
+        "next cohort", "start date", "class schedule", "class times", "timetable", "next intake"
+    ]
+}
+PHRASE_WEIGHT = 2.0
+
+
+def compile_phrases(phrases):
+    """One regex matching any of the phrases as whole words, longest first"""
+    alternatives = sorted((re.escape(phrase) for phrase in phrases), key=len, reverse=True)
+    return re.compile(r"\b(?:" + "|".join(alternatives) + r")\b", re.IGNORECASE)
+
+
+INTENT_PATTERNS = {intent: compile_phrases(phrases) for intent, phrases in INTENT_PHRASES.items()}
+
+
+def load_examples(path=ROUTER_EXAMPLES_PATH):
+    """(texts, intents) of the labeled training queries"""
+    texts, intents = [], []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                example = json.loads(line)
+                texts.append(example["text"])
+                intents.append(example["intent"])
+    return texts, intents
+
+
+class IntentClassifier:
+    """TF-IDF over word and character n-grams with a logistic regression
+
+    Trained with scikit-learn, then flattened into per-term weight tables:
+    scoring one short query in plain Python skips the pipeline overhead
+    and takes tens of microseconds.
+    """
+
+    def __init__(self, texts, intents):
+        from scipy.sparse import hstack
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.linear_model import LogisticRegression
+
+        vectorizers = [
+            TfidfVectorizer(ngram_range=(1, 2), sublinear_tf=True),
+            TfidfVectorizer(analyzer="char_wb", ngram_range=(2, 4), sublinear_tf=True)
+        ]
+        features = hstack([vectorizer.fit_transform(texts) for vectorizer in vectorizers]).tocsr()
+        model = LogisticRegression(C=10, max_iter=1000).fit(features, intents)
+
+        self.classes = list(model.classes_)
+        self.intercept = model.intercept_
+        self.weights = np.ascontiguousarray(model.coef_.T)
+        self._tables = []
+        offset = 0
+        for vectorizer in vectorizers:
+            table = {
+                term: (offset + column, vectorizer.idf_[column])
+                for term, column in vectorizer.vocabulary_.items()
+            }
+            self._tables.append((vectorizer.build_analyzer(), table))
+            offset += len(vectorizer.vocabulary_)
+
+    def predict(self, query, hints=()):
+        """(intent, probability) of the most likely intent
+
+        Each intent in `hints` gets PHRASE_WEIGHT added to its score.
+        """
+        rows, values = [], []
+        for analyze, table in self._tables:
+            counts = Counter(term for term in analyze(query) if term in table)
+            tfidf = [(1 + math.log(count)) * table[term][1] for term, count in counts.items()]
+            norm = math.sqrt(sum(value * value for value in tfidf)) or 1.0
+            rows.extend(table[term][0] for term in counts)
+            values.extend(value / norm for value in tfidf)
+        scores = self.intercept + np.asarray(values) @ self.weights[rows] if rows else self.intercept.copy()
+        for intent in hints:
+            if intent in self.classes:
+                scores[self.classes.index(intent)] += PHRASE_WEIGHT
+        probabilities = np.exp(scores - scores.max())
+        probabilities /= probabilities.sum()
+        best = int(probabilities.argmax())
+        return self.classes[best], float(probabilities[best])
+
+
+@dataclass
+class Route:
+    """Where a query goes: a canned `answer`, or the RAG chain when it is None"""
+    intent: str
+    source: str
+    confidence: float
+    answer: str = None
+
+
+class IntentRouter:
+    """Classifier with phrase matches as evidence; canned answers only when it is confident
+
+    Predictions below `min_confidence` count as general. A canned answer
+    also needs `canned_confidence` and an intent in `canned_intents`.
+    Without a classifier a phrase match only labels the query (at
+    `min_confidence`), so it still goes to the RAG chain.
+    """
+
+    def __init__(self, classifier=None, min_confidence=0.6, canned_intents=None, canned_confidence=0.85):
+        self.classifier = classifier
+        self.min_confidence = min_confidence
+        self.canned_confidence = canned_confidence
+        self.canned_intents = set(ROUTER_CANNED_INTENTS if canned_intents is None else canned_intents)
+
+    def _classify(self, query):
+        hints = [intent for intent, pattern in INTENT_PATTERNS.items() if pattern.search(query)]
+        if self.classifier is not None:
+            intent, confidence = self.classifier.predict(query, hints)
+            source = "classifier+pattern" if hints else "classifier"
+            if intent != GENERAL and confidence >= self.min_confidence:
+                return intent, source, confidence
+            return GENERAL, source, confidence
+        if hints:
+            return hints[0], "pattern", self.min_confidence
+        return GENERAL, "default", 0.0
+
+    def route(self, query):
+        start = time.perf_counter()
+        intent, source, confidence = self._classify(query)
+        answer = None
+        if intent in self.canned_intents and intent in CANNED_ANSWERS and confidence >= self.canned_confidence:
+            answer = CANNED_ANSWERS[intent]()
+        elapsed = time.perf_counter() - start
+        record_stage("route", elapsed, intent=intent, source=source)
+        METRICS.inc("teq3_routes_total", intent=intent, source=source, canned=str(answer is not None).lower())
+        logger.info("route intent=%s source=%s confidence=%.2f canned=%s elapsed=%.3fms",
+                    intent, source, confidence, answer is not None, elapsed * 1000)
+        return Route(intent, source, confidence, answer)
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def default_router():
+    """Shared router, trained on first use"""
+    global _router
+    with _router_lock:
+        if _router is None:
+            classifier = None
+            if os.path.exists(ROUTER_EXAMPLES_PATH):
+                classifier = IntentClassifier(*load_examples(ROUTER_EXAMPLES_PATH))
+            else:
+                logger.warning("no intent examples at %s, no canned answers", ROUTER_EXAMPLES_PATH)
+            _router = IntentRouter(
+                classifier, ROUTER_MIN_CONFIDENCE, ROUTER_CANNED_INTENTS, ROUTER_CANNED_CONFIDENCE
+            )
+        return _router
+
+
+def route_query(query):
+    """Route a query with the shared router"""
+    return default_router().route(query)
+
+
+def categorize_query(query):
+    """Categorize user queries for smart routing"""
+    return route_query(query).intent
+
+
+def handle_career_consultation():
+    """Provide career consultation information"""
+    return """That's fantastic! 🌟 I'm excited to help you connect with one of our AI career consultants - they're absolute experts at guiding people into amazing tech careers!
+
+Here's how to reach our career consultation team:
+   🌐 Visit: teq3.ai/contact
+   📧 Email: careers@teq3.ai  
+   📞 Phone: [Career consultation number]
+   📋 Or fill out our consultation request form on our website
+
+Our consultants are incredible at providing:
+   🎯 Personalized course selection based on your goals
+   📈 Career transition planning and strategy
+   💰 Job market insights and salary expectations  
+   🏆 Portfolio development and project guidance
+   🤝 Industry networking and job search support
+   ✅ Leveraging our 100% Job Guarantee program
+
+They offer consultations via phone, video call, or even in-person if you're local! 
+
+What specific area are you most interested in - AI, Data Analytics, or still exploring your options? 🤔"""
+
+
+def handle_technical_support():
+    """Provide technical support contact information"""
+    return """I understand you're experiencing a technical issue! 🛠️ Don't worry, our technical support team is here to help.
+
+Our tech support can assist with:
+   • Payment and billing problems 💳
+   • Account access issues 🔐
+   • Platform technical difficulties 💻
+   • Purchase and enrollment problems 📝
+
+Here's how to get help:
+   📧 Email: support@teq3.ai
+   📞 Phone: [Available on our website]
+   💬 Live Chat: Check teq3.ai for instant support
+   ⏰ Support Hours: We're here when you need us!
+
+For the fastest response, I'd recommend checking our website for live chat options. Is there anything else about your career goals I can help you with while you're here? 😊"""
+
+
+def handle_complaint():
+    """Handle complaints with appropriate routing"""
+    return """I'm really sorry to hear about your concern! 😔 Your feedback is super important to us, and I want to make sure you get the best possible help.
+
+Let me connect you with the right team:
+
+🎯 For course or program concerns:
+   📧 careers@teq3.ai | 📞 [Career team number]
+   They're amazing at addressing program questions and providing personalized guidance!
+
+🔧 For technical, billing, or platform issues:
+   📧 support@teq3.ai | 📞 [Tech support number]
+   Our tech wizards can sort out any platform problems
+
+📋 For general feedback or escalated concerns:
+   📧 hello@teq3.ai | 📞 [Main contact number]
+   Direct line to our customer care team
+
+Would you like me to help you get connected with the most appropriate team? I'm here to make sure you get the support you deserve! 💪"""
+
+
+def handle_contact():
+    """Provide TEQ3 contact details"""
+    return """Happy to help you get in touch! 😊 Here's how to reach the TEQ3 team:
+
+   🌐 Visit: teq3.ai/contact
+   📧 Career questions: careers@teq3.ai
+   🔧 Technical or billing help: support@teq3.ai
+   📋 Everything else: hello@teq3.ai
+   💬 Live Chat: on teq3.ai (fastest option!)
+
+Is there anything about our AI or Data Analytics programs I can help you with in the meantime? 🚀"""
+
+
+def handle_pricing():
+    """Point to current pricing and payment options"""
+    return """Great question! 💰 Program fees and payment options can change between cohorts, so I don't want to quote you an outdated number.
+
+Here's where to find the current pricing:
+   🌐 Each program page on teq3.ai lists its latest fees
+   📧 careers@teq3.ai can walk you through payment plans and any discounts or scholarships available
+   🎯 Our career consultants can also help you weigh the cost against the 100% Job Guarantee program
+
+Which program are you considering - AI or Data Analytics? I can tell you more about what's included! 😊"""
+
+
+def handle_schedule():
+    """Point to current cohort dates and schedules"""
+    return """Love that you're ready to get started! 📅 Cohort start dates and class schedules are updated regularly, so the best place to check is:
+
+   🌐 The program pages on teq3.ai for upcoming start dates
+   📧 careers@teq3.ai to ask about class times and weekly time commitment
+   🎯 Or book a quick chat with a career consultant to plan around your current job
+
+Which program are you interested in - AI or Data Analytics? I'm happy to tell you more about how it works! 😊"""
+
+
+# Canned replies by intent; only those enabled in TEQ3_ROUTER_CANNED_INTENTS are used
+CANNED_ANSWERS = {
+    "consultant_interest": handle_career_consultation,
+    "technical": handle_technical_support,
+    "complaint": handle_complaint,
+    "contact": handle_contact,
+    "pricing": handle_pricing,
+    "schedule": handle_schedule
+}
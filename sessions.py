@@ -0,0 +1,159 @@
+"""Per-session conversation history with bounded size and expiry"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from settings import (
+    SESSION_BACKEND, SESSION_DIR, SESSION_MAX, SESSION_MAX_TURNS, SESSION_REDIS_URL, SESSION_TTL
+)
+
+
+class DiskBackend:
+    """One JSON file per session in a local directory"""
+
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, session_id):
+        return os.path.join(self.path, hashlib.sha1(session_id.encode("utf-8")).hexdigest() + ".json")
+
+    def load(self, session_id):
+        path = self._file(session_id)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, session_id, state):
+        path = self._file(session_id)
+        # Other processes may be saving the same session into this directory
+        tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+
+    def delete(self, session_id):
+        try:
+            os.remove(self._file(session_id))
+        except OSError:
+            pass
+
+
+class RedisBackend:
+    """Sessions stored in any Redis-compatible server, expired by the server"""
+
+    def __init__(self, url, ttl, prefix="teq3:session:"):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def load(self, session_id):
+        raw = self.client.get(self.prefix + session_id)
+        return json.loads(raw) if raw else None
+
+    def save(self, session_id, state):
+        self.client.set(self.prefix + session_id, json.dumps(state), ex=int(self.ttl))
+
+    def delete(self, session_id):
+        self.client.delete(self.prefix + session_id)
+
+
+class SessionStore:
+    """Chat history per session id
+
+    Each session's state is `{"summary": str, "turns": [[q, a], ...]}`,
+    keeping at most `max_turns` turns. Without a backend, sessions live in
+    an in-process LRU capped at `max_sessions` entries, each expiring `ttl`
+    seconds after its last use. A backend persists sessions so they survive
+    restarts and can be shared between processes; it is then read on every
+    `get`, so a turn always starts from what any process saved last.
+    """
+
+    def __init__(self, max_sessions=1000, ttl=3600, max_turns=50, backend=None):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_turns = max_turns
+        self.backend = backend
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _new_state(self):
+        return {"summary": "", "turns": []}
+
+    def _evict(self, now):
+        # Entries are kept in last-used order, so expired ones sit at the front
+        while self._sessions:
+            session_id, (touched, _) = next(iter(self._sessions.items()))
+            if now - touched <= self.ttl and len(self._sessions) <= self.max_sessions:
+                break
+            self._sessions.popitem(last=False)
+
+    def _load(self, session_id):
+        now = time.time()
+        entry = self._sessions.get(session_id)
+        state = entry[1] if entry is not None and now - entry[0] <= self.ttl else self._new_state()
+        self._sessions[session_id] = (now, state)
+        self._sessions.move_to_end(session_id)
+        self._evict(now)
+        return state
+
+    def get(self, session_id):
+        """Return a copy of the session's state: its summary and (question, answer) turns"""
+        if self.backend:
+            state = self.backend.load(session_id) or self._new_state()
+        else:
+            with self._lock:
+                state = self._load(session_id)
+        return {"summary": state.get("summary", ""), "turns": [list(turn) for turn in state["turns"]]}
+
+    def save(self, session_id, state):
+        """Replace the session's state after a completed turn"""
+        state = {"summary": state.get("summary", ""), "turns": state["turns"][-self.max_turns:]}
+        if self.backend:
+            self.backend.save(session_id, state)
+            return
+        with self._lock:
+            now = time.time()
+            self._sessions[session_id] = (now, state)
+            self._sessions.move_to_end(session_id)
+            self._evict(now)
+
+    def clear(self, session_id):
+        """Forget everything about a session"""
+        if self.backend:
+            self.backend.delete(session_id)
+            return
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def __len__(self):
+        with self._lock:
+            self._evict(time.time())
+            return len(self._sessions)
+
+
+def make_session_store():
+    """Session store configured from settings"""
+    if SESSION_BACKEND == "redis":
+        backend = RedisBackend(SESSION_REDIS_URL, SESSION_TTL)
+    elif SESSION_BACKEND == "disk":
+        backend = DiskBackend(SESSION_DIR, SESSION_TTL)
+    else:
+        backend = None
+    return SessionStore(
+        max_sessions=SESSION_MAX,
+        ttl=SESSION_TTL,
+        max_turns=SESSION_MAX_TURNS,
+        backend=backend
+    )
@@ -0,0 +1,182 @@
+"""Shared configuration for the TEQ3AI chatbot"""
+import os
+
+# Pages that make up the CareerGPT knowledge base
+URLS = [
+    "https://www.teq3.ai/",
+    "https://www.teq3.ai/about-us",
+    "https://www.teq3.ai/courses",
+    "https://www.teq3.ai/programs",
+    "https://www.teq3.ai/data-analytics",
+    "https://www.teq3.ai/artificial-intelligence",
+    "https://www.teq3.ai/contact",
+    "https://www.teq3.ai/services"
+]
+
+# Crawling
+CRAWL_WORKERS = int(os.environ.get("TEQ3_CRAWL_WORKERS", "8"))
+CRAWL_TIMEOUT = float(os.environ.get("TEQ3_CRAWL_TIMEOUT", "10"))
+CRAWL_RETRIES = int(os.environ.get("TEQ3_CRAWL_RETRIES", "3"))
+CRAWL_STATE_DIR = os.environ.get("TEQ3_CRAWL_STATE_DIR", "crawl_state")
+# Read pages from local html files instead of the network (for offline runs)
+CRAWL_FIXTURE_DIR = os.environ.get("TEQ3_CRAWL_FIXTURE_DIR") or None
+# Site discovery: URLS are seeds, plus the pages in CRAWL_SITEMAPS and in-domain links from there.
+# "0" fetches just URLS, as before.
+CRAWL_DISCOVERY = os.environ.get("TEQ3_CRAWL_DISCOVERY", "1") == "1"
+CRAWL_SITEMAPS = [
+    url.strip() for url in os.environ.get("TEQ3_CRAWL_SITEMAPS", "https://www.teq3.ai/sitemap.xml").split(",")
+    if url.strip()
+]
+CRAWL_FOLLOW_LINKS = os.environ.get("TEQ3_CRAWL_FOLLOW_LINKS", "1") == "1"
+CRAWL_RESPECT_ROBOTS = os.environ.get("TEQ3_CRAWL_RESPECT_ROBOTS", "1") == "1"
+# Link hops followed from a seed, and the most urls the frontier will hold
+CRAWL_MAX_DEPTH = int(os.environ.get("TEQ3_CRAWL_MAX_DEPTH", "3"))
+CRAWL_MAX_PAGES = int(os.environ.get("TEQ3_CRAWL_MAX_PAGES", "500"))
+# Politeness: requests in flight to one host, and seconds between their starts (robots.txt Crawl-delay wins if longer)
+CRAWL_HOST_CONCURRENCY = int(os.environ.get("TEQ3_CRAWL_HOST_CONCURRENCY", "2"))
+CRAWL_HOST_DELAY = float(os.environ.get("TEQ3_CRAWL_HOST_DELAY", "0.5"))
+# Seconds before a fetched page is due again; the frontier database keeps this across runs
+CRAWL_RECRAWL_AFTER = float(os.environ.get("TEQ3_CRAWL_RECRAWL_AFTER", "21600"))
+CRAWL_FRONTIER_PATH = os.environ.get("TEQ3_CRAWL_FRONTIER", os.path.join(CRAWL_STATE_DIR, "frontier.sqlite3"))
+
+# Chunking: sections are split to a token budget, near-duplicates within
+# CHUNK_DUPLICATE_BITS SimHash bits are indexed once. Chunks shorter than
+# CHUNK_DUPLICATE_MIN_WORDS words are only deduplicated when identical.
+CHUNK_TOKENS = int(os.environ.get("TEQ3_CHUNK_TOKENS", "300"))
+CHUNK_OVERLAP_TOKENS = int(os.environ.get("TEQ3_CHUNK_OVERLAP_TOKENS", "30"))
+CHUNK_DUPLICATE_BITS = int(os.environ.get("TEQ3_CHUNK_DUPLICATE_BITS", "3"))
+CHUNK_DUPLICATE_MIN_WORDS = int(os.environ.get("TEQ3_CHUNK_DUPLICATE_MIN_WORDS", "32"))
+
+# Embeddings: "openai" or "local" (CPU sentence embeddings via transformers)
+EMBEDDING_BACKEND = os.environ.get("TEQ3_EMBEDDING_BACKEND", "openai")
+_DEFAULT_EMBEDDING_MODELS = {
+    "openai": "text-embedding-ada-002",
+    "local": "sentence-transformers/all-MiniLM-L6-v2"
+}
+EMBEDDING_MODEL = os.environ.get("TEQ3_EMBEDDING_MODEL", _DEFAULT_EMBEDDING_MODELS.get(EMBEDDING_BACKEND, ""))
+LOCAL_EMBEDDING_BATCH_SIZE = int(os.environ.get("TEQ3_LOCAL_EMBEDDING_BATCH_SIZE", "32"))
+LOCAL_EMBEDDING_THREADS = int(os.environ.get("TEQ3_LOCAL_EMBEDDING_THREADS", "0")) or None
+LOCAL_EMBEDDING_QUANTIZE = os.environ.get("TEQ3_LOCAL_EMBEDDING_QUANTIZE", "0") == "1"
+QUERY_EMBEDDING_CACHE_SIZE = int(os.environ.get("TEQ3_QUERY_EMBEDDING_CACHE_SIZE", "1024"))
+
+# SQLite file caching chunk embeddings by content hash
+EMBEDDING_CACHE_PATH = os.environ.get("TEQ3_EMBEDDING_CACHE", "embedding_cache.sqlite3")
+
+# Directory holding the on-disk FAISS index snapshot
+INDEX_DIR = os.environ.get("TEQ3_INDEX_DIR", "index_snapshot")
+# Index layout: "flat" (exact float32 index, chunk texts in memory), "compressed" (quantized index,
+# memory-mapped compressed chunk store) or "auto" (compressed once there are more than INDEX_FLAT_MAX chunks)
+INDEX_MODE = os.environ.get("TEQ3_INDEX_MODE", "auto")
+# Compressed layout: exact search up to INDEX_FLAT_MAX chunks, HNSW + SQ8 up to INDEX_HNSW_MAX, IVF + PQ beyond
+INDEX_FLAT_MAX = int(os.environ.get("TEQ3_INDEX_FLAT_MAX", "10000"))
+INDEX_HNSW_MAX = int(os.environ.get("TEQ3_INDEX_HNSW_MAX", "250000"))
+# Search-time recall/latency trade-off of the HNSW and IVF indexes
+INDEX_EF_SEARCH = int(os.environ.get("TEQ3_INDEX_EF_SEARCH", "64"))
+INDEX_NPROBE = int(os.environ.get("TEQ3_INDEX_NPROBE", "16"))
+# Chunks embedded per batch while streaming a build; bounds memory along with the on-disk spool
+INDEX_BUILD_BATCH = int(os.environ.get("TEQ3_INDEX_BUILD_BATCH", "256"))
+# Chunks per compressed block; larger blocks compress better but cost more to read one chunk
+DOCSTORE_BLOCK_SIZE = int(os.environ.get("TEQ3_DOCSTORE_BLOCK_SIZE", "32"))
+# Seconds between background re-crawls of the site (0 disables)
+REFRESH_INTERVAL = float(os.environ.get("TEQ3_REFRESH_INTERVAL", "21600"))
+
+# Shared retrieval service (retrieval_service.py): a pool of worker processes holding one copy of the index.
+# With an address (a unix socket path) set, UI and API processes send retrieval and embedding calls there
+# instead of each loading the index and embedding model.
+RETRIEVAL_SERVICE_ADDRESS = os.environ.get("TEQ3_RETRIEVAL_SERVICE") or None
+RETRIEVAL_SERVICE_WORKERS = int(os.environ.get("TEQ3_RETRIEVAL_SERVICE_WORKERS", "0")) or os.cpu_count() or 1
+# Shared secret for the socket; by default a random key is written beside it, readable only by its owner
+RETRIEVAL_SERVICE_AUTHKEY = os.environ.get("TEQ3_RETRIEVAL_SERVICE_AUTHKEY") or None
+RETRIEVAL_SERVICE_TIMEOUT = float(os.environ.get("TEQ3_RETRIEVAL_SERVICE_TIMEOUT", "30"))
+
+# Per-session chat history
+SESSION_MAX = int(os.environ.get("TEQ3_SESSION_MAX", "1000"))
+SESSION_TTL = float(os.environ.get("TEQ3_SESSION_TTL", "3600"))
+SESSION_MAX_TURNS = int(os.environ.get("TEQ3_SESSION_MAX_TURNS", "50"))
+# "memory", "disk" or "redis"
+SESSION_BACKEND = os.environ.get("TEQ3_SESSION_BACKEND", "memory")
+SESSION_DIR = os.environ.get("TEQ3_SESSION_DIR", "sessions")
+SESSION_REDIS_URL = os.environ.get("TEQ3_SESSION_REDIS_URL", "redis://localhost:6379/0")
+
+# Chat history sent with each turn
+HISTORY_KEEP_TURNS = int(os.environ.get("TEQ3_HISTORY_KEEP_TURNS", "4"))
+HISTORY_MAX_TOKENS = int(os.environ.get("TEQ3_HISTORY_MAX_TOKENS", "1500"))
+SUMMARY_MODEL = os.environ.get("TEQ3_SUMMARY_MODEL", "gpt-3.5-turbo")
+
+# Semantic cache for answers to opening questions
+ANSWER_CACHE_ENABLED = os.environ.get("TEQ3_ANSWER_CACHE", "1") == "1"
+ANSWER_CACHE_THRESHOLD = float(os.environ.get("TEQ3_ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL = float(os.environ.get("TEQ3_ANSWER_CACHE_TTL", "86400"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("TEQ3_ANSWER_CACHE_MAX_ENTRIES", "2000"))
+
+# Retrieval
+RERANKER_ENABLED = os.environ.get("TEQ3_RERANKER", "0") == "1"
+# Retrieved chunks are packed into this many tokens of {context}, from at most CONTEXT_MAX_K chunks
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("TEQ3_CONTEXT_TOKEN_BUDGET", "1200"))
+CONTEXT_MAX_K = int(os.environ.get("TEQ3_CONTEXT_MAX_K", "8"))
+
+# Async request engine behind the chat handler
+ENGINE_ENABLED = os.environ.get("TEQ3_ENGINE", "1") == "1"
+# Chat turns in progress at once, across all sessions
+ENGINE_WORKERS = int(os.environ.get("TEQ3_ENGINE_WORKERS", "16"))
+# Limits of the OpenAI account, shared by every chat completion
+OPENAI_MAX_CONCURRENCY = int(os.environ.get("TEQ3_OPENAI_MAX_CONCURRENCY", "8"))
+OPENAI_RPM = int(os.environ.get("TEQ3_OPENAI_RPM", "500"))
+OPENAI_TPM = int(os.environ.get("TEQ3_OPENAI_TPM", "30000"))
+OPENAI_RETRIES = int(os.environ.get("TEQ3_OPENAI_RETRIES", "4"))
+OPENAI_BACKOFF = float(os.environ.get("TEQ3_OPENAI_BACKOFF", "0.5"))
+# Point chat completions at another server, e.g. mock_llm_server.py for load tests
+OPENAI_API_BASE = os.environ.get("TEQ3_OPENAI_API_BASE") or None
+
+# Headless HTTP API (api.py)
+API_HOST = os.environ.get("TEQ3_API_HOST", "127.0.0.1")
+API_PORT = int(os.environ.get("TEQ3_API_PORT", "8000"))
+# Comma-separated origins allowed to call the API from a browser
+API_CORS_ORIGINS = [
+    origin.strip() for origin in os.environ.get("TEQ3_API_CORS_ORIGINS", "https://teq3.ai,https://www.teq3.ai").split(",")
+    if origin.strip()
+]
+API_MAX_MESSAGE_CHARS = int(os.environ.get("TEQ3_API_MAX_MESSAGE_CHARS", "4000"))
+# Signs the session ids the API hands out, so a client can only use and clear its own sessions.
+# Without it a random key is used, and session ids don't survive an API restart.
+API_SESSION_SECRET = os.environ.get("TEQ3_API_SESSION_SECRET", "")
+
+# Streamlit chat view: messages shown before "Show earlier messages", and whether to show render timings
+CHAT_PAGE_SIZE = int(os.environ.get("TEQ3_CHAT_PAGE_SIZE", "20"))
+CHAT_SHOW_RENDER_TIME = os.environ.get("TEQ3_CHAT_SHOW_RENDER_TIME", "0") == "1"
+
+# Local intent routing in front of the RAG chain
+ROUTER_EXAMPLES_PATH = os.environ.get("TEQ3_ROUTER_EXAMPLES", "intent_examples.jsonl")
+# Classifier predictions below this probability go to the RAG chain
+ROUTER_MIN_CONFIDENCE = float(os.environ.get("TEQ3_ROUTER_MIN_CONFIDENCE", "0.6"))
+# Intents answered with a canned reply instead of the LLM. Technical issues
+# and complaints go to the LLM, which troubleshoots before escalating, and
+# the knowledge base answers pricing and schedule questions.
+ROUTER_CANNED_INTENTS = [
+    intent.strip() for intent in os.environ.get(
+        "TEQ3_ROUTER_CANNED_INTENTS", "consultant_interest,contact"
+    ).split(",") if intent.strip()
+]
+# A canned reply also needs the classifier to be at least this sure
+ROUTER_CANNED_CONFIDENCE = float(os.environ.get("TEQ3_ROUTER_CANNED_CONFIDENCE", "0.85"))
+
+# Model cascade: simple turns are answered by CASCADE_SMALL_MODEL, the rest by gpt-4-turbo
+CASCADE_ENABLED = os.environ.get("TEQ3_CASCADE", "1") == "1"
+CASCADE_SMALL_MODEL = os.environ.get("TEQ3_CASCADE_SMALL_MODEL", "gpt-3.5-turbo")
+# Questions longer than this go straight to the large model
+CASCADE_MAX_QUESTION_WORDS = int(os.environ.get("TEQ3_CASCADE_MAX_QUESTION_WORDS", "30"))
+# Share of the question's content words that must appear in the retrieved context for the small model
+CASCADE_MIN_TERM_COVERAGE = float(os.environ.get("TEQ3_CASCADE_MIN_TERM_COVERAGE", "0.5"))
+# Let the small model hand a turn up when the context isn't enough
+CASCADE_SELF_CHECK = os.environ.get("TEQ3_CASCADE_SELF_CHECK", "1") == "1"
+
+# Logging and tracing: log lines as "text" or "json", and a port for /metrics (plus the API's /stats
+# and /debug/profile) that is off by default (0) and only listens on METRICS_HOST
+LOG_FORMAT = os.environ.get("TEQ3_LOG_FORMAT", "text")
+LOG_LEVEL = os.environ.get("TEQ3_LOG_LEVEL", "INFO")
+METRICS_PORT = int(os.environ.get("TEQ3_METRICS_PORT", "0"))
+METRICS_HOST = os.environ.get("TEQ3_METRICS_HOST", "127.0.0.1")
+# Sampling profiler for hot-path analysis; folded stacks are written to PROFILE_PATH on exit
+PROFILE_ENABLED = os.environ.get("TEQ3_PROFILE", "0") == "1"
+PROFILE_INTERVAL = float(os.environ.get("TEQ3_PROFILE_INTERVAL", "0.005"))
+PROFILE_PATH = os.environ.get("TEQ3_PROFILE_PATH", "profile.folded")
@@ -0,0 +1,483 @@
+"""Sitemap-seeded site crawl with a persistent frontier and per-host politeness
+
+The frontier is a SQLite table of every url discovered so far with its
+fetch state, so an interrupted crawl picks up where it stopped and a
+re-crawl only fetches pages that are due: never fetched, older than
+`recrawl_after`, or listed in a sitemap with a newer <lastmod>.
+"""
+import gzip
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from urllib.parse import urldefrag, urljoin, urlsplit, urlunsplit
+from urllib.robotparser import RobotFileParser
+from xml.etree import ElementTree
+
+import requests
+from bs4 import BeautifulSoup, SoupStrainer
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+FETCHING = "fetching"
+DONE = "done"
+FAILED = "failed"
+GONE = "gone"
+BLOCKED = "blocked"
+
+# Links to these are never pages worth indexing
+SKIP_EXTENSIONS = (
+    ".pdf", ".png", ".jpg", ".jpeg", ".gif", ".svg", ".webp", ".ico", ".css", ".js", ".json", ".xml",
+    ".zip", ".gz", ".mp3", ".mp4", ".mov", ".avi", ".woff", ".woff2", ".ttf", ".doc", ".docx", ".xls",
+    ".xlsx", ".ppt", ".pptx"
+)
+# Statuses that mean the page is not there, as opposed to a transient failure
+GONE_STATUSES = {401, 403, 404, 410}
+
+
+def host_key(host):
+    """Host without a leading "www.", so both spellings count as one site"""
+    host = host.lower()
+    return host[4:] if host.startswith("www.") else host
+
+
+def normalize_url(url, base=None):
+    """Absolute http(s) url without fragment, default port or trailing slash; None if not a page link"""
+    if base is not None:
+        url = urljoin(base, url.strip())
+    url, _ = urldefrag(url)
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        return None
+    netloc = parts.hostname
+    if parts.port and parts.port != {"http": 80, "https": 443}[parts.scheme]:
+        netloc += f":{parts.port}"
+    path = parts.path or "/"
+    if len(path) > 1:
+        path = path.rstrip("/")
+    if path.lower().endswith(SKIP_EXTENSIONS):
+        return None
+    return urlunsplit((parts.scheme, netloc, path, parts.query, ""))
+
+
+def extract_links(html, base, allowed_hosts):
+    """Normalized links in a page that stay on `allowed_hosts` (compared with `host_key`)"""
+    links = []
+    seen = set()
+    for anchor in BeautifulSoup(html, "html.parser", parse_only=SoupStrainer("a", href=True)):
+        if anchor.get("rel") and "nofollow" in anchor["rel"]:
+            continue
+        url = normalize_url(anchor["href"], base)
+        if url and url not in seen and host_key(urlsplit(url).hostname) in allowed_hosts:
+            seen.add(url)
+            links.append(url)
+    return links
+
+
+def parse_lastmod(value):
+    """Epoch seconds of a sitemap <lastmod> (W3C datetime), or None"""
+    if not value:
+        return None
+    try:
+        moment = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+def parse_sitemap(body):
+    """(pages, sitemaps) listed in a sitemap or sitemap index
+
+    Pages are (url, lastmod) pairs; sitemaps are the urls of nested sitemaps.
+    """
+    if body[:2] == b"\x1f\x8b":
+        body = gzip.decompress(body)
+    root = ElementTree.fromstring(body)
+    pages, sitemaps = [], []
+    for entry in root:
+        fields = {child.tag.rsplit("}", 1)[-1]: (child.text or "").strip() for child in entry}
+        if not fields.get("loc"):
+            continue
+        if root.tag.endswith("sitemapindex"):
+            sitemaps.append(fields["loc"])
+        else:
+            pages.append((fields["loc"], parse_lastmod(fields.get("lastmod"))))
+    return pages, sitemaps
+
+
+class HostLimiter:
+    """Caps concurrent requests to each host and spaces out their starts
+
+    Each host gets `concurrency` slots, and consecutive requests to it
+    start at least `delay` seconds apart (or its robots.txt Crawl-delay,
+    if that is longer).
+    """
+
+    def __init__(self, concurrency=2, delay=0.5):
+        self.concurrency = concurrency
+        self.delay = delay
+        self._lock = threading.Lock()
+        self._slots = {}
+        self._delays = {}
+        self._next_start = {}
+
+    def set_delay(self, host, delay):
+        with self._lock:
+            self._delays[host] = max(delay, self.delay)
+
+    @contextmanager
+    def slot(self, host):
+        with self._lock:
+            semaphore = self._slots.setdefault(host, threading.Semaphore(self.concurrency))
+        semaphore.acquire()
+        try:
+            with self._lock:
+                now = time.monotonic()
+                start = max(now, self._next_start.get(host, now))
+                self._next_start[host] = start + self._delays.get(host, self.delay)
+            if start > now:
+                time.sleep(start - now)
+            yield
+        finally:
+            semaphore.release()
+
+
+class Frontier:
+    """Every known url of the site and its fetch state, in SQLite
+
+    A url is due when it is queued, or its `next_fetch_at` has passed:
+    `recrawl_after` seconds after a good fetch, after an exponential
+    backoff following a failure.
+    """
+
+    def __init__(self, path, recrawl_after=86400, retry_after=300):
+        self.recrawl_after = recrawl_after
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                host TEXT NOT NULL,
+                depth INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                next_fetch_at REAL NOT NULL,
+                fetched_at REAL,
+                lastmod REAL,
+                content_hash TEXT,
+                http_status INTEGER,
+                failures INTEGER NOT NULL DEFAULT 0,
+                error TEXT
+            );
+            CREATE INDEX IF NOT EXISTS pages_due ON pages (next_fetch_at);
+        """)
+        self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+
+    def add(self, url, depth, lastmod=None):
+        """Record a discovered url; True if it was new
+
+        A known page whose `lastmod` is newer than its last fetch becomes due.
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO pages (url, host, depth, status, next_fetch_at, lastmod) VALUES (?, ?, ?, ?, 0, ?)",
+                (url, urlsplit(url).hostname, depth, QUEUED, lastmod)
+            )
+            added = cursor.rowcount == 1
+            if not added:
+                self._conn.execute("UPDATE pages SET depth = MIN(depth, ?) WHERE url = ?", (depth, url))
+                if lastmod is not None:
+                    self._conn.execute(
+                        "UPDATE pages SET lastmod = ?, next_fetch_at = CASE WHEN status = ? AND fetched_at < ? "
+                        "THEN 0 ELSE next_fetch_at END WHERE url = ?",
+                        (lastmod, DONE, lastmod, url)
+                    )
+            self._conn.commit()
+        return added
+
+    def due(self, limit, now=None):
+        """Up to `limit` (url, depth) pairs due for fetching, shallowest first"""
+        now = time.time() if now is None else now
+        with self._lock:
+            return self._conn.execute(
+                "SELECT url, depth FROM pages WHERE status IN (?, ?, ?, ?) AND next_fetch_at <= ? "
+                "ORDER BY depth, next_fetch_at LIMIT ?",
+                (QUEUED, DONE, FAILED, GONE, now, limit)
+            ).fetchall()
+
+    def start(self, urls):
+        """Mark urls as being fetched so they aren't handed out twice"""
+        self._set_many(urls, FETCHING)
+
+    def reset_in_flight(self):
+        """Requeue fetches cut off by a crash or restart"""
+        with self._lock:
+            self._conn.execute("UPDATE pages SET status = ?, next_fetch_at = 0 WHERE status = ?", (QUEUED, FETCHING))
+            self._conn.commit()
+
+    def done(self, url, http_status, digest, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            self._conn.execute(
+                "UPDATE pages SET status = ?, fetched_at = ?, next_fetch_at = ?, content_hash = ?, http_status = ?, "
+                "failures = 0, error = NULL WHERE url = ?",
+                (DONE, now, now + self.recrawl_after, digest, http_status, url)
+            )
+            self._conn.commit()
+
+    def failed(self, url, http_status, error, now=None):
+        """Record a failed fetch; 4xx pages are gone until the next re-crawl, others retry with backoff"""
+        now = time.time() if now is None else now
+        with self._lock:
+            failures = self._conn.execute("SELECT failures FROM pages WHERE url = ?", (url,)).fetchone()
+            failures = (failures[0] if failures else 0) + 1
+            if http_status in GONE_STATUSES:
+                status, next_fetch_at = GONE, now + self.recrawl_after
+            else:
+                status = FAILED
+                next_fetch_at = now + min(self.retry_after * 2 ** (failures - 1), self.recrawl_after)
+            self._conn.execute(
+                "UPDATE pages SET status = ?, next_fetch_at = ?, http_status = ?, failures = ?, error = ? WHERE url = ?",
+                (status, next_fetch_at, http_status, failures, error, url)
+            )
+            self._conn.commit()
+        return status
+
+    def blocked(self, url):
+        """Disallowed by robots.txt; looked at again on the next re-crawl"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE pages SET status = ?, next_fetch_at = ? WHERE url = ?",
+                (BLOCKED, time.time() + self.recrawl_after, url)
+            )
+            self._conn.commit()
+
+    def _set_many(self, urls, status):
+        with self._lock:
+            self._conn.executemany("UPDATE pages SET status = ? WHERE url = ?", [(status, url) for url in urls])
+            self._conn.commit()
+
+    def urls(self, status=DONE):
+        """Urls in a status, in discovery depth order"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT url FROM pages WHERE status = ? ORDER BY depth, url", (status,)
+            ).fetchall()
+        return [url for url, in rows]
+
+    def stats(self):
+        """Number of urls in each status"""
+        with self._lock:
+            return dict(self._conn.execute("SELECT status, COUNT(*) FROM pages GROUP BY status").fetchall())
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SiteCrawler:
+    """Discover and fetch a site's pages through a persistent frontier
+
+    Seeds are `seeds` plus the pages in `sitemaps` (and any sitemaps that
+    robots.txt lists); fetched pages' in-domain links are followed up to
+    `max_depth` hops, and the frontier holds at most `max_pages` urls.
+    Pages are fetched by `fetcher` (a `crawler.Crawler`, which brings
+    conditional GETs, retries and fixture directories), at most
+    `max_workers` at a time and within the per-host limits.
+    """
+
+    def __init__(self, fetcher, frontier, seeds, sitemaps=(), allowed_hosts=None, max_pages=500, max_depth=3,
+                 follow_links=True, host_concurrency=2, host_delay=0.5, respect_robots=True):
+        self.fetcher = fetcher
+        self.frontier = frontier
+        self.seeds = [url for url in map(normalize_url, seeds) if url]
+        self.sitemaps = list(sitemaps)
+        if allowed_hosts is None:
+            allowed_hosts = [urlsplit(url).hostname for url in self.seeds]
+        self.allowed_hosts = {host_key(host) for host in allowed_hosts}
+        # Links to "teq3.ai" and "www.teq3.ai" are one page, spelled as in the seeds
+        self._hostnames = {host_key(urlsplit(url).hostname): urlsplit(url).hostname for url in reversed(self.seeds)}
+        self.max_pages = max_pages
+        self.max_depth = max_depth
+        self.follow_links = follow_links
+        self.respect_robots = respect_robots
+        self.hosts = HostLimiter(host_concurrency, host_delay)
+        self.failed = []
+        self._robots = {}
+        self._known = 0
+
+    # Fixture runs are offline, so there is no robots.txt or sitemap to read
+    @property
+    def _offline(self):
+        return bool(self.fetcher.fixture_dir)
+
+    def _get(self, url):
+        """Body of a robots.txt or sitemap, fetched within the host limits; None on failure"""
+        try:
+            with self.hosts.slot(urlsplit(url).hostname):
+                response = self.fetcher.session.get(url, timeout=self.fetcher.timeout)
+        except requests.RequestException as e:
+            logger.warning("could not fetch %s: %s", url, e)
+            return None
+        if not response.ok:
+            logger.info("could not fetch %s: HTTP %d", url, response.status_code)
+            return None
+        return response.content
+
+    def _robots_for(self, url):
+        parts = urlsplit(url)
+        origin = f"{parts.scheme}://{parts.netloc}"
+        if origin not in self._robots:
+            robots = RobotFileParser()
+            body = None if self._offline or not self.respect_robots else self._get(origin + "/robots.txt")
+            robots.parse(body.decode("utf-8", "replace").splitlines() if body else [])
+            delay = robots.crawl_delay(self.fetcher.session.headers["User-Agent"])
+            if delay:
+                self.hosts.set_delay(parts.hostname, float(delay))
+            self._robots[origin] = robots
+        return self._robots[origin]
+
+    def _allowed(self, url):
+        return self._robots_for(url).can_fetch(self.fetcher.session.headers["User-Agent"], url)
+
+    def _add(self, url, depth, lastmod=None):
+        if url is None:
+            return
+        parts = urlsplit(url)
+        key = host_key(parts.hostname)
+        if key not in self.allowed_hosts:
+            return
+        hostname = self._hostnames.get(key, parts.hostname)
+        if hostname != parts.hostname:
+            url = urlunsplit(parts._replace(netloc=parts.netloc.replace(parts.hostname, hostname, 1)))
+        if self._known >= self.max_pages:
+            return
+        if self.frontier.add(url, depth, lastmod):
+            self._known += 1
+
+    def seed(self):
+        """Queue the seed urls and every page listed in the sitemaps"""
+        self.frontier.reset_in_flight()
+        self._known = len(self.frontier)
+        for url in self.seeds:
+            self._add(url, 0)
+        if self._offline:
+            return
+
+        sitemaps = list(self.sitemaps)
+        for url in self.seeds:
+            sitemaps.extend(self._robots_for(url).site_maps() or [])
+        seen = set()
+        while sitemaps:
+            sitemap = sitemaps.pop()
+            if sitemap in seen:
+                continue
+            seen.add(sitemap)
+            body = self._get(sitemap)
+            if body is None:
+                continue
+            try:
+                pages, nested = parse_sitemap(body)
+            except (ElementTree.ParseError, OSError) as e:
+                logger.warning("could not parse sitemap %s: %s", sitemap, e)
+                continue
+            sitemaps.extend(nested)
+            for url, lastmod in pages:
+                self._add(normalize_url(url), 0, lastmod)
+            logger.info("sitemap %s: %d pages, %d nested sitemaps", sitemap, len(pages), len(nested))
+
+    def _fetch(self, url):
+        if self._offline:
+            return self.fetcher.fetch(url)
+        with self.hosts.slot(urlsplit(url).hostname):
+            return self.fetcher.fetch(url)
+
+    def _record(self, result, depth):
+        if result.ok:
+            self.frontier.done(result.url, result.http_status, hashlib.sha256(result.html.encode("utf-8")).hexdigest())
+            if self.follow_links and depth < self.max_depth:
+                for link in extract_links(result.html, result.url, self.allowed_hosts):
+                    self._add(link, depth + 1)
+            return
+        status = self.frontier.failed(result.url, result.http_status, result.error)
+        # Pages that are gone just drop out of the index; anything else means the crawl is incomplete
+        if status == FAILED:
+            self.failed.append(result.url)
+
+    def crawl(self):
+        """Fetch every due page, yielding `FetchResult`s as they complete
+
+        At most `fetcher.max_workers` fetches are in flight and no
+        result is held after it is yielded, so memory stays flat however
+        large the site is.
+        """
+        self.seed()
+        # Pages come due again `recrawl_after` after this run fetched them; that's the next run's job
+        started = time.time()
+        workers = self.fetcher.max_workers
+        in_flight = {}
+        busy = Counter()
+        try:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="site-crawler") as pool:
+                while True:
+                    if len(in_flight) < workers:
+                        for url, depth in self.frontier.due(4 * workers, started):
+                            host = urlsplit(url).hostname
+                            if len(in_flight) >= workers:
+                                break
+                            if busy[host] >= self.hosts.concurrency:
+                                continue
+                            if not self._allowed(url):
+                                self.frontier.blocked(url)
+                                continue
+                            self.frontier.start([url])
+                            busy[host] += 1
+                            in_flight[pool.submit(self._fetch, url)] = (url, depth)
+                    if not in_flight:
+                        break
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        url, depth = in_flight.pop(future)
+                        busy[urlsplit(url).hostname] -= 1
+                        result = future.result()
+                        self._record(result, depth)
+                        yield result
+        finally:
+            self.fetcher.save_state()
+            logger.info("crawl frontier %s", self.frontier.stats())
+
+    def pages(self):
+        """(url, html) of every good page on the site, fetching only the due ones
+
+        Pages that aren't due come from the fetcher's body cache (or are
+        fetched again if it has none).
+        """
+        fetched = set()
+        for result in self.crawl():
+            fetched.add(result.url)
+            if result.ok:
+                yield result.url, result.html
+        for url in self.frontier.urls(DONE):
+            if url in fetched:
+                continue
+            html = self.fetcher.cached_body(url)
+            if html is None:
+                result = self._fetch(url)
+                self._record(result, self.max_depth)
+                html = result.html
+            if html is not None:
+                yield url, html
@@ -0,0 +1,128 @@
+"""Token streaming from a chain running in the background"""
+import asyncio
+import logging
+import queue
+import time
+
+from langchain.callbacks.base import BaseCallbackHandler
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+class TokenQueueHandler(BaseCallbackHandler):
+    """Hand every streamed LLM token to `put`"""
+
+    # Called directly on the event loop for async chains; put() never blocks
+    run_inline = True
+
+    def __init__(self, put):
+        self.put = put
+        self.model = None
+        self._streaming_runs = set()
+
+    def on_llm_new_token(self, token, run_id=None, **kwargs):
+        self._streaming_runs.add(run_id)
+        self.put(token)
+
+    def on_llm_end(self, response, run_id=None, **kwargs):
+        # The call whose tokens were streamed is the answer; tag it with its model
+        if run_id in self._streaming_runs:
+            self.model = (response.llm_output or {}).get("model_name")
+
+
+class ReplyStream:
+    """Iterate over a reply's tokens as the worker produces them
+
+    `submit` is called with a list of callbacks to pass to the chain and
+    must start the turn, returning a future of the full answer. After
+    iteration, `answer`, `model` (None for canned or cached answers), `ttft`
+    (time to first token) and `elapsed` are set; any exception from the
+    worker is re-raised at the end of iteration.
+    """
+
+    def __init__(self, submit):
+        self._queue = self._make_queue()
+        self.answer = None
+        self.model = None
+        self.ttft = None
+        self.elapsed = None
+        self._started = time.perf_counter()
+        self._handler = TokenQueueHandler(self._put)
+        self._future = submit([self._handler])
+        self._future.add_done_callback(lambda _: self._put(_DONE))
+
+    def _make_queue(self):
+        return queue.Queue()
+
+    def _put(self, item):
+        self._queue.put(item)
+
+    def _mark_first_token(self):
+        if self.ttft is None:
+            self.ttft = time.perf_counter() - self._started
+
+    def _token(self, token):
+        self._mark_first_token()
+        return token
+
+    def _finish(self, streamed):
+        """The answer, if it still has to be yielded as a whole"""
+        self.answer = self._future.result()
+        self.model = self._handler.model
+        if not streamed and self.answer:
+            # Non-streaming paths (canned or cached answers) arrive in one piece
+            self._mark_first_token()
+            return self.answer
+        return None
+
+    def _log(self):
+        self.elapsed = time.perf_counter() - self._started
+        logger.info("reply model=%s ttft=%.3fs elapsed=%.3fs", self.model, self.ttft or 0.0, self.elapsed)
+
+    def __iter__(self):
+        streamed = False
+        while True:
+            token = self._queue.get()
+            if token is _DONE:
+                break
+            streamed = True
+            yield self._token(token)
+
+        whole = self._finish(streamed)
+        if whole:
+            yield whole
+        self._log()
+
+
+class AsyncReplyStream(ReplyStream):
+    """ReplyStream for consumers running on an asyncio event loop
+
+    Must be created on the loop it is iterated from; tokens produced on
+    other threads are handed over with `call_soon_threadsafe`.
+    """
+
+    def _make_queue(self):
+        self._loop = asyncio.get_running_loop()
+        return asyncio.Queue()
+
+    def _put(self, item):
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, item)
+
+    def __iter__(self):
+        raise TypeError("AsyncReplyStream must be iterated with `async for`")
+
+    async def __aiter__(self):
+        streamed = False
+        while True:
+            token = await self._queue.get()
+            if token is _DONE:
+                break
+            streamed = True
+            yield self._token(token)
+
+        whole = self._finish(streamed)
+        if whole:
+            yield whole
+        self._log()
@@ -0,0 +1,82 @@
+import answer_cache
+from answer_cache import SemanticAnswerCache
+
+
+class FakeEmbeddings:
+    """Questions mapped to fixed vectors; unknown ones are orthogonal to all of them"""
+
+    VECTORS = {
+        "what courses do you offer?": [1.0, 0.0, 0.0],
+        "which courses do you offer?": [0.99, 0.1, 0.0],
+        "how much does it cost?": [0.0, 1.0, 0.0],
+        "where are you based?": [0.0, 0.0, 1.0]
+    }
+
+    def embed_query(self, text):
+        return self.VECTORS.get(text.lower(), [0.0, 0.0, 0.0])
+
+
+def ask(cache, question, answer="answer", latency=1.0):
+    """Look a question up and store `answer` on a miss, as the bot does"""
+    cached, key = cache.lookup(question)
+    if cached is None:
+        cache.store(key, answer, latency)
+    return cached
+
+
+def test_near_duplicate_question_hits():
+    cache = SemanticAnswerCache(FakeEmbeddings(), threshold=0.95)
+    ask(cache, "What courses do you offer?", "Data and AI courses", latency=2.0)
+
+    assert ask(cache, "Which courses do you offer?") == "Data and AI courses"
+    assert ask(cache, "How much does it cost?") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 2, 2)
+    assert stats["latency_saved_seconds"] == 2.0
+
+
+def test_invalidate_drops_entries_and_records_version():
+    cache = SemanticAnswerCache(FakeEmbeddings())
+    ask(cache, "What courses do you offer?", "old answer")
+    cache.invalidate("v2")
+
+    assert cache.index_version == "v2"
+    assert cache.stats()["entries"] == 0
+    assert ask(cache, "What courses do you offer?", "new answer") is None
+    assert ask(cache, "What courses do you offer?") == "new answer"
+
+
+def test_answer_generated_before_invalidate_is_not_stored():
+    cache = SemanticAnswerCache(FakeEmbeddings())
+    _, key = cache.lookup("What courses do you offer?")
+    # The index is swapped while the answer is being generated from the old one
+    cache.invalidate("v2")
+    cache.store(key, "answer from the old index", 1.0)
+
+    assert cache.stats()["entries"] == 0
+    assert cache.lookup("What courses do you offer?")[0] is None
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(answer_cache.time, "time", lambda: now[0])
+    cache = SemanticAnswerCache(FakeEmbeddings(), ttl=60)
+    ask(cache, "What courses do you offer?", "courses")
+
+    now[0] += 59
+    assert ask(cache, "What courses do you offer?") == "courses"
+    now[0] += 2
+    assert ask(cache, "What courses do you offer?") is None
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = SemanticAnswerCache(FakeEmbeddings(), max_entries=2)
+    ask(cache, "What courses do you offer?", "courses")
+    ask(cache, "How much does it cost?", "price")
+    # A hit makes the first entry the most recently used
+    ask(cache, "What courses do you offer?")
+    ask(cache, "Where are you based?", "location")
+
+    assert ask(cache, "What courses do you offer?") == "courses"
+    assert ask(cache, "Where are you based?") == "location"
+    assert cache.lookup("How much does it cost?")[0] is None
@@ -0,0 +1,14 @@
+from api import new_session_id, valid_session_id
+
+
+def test_issued_session_ids_verify():
+    assert valid_session_id(new_session_id())
+
+
+def test_client_chosen_or_tampered_session_ids_are_rejected():
+    session_id = new_session_id()
+    session, _, signature = session_id.partition(".")
+    assert not valid_session_id("victim")
+    assert not valid_session_id(f"victim.{signature}")
+    assert not valid_session_id(f"{session}.{'0' * len(signature)}")
+    assert not valid_session_id("")
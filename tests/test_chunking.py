@@ -0,0 +1,63 @@
+import random
+
+import chunking
+from chunking import DuplicateFilter
+
+LONG = " ".join(f"word{i}" for i in range(40))
+
+
+def fake_simhash(monkeypatch, fingerprints):
+    monkeypatch.setattr(chunking, "simhash", lambda text, bits=64: fingerprints[text])
+
+
+def test_exact_repeats_are_dropped_ignoring_case_and_spacing():
+    seen = DuplicateFilter()
+
+    assert seen.is_new("Duration: 12 weeks")
+    assert not seen.is_new("duration:   12\nweeks")
+    assert len(seen) == 1
+
+
+def test_short_templated_chunks_are_kept(monkeypatch):
+    # Same fingerprint, but too short for a near match to mean anything
+    fake_simhash(monkeypatch, {"duration: 12 weeks": 0, "duration: 16 weeks": 0})
+    seen = DuplicateFilter(max_bits=3)
+
+    assert seen.is_new("Duration: 12 weeks")
+    assert seen.is_new("Duration: 16 weeks")
+
+
+def test_near_duplicates_within_max_bits_across_bands(monkeypatch):
+    base = random.Random(0).getrandbits(64)
+    # One flipped bit in each of three of the four 16-bit bands
+    near = base ^ (1 << 3) ^ (1 << 20) ^ (1 << 40)
+    far = near ^ (1 << 60)
+    fake_simhash(monkeypatch, {LONG: base, f"{LONG} a": near, f"{LONG} b": far})
+    seen = DuplicateFilter(max_bits=3)
+
+    assert seen.is_new(LONG)
+    assert not seen.is_new(f"{LONG} a")
+    assert seen.is_new(f"{LONG} b")
+
+
+def test_banded_lookup_matches_brute_force(monkeypatch):
+    rng = random.Random(1)
+    fingerprints = {}
+    for i in range(400):
+        if fingerprints and rng.random() < 0.5:
+            # Some distance from an earlier one, either side of the threshold
+            value = rng.choice(list(fingerprints.values()))
+            for bit in rng.sample(range(64), rng.randint(1, 5)):
+                value ^= 1 << bit
+        else:
+            value = rng.getrandbits(64)
+        fingerprints[f"{LONG} {i}"] = value
+    fake_simhash(monkeypatch, fingerprints)
+    seen = DuplicateFilter(max_bits=3)
+    kept = []
+
+    for text, value in fingerprints.items():
+        expected = all(bin(value ^ other).count("1") > 3 for other in kept)
+        assert seen.is_new(text) == expected
+        if expected:
+            kept.append(value)
@@ -0,0 +1,88 @@
+import asyncio
+import time
+
+import openai
+import pytest
+
+from engine import LimitedChatCompletion, RateLimiter, RequestEngine
+
+
+class FakeCompletion:
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.calls = 0
+
+    async def acreate(self, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return {"choices": [], "usage": {"total_tokens": 10}}
+
+
+def test_cancel_while_throttled_releases_slot():
+    async def main():
+        limiter = RateLimiter(max_concurrency=1, rpm=60, tpm=100000)
+        limiter.requests.level = 0  # next request is a second away
+        waiter = asyncio.create_task(limiter.acquire(10))
+        await asyncio.sleep(0.05)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        limiter.requests.level = limiter.requests.capacity
+        await asyncio.wait_for(limiter.acquire(10), 1)
+        limiter.release()
+
+    asyncio.run(main())
+
+
+def test_acreate_makes_one_attempt_without_retries():
+    async def main():
+        client = FakeCompletion()
+        completion = LimitedChatCompletion(RateLimiter(), retries=0, backoff=0, client=client)
+        response = await completion.acreate(messages=[{"role": "user", "content": "hi"}])
+        assert response["usage"]["total_tokens"] == 10
+        assert client.calls == 1
+
+    asyncio.run(main())
+
+
+def test_acreate_retries_and_raises_last_error():
+    async def main():
+        errors = [openai.error.ServiceUnavailableError("down")] * 2
+        client = FakeCompletion(errors)
+        completion = LimitedChatCompletion(RateLimiter(max_concurrency=1), retries=2, backoff=0, client=client)
+        with pytest.raises(openai.error.ServiceUnavailableError):
+            await completion.acreate(messages=[])
+        # Both attempts gave their slot back
+        assert completion.limiter._semaphore._value == 1
+
+    asyncio.run(main())
+
+
+def test_engine_runs_and_cancels_turns_and_stops():
+    engine = RequestEngine(workers=2).start()
+    try:
+        async def answer():
+            return 42
+
+        async def slow():
+            await asyncio.sleep(30)
+
+        assert engine.submit("a", answer).result(5) == 42
+        pending = engine.submit("b", slow)
+        time.sleep(0.1)
+        engine.cancel("b")
+        with pytest.raises(Exception):
+            pending.result(5)
+        stats = engine.stats()
+        assert stats["submitted"] == 2
+        assert stats["completed"] == 1
+        assert stats["cancelled"] == 1
+        # Stopping cancels a running turn and its worker too
+        running = engine.submit("c", slow)
+        time.sleep(0.1)
+    finally:
+        engine.stop()
+    assert not engine._thread.is_alive()
+    with pytest.raises(Exception):
+        running.result(0)
@@ -0,0 +1,115 @@
+import asyncio
+import threading
+
+import pytest
+from langchain.llms.fake import FakeListLLM
+from langchain.schema import AIMessage, HumanMessage, SystemMessage
+
+import history
+from chatbot import CareerBot
+from history import HistoryManager
+from sessions import SessionStore
+
+
+class WordEncoding:
+    """One token per word, so budgets are easy to reason about"""
+
+    def encode(self, text):
+        return text.split()
+
+    def decode(self, tokens):
+        return " ".join(tokens)
+
+
+@pytest.fixture(autouse=True)
+def word_tokens(monkeypatch):
+    monkeypatch.setattr(history.tiktoken, "encoding_for_model", lambda model_name: WordEncoding())
+
+
+def manager(summaries, **kwargs):
+    return HistoryManager(FakeListLLM(responses=summaries), **kwargs)
+
+
+def add_turns(history_manager, state, count, answer="ok"):
+    for i in range(count):
+        state = history_manager.add_turn(state, f"question {i}", answer)
+    return state
+
+
+def test_old_turns_fold_in_batches():
+    # A second summarization call would return the second response
+    history_manager = manager(["earlier questions about courses", "folded again"], keep_turns=2, fold_batch=2)
+    state = add_turns(history_manager, {"summary": "", "turns": []}, 3)
+    assert state["summary"] == "" and len(state["turns"]) == 3
+
+    state = history_manager.add_turn(state, "question 3", "ok")
+
+    assert state["summary"] == "earlier questions about courses"
+    assert state["turns"] == [["question 2", "ok"], ["question 3", "ok"]]
+
+
+def test_long_answers_are_folded_to_stay_within_budget():
+    history_manager = manager(["short summary"] * 10, keep_turns=4, fold_batch=2, max_tokens=60)
+    state = add_turns(history_manager, {"summary": "", "turns": []}, 3, answer=" ".join(["word"] * 20))
+
+    assert history_manager._total_tokens(state) <= 60
+    assert len(state["turns"]) < 3
+    assert state["summary"] == "short summary"
+
+
+def test_summary_is_cut_from_the_front():
+    summary = " ".join(f"s{i}" for i in range(50))
+    history_manager = manager([summary], keep_turns=1, fold_batch=1, max_tokens=20)
+    state = add_turns(history_manager, {"summary": "", "turns": []}, 2)
+
+    assert history_manager._total_tokens(state) <= 20
+    assert state["summary"].split()[-1] == "s49"
+
+
+def test_add_turn_leaves_the_given_state_alone():
+    history_manager = manager(["summary"], keep_turns=1, fold_batch=1)
+    state = {"summary": "", "turns": [["question", "answer"]]}
+
+    new_state = asyncio.run(history_manager.aadd_turn(state, "next", "answer"))
+
+    assert state == {"summary": "", "turns": [["question", "answer"]]}
+    assert new_state == {"summary": "summary", "turns": [["next", "answer"]]}
+
+
+def test_chat_history_puts_the_summary_first():
+    history_manager = manager([])
+    messages = history_manager.chat_history({"summary": "asked about fees", "turns": [["and dates?", "May"]]})
+
+    assert messages == [
+        SystemMessage(content="Summary of the earlier conversation: asked about fees"),
+        HumanMessage(content="and dates?"),
+        AIMessage(content="May")
+    ]
+
+
+def test_reply_is_returned_before_old_turns_are_folded():
+    summarized = threading.Event()
+
+    class SlowSummaries(FakeListLLM):
+        def _call(self, *args, **kwargs):
+            assert summarized.wait(5)
+            return super()._call(*args, **kwargs)
+
+    history_manager = HistoryManager(SlowSummaries(responses=["asked about courses"]), keep_turns=1, fold_batch=2)
+    sessions = SessionStore()
+    sessions.save("s1", {"summary": "", "turns": [["question 0", "ok"], ["question 1", "ok"]]})
+    bot = CareerBot(lambda inputs, callbacks: {"answer": "Twelve weeks"}, history_manager, sessions)
+
+    assert bot.reply("s1", "question 2") == "Twelve weeks"
+    state = sessions.get("s1")
+    assert state["summary"] == "" and len(state["turns"]) == 3
+    # Another worker saves a turn while the summary is still being written
+    state["turns"].append(["question 3", "ok"])
+    sessions.save("s1", state)
+
+    summarized.set()
+    bot.executor.shutdown(wait=True)
+    assert sessions.get("s1") == {
+        "summary": "asked about courses",
+        "turns": [["question 2", "Twelve weeks"], ["question 3", "ok"]]
+    }
@@ -0,0 +1,110 @@
+import os
+
+import faiss
+import numpy as np
+from langchain.docstore.document import Document
+from langchain.embeddings import FakeEmbeddings
+from langchain.vectorstores import FAISS
+
+import index_store
+from index_store import (
+    COMPRESSED_LAYOUT, CompressedSnapshotWriter, content_hash, load_snapshot, read_manifest, save_snapshot
+)
+
+EMBEDDINGS = FakeEmbeddings(size=8)
+
+
+def flat_store(texts):
+    return FAISS.from_texts(texts, EMBEDDINGS, metadatas=[{"source": f"https://teq3.ai/{i}"} for i in range(len(texts))])
+
+
+def publish_compressed(path, texts):
+    writer = CompressedSnapshotWriter(path, block_size=2)
+    vectors = np.random.rand(len(texts), 8).astype("float32")
+    writer.add([Document(page_content=text) for text in texts], [content_hash(text) for text in texts], vectors)
+    writer.finish()
+    index = faiss.IndexFlatL2(8)
+    index.add(vectors)
+    return writer.publish(index, "fp", "model")
+
+
+def test_save_and_load_round_trip(tmp_path):
+    path = str(tmp_path / "index")
+    manifest = save_snapshot(flat_store(["one", "two", "three"]), path, "fp", "model", {"https://teq3.ai/": "abc"})
+
+    assert read_manifest(path) == manifest
+    assert manifest["chunk_count"] == 3
+    assert manifest["pages"] == {"https://teq3.ai/": "abc"}
+    vectorstore = load_snapshot(path, EMBEDDINGS, "fp", "model")
+    texts = {vectorstore.docstore.search(doc_id).page_content for doc_id in vectorstore.index_to_docstore_id.values()}
+    assert texts == {"one", "two", "three"}
+
+
+def test_stale_snapshot_is_not_loaded(tmp_path):
+    path = str(tmp_path / "index")
+    save_snapshot(flat_store(["one"]), path, "fp", "model")
+
+    assert load_snapshot(path, EMBEDDINGS, "other", "model") is None
+    assert load_snapshot(path, EMBEDDINGS, "fp", "other-model") is None
+    assert load_snapshot(path, EMBEDDINGS, "fp", "model", layout=COMPRESSED_LAYOUT) is None
+    assert load_snapshot(str(tmp_path / "missing"), EMBEDDINGS, "fp", "model") is None
+
+
+def test_version_follows_chunk_contents(tmp_path):
+    first = save_snapshot(flat_store(["one", "two"]), str(tmp_path / "a"), "fp", "model")
+    same = save_snapshot(flat_store(["one", "two"]), str(tmp_path / "b"), "fp", "model")
+    changed = save_snapshot(flat_store(["one", "three"]), str(tmp_path / "c"), "fp", "model")
+
+    assert first["version"] == same["version"] != changed["version"]
+
+
+def test_publish_swaps_a_link_and_removes_the_old_snapshot(tmp_path):
+    path = str(tmp_path / "index")
+    save_snapshot(flat_store(["one"]), path, "fp", "model")
+    first = os.path.realpath(path)
+    save_snapshot(flat_store(["two"]), path, "fp", "model")
+
+    assert os.path.islink(path)
+    assert os.path.realpath(path) != first
+    assert not os.path.exists(first)
+    assert sorted(os.listdir(tmp_path)) == sorted(["index", os.path.basename(os.path.realpath(path))])
+
+
+def test_publish_replaces_a_snapshot_directory(tmp_path):
+    path = tmp_path / "index"
+    path.mkdir()
+    (path / "manifest.json").write_text("{}")
+    save_snapshot(flat_store(["one"]), str(path), "fp", "model")
+
+    assert os.path.islink(path)
+    assert read_manifest(str(path))["chunk_count"] == 1
+    assert len(os.listdir(tmp_path)) == 2
+
+
+def test_open_compressed_snapshot_survives_a_publish(tmp_path):
+    path = str(tmp_path / "index")
+    publish_compressed(path, ["alpha", "beta", "gamma"])
+    live = load_snapshot(path, EMBEDDINGS, "fp", "model")
+    publish_compressed(path, ["delta"])
+
+    assert live.docstore.search(content_hash("beta")).page_content == "beta"
+    assert load_snapshot(path, EMBEDDINGS, "fp", "model").index.ntotal == 1
+
+
+def test_load_retries_when_the_snapshot_is_replaced_mid_load(tmp_path, monkeypatch):
+    path = str(tmp_path / "index")
+    save_snapshot(flat_store(["one"]), path, "fp", "model")
+    read_index = index_store._read_index
+    calls = []
+
+    def publish_then_read(index_path):
+        if not calls:
+            save_snapshot(flat_store(["two", "three"]), path, "fp", "model")
+        calls.append(index_path)
+        return read_index(index_path)
+
+    monkeypatch.setattr(index_store, "_read_index", publish_then_read)
+    vectorstore = load_snapshot(path, EMBEDDINGS, "fp", "model")
+
+    assert len(calls) == 2
+    assert vectorstore.index.ntotal == 2
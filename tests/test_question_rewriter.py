@@ -0,0 +1,34 @@
+import pytest
+
+from question_rewriter import needs_rewrite
+
+
+@pytest.mark.parametrize("question", [
+    "What does the data analytics program cover?",
+    "Is there a discount for students from Nigeria?",
+    "Do I need previous coding experience for the AI course?",
+    "Why should I learn Python for data analytics?",
+    "Is this course suitable for complete beginners?",
+    "Can I learn data analytics if it's my first tech job?",
+    "How long is the data analytics program?",
+    "What jobs can I get after finishing the AI engineering program?",
+])
+def test_standalone_questions_skip_the_rewrite(question):
+    assert not needs_rewrite(question)
+
+
+@pytest.mark.parametrize("question", [
+    "How much does it cost?",
+    "Is it online?",
+    "Can I pay for it in installments?",
+    "What about the AI one?",
+    "Does that include job support?",
+    "What are their prerequisites?",
+    "And the schedule for the weekend classes?",
+    "Which one is better for someone from marketing?",
+    "Tell me more",
+    "How long?",
+    "Can you explain what you mentioned about the portfolio projects?",
+])
+def test_follow_ups_are_rewritten(question):
+    assert needs_rewrite(question)
@@ -0,0 +1,114 @@
+import pytest
+from langchain.embeddings import FakeEmbeddings
+
+import chunking
+import refresher
+from index_store import read_manifest, source_fingerprint
+from ingest import build_from_pages, open_latest_snapshot, partial_dir
+from refresher import IndexRefresher
+from settings import CHUNK_OVERLAP_TOKENS, CHUNK_TOKENS, EMBEDDING_MODEL
+
+FINGERPRINT = source_fingerprint([], CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS, EMBEDDING_MODEL)
+
+SHARED = "<h2>Contact</h2><p>Write to hello@teq3.ai and we will get back to you within a day.</p>"
+
+
+class WordEncoding:
+    def encode(self, text):
+        return text.split()
+
+    def decode(self, tokens):
+        return " ".join(tokens)
+
+
+class FakeBot:
+    def __init__(self, vectorstore):
+        self.vectorstore = vectorstore
+
+    def swap_index(self, vectorstore, index_version):
+        self.vectorstore = vectorstore
+
+
+@pytest.fixture(autouse=True)
+def word_tokens(monkeypatch):
+    monkeypatch.setattr(chunking.tiktoken, "encoding_for_model", lambda model_name: WordEncoding())
+
+
+def page(body):
+    return f"<html><body><main>{body}</main></body></html>"
+
+
+def indexed(vectorstore):
+    """(source, text) of every chunk in the index"""
+    return {
+        (doc.metadata["source"], doc.page_content)
+        for doc in map(vectorstore.docstore.search, vectorstore.index_to_docstore_id.values())
+    }
+
+
+def refreshed(tmp_path, monkeypatch, before, after, failed=()):
+    """Chunks in the index after building it from `before` and refreshing it with `after`"""
+    embeddings = FakeEmbeddings(size=8)
+    index_dir = str(tmp_path / "index")
+    build_from_pages(iter(before), embeddings, index_dir, FINGERPRINT, list(failed))
+    vectorstore, _ = open_latest_snapshot(embeddings, index_dir, FINGERPRINT)
+    bot = FakeBot(vectorstore)
+    monkeypatch.setattr(refresher, "load_pages", lambda urls: (after, []))
+    assert IndexRefresher(bot, embeddings, 0, urls=[], index_dir=index_dir).refresh_once()
+    return indexed(bot.vectorstore)
+
+
+def test_shared_chunk_survives_its_owner_page_changing(tmp_path, monkeypatch):
+    a = ("https://teq3.ai/a", page("<h2>Courses</h2><p>Data analytics.</p>" + SHARED))
+    b = ("https://teq3.ai/b", page("<h2>Fees</h2><p>Payment plans.</p>" + SHARED))
+    a_changed = ("https://teq3.ai/a", page("<h2>Courses</h2><p>AI engineering.</p>"))
+
+    chunks = refreshed(tmp_path, monkeypatch, [a, b], [a_changed, b])
+
+    shared = [source for source, text in chunks if text.startswith("Contact")]
+    assert shared == ["https://teq3.ai/b"]
+    assert ("https://teq3.ai/a", "Courses\nAI engineering.") in chunks
+
+
+def test_shared_chunk_survives_its_owner_page_being_removed(tmp_path, monkeypatch):
+    a = ("https://teq3.ai/a", page("<h2>Courses</h2><p>Data analytics.</p>" + SHARED))
+    b = ("https://teq3.ai/b", page("<h2>Fees</h2><p>Payment plans.</p>" + SHARED))
+
+    chunks = refreshed(tmp_path, monkeypatch, [a, b], [b])
+
+    assert {source for source, _ in chunks} == {"https://teq3.ai/b"}
+    assert sum(text.startswith("Contact") for _, text in chunks) == 1
+
+
+def test_chunks_of_unchanged_pages_are_not_added_twice(tmp_path, monkeypatch):
+    a = ("https://teq3.ai/a", page("<h2>Courses</h2><p>Data analytics.</p>" + SHARED))
+    b = ("https://teq3.ai/b", page("<h2>Fees</h2><p>Payment plans.</p>" + SHARED))
+    a_changed = ("https://teq3.ai/a", page("<h2>Courses</h2><p>AI engineering.</p>" + SHARED))
+
+    chunks = refreshed(tmp_path, monkeypatch, [a, b], [a_changed, b])
+
+    texts = [text for _, text in chunks]
+    assert len(texts) == len(set(texts)) == 3
+
+
+def test_partial_build_is_saved_beside_the_snapshot(tmp_path):
+    a = ("https://teq3.ai/a", page("<h2>Courses</h2><p>Data analytics.</p>"))
+    index_dir = str(tmp_path / "index")
+    build_from_pages(iter([a]), FakeEmbeddings(size=8), index_dir, FINGERPRINT, ["https://teq3.ai/b"])
+
+    assert read_manifest(index_dir) is None
+    assert read_manifest(partial_dir(index_dir))["failed"] == ["https://teq3.ai/b"]
+    _, path = open_latest_snapshot(FakeEmbeddings(size=8), index_dir, FINGERPRINT)
+    assert path == partial_dir(index_dir)
+
+
+def test_refresh_completes_a_partial_snapshot(tmp_path, monkeypatch):
+    a = ("https://teq3.ai/a", page("<h2>Courses</h2><p>Data analytics.</p>"))
+    b = ("https://teq3.ai/b", page("<h2>Fees</h2><p>Payment plans.</p>"))
+
+    chunks = refreshed(tmp_path, monkeypatch, [a], [a, b], failed=["https://teq3.ai/b"])
+
+    assert {source for source, _ in chunks} == {"https://teq3.ai/a", "https://teq3.ai/b"}
+    manifest = read_manifest(str(tmp_path / "index"))
+    assert set(manifest["pages"]) == {"https://teq3.ai/a", "https://teq3.ai/b"}
+    assert manifest["failed"] == []
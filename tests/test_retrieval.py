@@ -0,0 +1,86 @@
+import pytest
+from langchain.embeddings import FakeEmbeddings
+from langchain.vectorstores import FAISS
+
+import chunking
+import context_packing
+import ingest
+from context_packing import ContextPacker, PackedRetriever
+from ingest import build_from_pages
+from retrieval import BM25Index, BM25Writer, HybridRetriever, IdfReranker, MappedBM25Index
+from vector_index import CompressedDocstore
+
+TEXTS = [
+    "AI engineering course: twelve weeks of Python, machine learning and deployment",
+    "Data analytics course covering SQL, Excel, Power BI and Python",
+    "Fees can be paid in monthly instalments; scholarships are available",
+    "Contact us at hello@teq3.ai about courses, fees or scholarships",
+    "",
+]
+
+
+class WordEncoding:
+    def encode(self, text):
+        return text.split()
+
+    def decode(self, tokens):
+        return " ".join(tokens)
+
+
+def page(body):
+    return f"<html><body><main>{body}</main></body></html>"
+
+
+@pytest.mark.parametrize("query", ["python course", "fees scholarships", "power bi", "nothing matches"])
+def test_mapped_bm25_matches_in_process_index(tmp_path, query):
+    writer = BM25Writer()
+    writer.add(TEXTS[:2])
+    writer.add(TEXTS[2:])
+    writer.save(str(tmp_path))
+
+    mapped = MappedBM25Index(str(tmp_path)).search(query, 3)
+    expected = BM25Index(TEXTS).search(query, 3)
+
+    assert [(doc_idx, matched) for doc_idx, _, matched in mapped] == [
+        (doc_idx, matched) for doc_idx, _, matched in expected
+    ]
+    assert [score for _, score, _ in mapped] == pytest.approx([score for _, score, _ in expected])
+
+
+def test_compressed_snapshot_is_searched_without_reading_every_chunk(tmp_path, monkeypatch):
+    monkeypatch.setattr(chunking.tiktoken, "encoding_for_model", lambda model_name: WordEncoding())
+    monkeypatch.setattr(ingest, "INDEX_MODE", "compressed")
+    pages = [
+        ("https://teq3.ai/ai", page("<h2>AI engineering</h2><p>Twelve weeks of Python and deployment.</p>")),
+        ("https://teq3.ai/fees", page("<h2>Fees</h2><p>Monthly instalments and scholarships.</p>")),
+    ]
+    vectorstore, _ = build_from_pages(iter(pages), FakeEmbeddings(size=8), str(tmp_path / "index"), "fp")
+    assert isinstance(vectorstore.docstore, CompressedDocstore)
+
+    reads = []
+    record = CompressedDocstore.record
+    monkeypatch.setattr(CompressedDocstore, "record", lambda self, row: reads.append(row) or record(self, row))
+    retriever = HybridRetriever(vectorstore=vectorstore, k=1, use_reranker=True)
+    assert isinstance(retriever._bm25, MappedBM25Index)
+    assert isinstance(retriever._reranker, IdfReranker)
+    assert reads == []
+
+    [doc] = retriever.get_relevant_documents("scholarships")
+    assert doc.metadata["source"] == "https://teq3.ai/fees"
+    assert doc.metadata["retrieval_mode"] == "lexical"
+
+
+def test_counters_carry_over_an_index_swap(monkeypatch):
+    monkeypatch.setattr(context_packing.tiktoken, "encoding_for_model", lambda model_name: WordEncoding())
+    retriever = PackedRetriever(
+        base=HybridRetriever(vectorstore=FAISS.from_texts(TEXTS[:2], FakeEmbeddings(size=8)), k=1),
+        packer=ContextPacker()
+    )
+    retriever.get_relevant_documents("power bi")
+
+    swapped = retriever.with_vectorstore(FAISS.from_texts(TEXTS, FakeEmbeddings(size=8)))
+    swapped.get_relevant_documents("scholarships")
+
+    stats = swapped.stats()
+    assert stats["lexical"] + stats["hybrid"] == 2
+    assert stats["packing"]["requests"] == 2
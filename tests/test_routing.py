@@ -0,0 +1,91 @@
+import os
+
+import pytest
+
+from conftest import ROOT
+from routing import IntentClassifier, IntentRouter, load_examples
+
+CANNED = ["consultant_interest", "contact"]
+
+# The keywords the app routed to a consultant before there was a classifier
+BASELINE_CONSULTANT_KEYWORDS = [
+    "speak to someone", "talk to human", "human advisor", "real person",
+    "schedule call", "book consultation", "arrange meeting", "connect me with"
+]
+
+
+@pytest.fixture(scope="module")
+def router():
+    classifier = IntentClassifier(*load_examples(os.path.join(ROOT, "intent_examples.jsonl")))
+    return IntentRouter(classifier, min_confidence=0.6, canned_intents=CANNED, canned_confidence=0.85)
+
+
+@pytest.mark.parametrize("query", [
+    "How much Python do I need to know before the AI course?",
+    "How long is the data analytics program?",
+    "Does the job guarantee include a refund if I don't get a job?",
+    "Is there a discount for students from Nigeria?",
+    "how much does the course cost",
+    "when does the next cohort start",
+    "tell me about the ai program",
+])
+def test_knowledge_base_questions_go_to_retrieval(router, query):
+    assert router.route(query).answer is None
+
+
+@pytest.mark.parametrize("query, intent", [
+    ("I want to talk to a human", "consultant_interest"),
+    ("what is your email address", "contact"),
+])
+def test_confident_support_intents_get_canned_answer(router, query, intent):
+    route = router.route(query)
+    assert route.intent == intent
+    assert route.confidence >= router.canned_confidence
+    assert route.answer is not None
+
+
+@pytest.mark.parametrize("keyword", BASELINE_CONSULTANT_KEYWORDS)
+def test_baseline_consultant_keywords_keep_their_canned_answer(router, keyword):
+    for query in (keyword, f"Hi, I'd like to {keyword} please"):
+        route = router.route(query)
+        assert route.intent == "consultant_interest", query
+        assert route.answer is not None, query
+
+
+@pytest.mark.parametrize("query, intent", [
+    ("my payment failed, what should I do?", "technical"),
+    ("I can't log in to my account", "technical"),
+    ("I forgot my password", "technical"),
+    ("I want to make a complaint", "complaint"),
+])
+def test_technical_issues_and_complaints_go_to_the_llm(router, query, intent):
+    # The system prompt troubleshoots first instead of escalating straight away
+    route = router.route(query)
+    assert route.intent == intent
+    assert route.answer is None
+
+
+def test_default_canned_intents_come_from_settings():
+    from settings import ROUTER_CANNED_INTENTS
+
+    assert IntentRouter().canned_intents == set(ROUTER_CANNED_INTENTS)
+
+
+def test_phrase_match_is_evidence_not_an_override(router):
+    route = router.route("can i speak to someone about the programs")
+    assert route.source == "classifier+pattern"
+    assert route.confidence < 1.0
+
+
+def test_pricing_and_schedule_are_labeled_but_not_canned(router):
+    route = router.route("when does the next cohort start")
+    assert route.intent == "schedule"
+    assert route.answer is None
+
+
+def test_without_classifier_phrases_only_label():
+    router = IntentRouter(None, min_confidence=0.6, canned_intents=CANNED, canned_confidence=0.85)
+    route = router.route("I forgot my password")
+    assert route.intent == "technical"
+    assert route.answer is None
+    assert router.route("what projects will i build").intent == "general"
@@ -0,0 +1,60 @@
+from sessions import DiskBackend, SessionStore
+
+
+def shared_stores(tmp_path, count=2):
+    """Stores in separate workers sharing one session directory"""
+    return [SessionStore(backend=DiskBackend(str(tmp_path), ttl=3600)) for _ in range(count)]
+
+
+def take_turn(store, session_id, question, answer):
+    state = store.get(session_id)
+    state["turns"].append([question, answer])
+    store.save(session_id, state)
+
+
+def test_worker_sees_turns_saved_by_another(tmp_path):
+    first, second = shared_stores(tmp_path)
+    take_turn(first, "s1", "what courses do you offer?", "AI and data analytics")
+    take_turn(second, "s1", "how long is the AI course?", "Twelve weeks")
+    take_turn(first, "s1", "and the data course?", "Ten weeks")
+
+    assert [question for question, _ in second.get("s1")["turns"]] == [
+        "what courses do you offer?", "how long is the AI course?", "and the data course?"
+    ]
+
+
+def test_clear_in_one_worker_is_seen_by_another(tmp_path):
+    first, second = shared_stores(tmp_path)
+    take_turn(first, "s1", "hello", "hi")
+    second.get("s1")
+    first.clear("s1")
+
+    assert second.get("s1") == {"summary": "", "turns": []}
+
+
+def test_max_turns_is_kept_with_a_backend(tmp_path):
+    store = SessionStore(max_turns=2, backend=DiskBackend(str(tmp_path), ttl=3600))
+    for i in range(4):
+        take_turn(store, "s1", f"question {i}", "answer")
+
+    assert [question for question, _ in store.get("s1")["turns"]] == ["question 2", "question 3"]
+
+
+def test_in_process_store_evicts_least_recently_used():
+    store = SessionStore(max_sessions=2)
+    take_turn(store, "a", "q", "a")
+    take_turn(store, "b", "q", "a")
+    store.get("a")
+    take_turn(store, "c", "q", "a")
+
+    assert len(store) == 2
+    assert store.get("a")["turns"] == [["q", "a"]]
+    assert store.get("b")["turns"] == []
+
+
+def test_returned_state_is_a_copy():
+    store = SessionStore()
+    take_turn(store, "s1", "q", "a")
+    store.get("s1")["turns"].append(["not", "saved"])
+
+    assert store.get("s1")["turns"] == [["q", "a"]]
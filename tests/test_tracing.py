@@ -0,0 +1,36 @@
+import socket
+from urllib.request import urlopen
+
+from tracing import serve_metrics
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def get(port, path):
+    with urlopen(f"http://127.0.0.1:{port}{path}", timeout=5) as response:
+        return response.read().decode("utf-8")
+
+
+def test_serving_a_port_again_reuses_the_running_server():
+    port = free_port()
+    first = serve_metrics(port, "127.0.0.1")
+    try:
+        second = serve_metrics(port, "127.0.0.1", {"/stats": lambda query: (200, "application/json", "{}")})
+
+        assert second is first
+        assert get(port, "/stats") == "{}"
+    finally:
+        first.shutdown()
+        first.server_close()
+
+    restarted = serve_metrics(port, "127.0.0.1")
+    try:
+        assert restarted is not first
+        get(port, "/metrics")
+    finally:
+        restarted.shutdown()
+        restarted.server_close()
@@ -0,0 +1,514 @@
+"""Per-stage tracing of chat turns: Prometheus metrics, JSON logs and a sampling profiler
+
+Every turn gets a `TurnTrace` with one entry per stage (routing, answer
+cache, condense, retrieval and its embed / search steps, the answer LLM,
+history) carrying wall time, tokens in and out, cache hits and retries.
+Stage timings also feed process-wide metrics, served as Prometheus text
+on /metrics by `serve_metrics`, on a port bound to localhost by default.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+from langchain.callbacks.base import BaseCallbackHandler
+
+from prompts import count_tokens, message_tokens
+from settings import LOG_FORMAT, LOG_LEVEL, METRICS_HOST, PROFILE_ENABLED, PROFILE_INTERVAL, PROFILE_PATH
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the latency histograms, in seconds
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels, **extra):
+    items = list(labels) + sorted(extra.items())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in items) + "}"
+
+
+class Metrics:
+    """Thread-safe counters and histograms rendered in the Prometheus text format"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] += value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, [list(h[0]), h[1], h[2]]) for key, h in self._histograms.items())
+        lines = []
+        declared = set()
+        for (name, labels), value in counters:
+            if name not in declared:
+                declared.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{_labels(labels)} {value:g}")
+        for (name, labels), (buckets, total, count) in histograms:
+            if name not in declared:
+                declared.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            for bound, bucket_count in zip(self.buckets, buckets):
+                lines.append(f"{name}_bucket{_labels(labels, le=f'{bound:g}')} {bucket_count}")
+            lines.append(f"{name}_bucket{_labels(labels, le='+Inf')} {count}")
+            lines.append(f"{name}_sum{_labels(labels)} {total:.6f}")
+            lines.append(f"{name}_count{_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+
+
+class TurnTrace:
+    """Stages and counters of one chat turn"""
+
+    def __init__(self, session_id):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.session_id = session_id
+        self.stages = []
+        self.counts = Counter()
+        self._lock = threading.Lock()
+
+    def add_stage(self, name, seconds, **fields):
+        with self._lock:
+            self.stages.append(dict(stage=name, ms=round(seconds * 1000, 3), **fields))
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counts[name] += value
+
+    def to_dict(self):
+        with self._lock:
+            return {"trace_id": self.trace_id, "session_id": self.session_id,
+                    "stages": list(self.stages), "counts": dict(self.counts)}
+
+
+_current = contextvars.ContextVar("teq3_turn_trace", default=None)
+
+
+def current_trace():
+    """The trace of the turn running in this context, if any"""
+    return _current.get()
+
+
+def record_stage(name, seconds, error=False, **fields):
+    """Time one stage into the metrics and the current turn's trace"""
+    METRICS.observe("teq3_stage_seconds", seconds, stage=name)
+    if error:
+        METRICS.inc("teq3_stage_errors_total", stage=name)
+        fields["error"] = True
+    trace = _current.get()
+    if trace is not None:
+        trace.add_stage(name, seconds, **fields)
+
+
+@contextmanager
+def stage(name, **fields):
+    """Time the block as stage `name`"""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        record_stage(name, time.perf_counter() - start, error=True, **fields)
+        raise
+    record_stage(name, time.perf_counter() - start, **fields)
+
+
+def count(metric, trace_key, value=1, **labels):
+    """Add to a counter metric and to the current turn's `trace_key` count"""
+    METRICS.inc(metric, value, **labels)
+    trace = _current.get()
+    if trace is not None:
+        trace.count(trace_key, value)
+
+
+def cache_result(cache, hit):
+    count("teq3_cache_requests_total", f"{cache}_cache_{'hits' if hit else 'misses'}",
+          cache=cache, result="hit" if hit else "miss")
+
+
+@contextmanager
+def collect():
+    """Record the block's stages into a fresh trace without logging a turn, e.g. to send them to a caller"""
+    trace = TurnTrace(None)
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def turn(session_id):
+    """Trace a turn: stages recorded inside the block land in one JSON log line"""
+    trace = TurnTrace(session_id)
+    token = _current.set(trace)
+    start = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield trace
+    except BaseException as e:
+        outcome = "error" if isinstance(e, Exception) else "cancelled"
+        raise
+    finally:
+        _current.reset(token)
+        elapsed = time.perf_counter() - start
+        METRICS.observe("teq3_turn_seconds", elapsed, outcome=outcome)
+        record = dict(trace.to_dict(), outcome=outcome, ms=round(elapsed * 1000, 3))
+        summary = " ".join(f"{entry['stage']}={entry['ms']:.0f}ms" for entry in record["stages"])
+        logger.info("turn %s %s in %.3fs: %s", trace.trace_id, outcome, elapsed, summary, extra={"trace": record})
+
+
+def _class_name(serialized):
+    return (serialized or {}).get("id", [""])[-1]
+
+
+class StageTracer(BaseCallbackHandler):
+    """Callback handler timing the chain's stages and LLM calls into a `TurnTrace`
+
+    Chains and retrievers are named by class; nested runs under a stage of
+    the same name (the retriever behind the context packer, the stuff chain
+    inside the cascade) are not timed twice. LLM calls are recorded as
+    `<stage>.llm` with their model and token counts; streamed calls report
+    no usage, so their tokens are counted locally.
+    """
+
+    run_inline = True
+
+    STAGES = {
+        "QuestionRewriter": "condense",
+        "ModelCascade": "answer",
+        "StuffDocumentsChain": "answer",
+        "PackedRetriever": "retrieve",
+        "HybridRetriever": "retrieve",
+        "RemoteRetriever": "retrieve"
+    }
+
+    def __init__(self, trace=None):
+        self.trace = trace
+        self._runs = {}
+        self._names = {}
+        self._parents = {}
+
+    def _ancestor_stage(self, parent_run_id):
+        while parent_run_id is not None:
+            name = self._names.get(parent_run_id)
+            if name:
+                return name
+            parent_run_id = self._parents.get(parent_run_id)
+        return None
+
+    def _start(self, name, run_id, parent_run_id, **fields):
+        self._parents[run_id] = parent_run_id
+        ancestor = self._ancestor_stage(parent_run_id)
+        if name is None or name == ancestor:
+            return
+        self._names[run_id] = name
+        self._runs[run_id] = (name, time.perf_counter(), fields)
+
+    def _end(self, run_id, error=False, **fields):
+        self._parents.pop(run_id, None)
+        self._names.pop(run_id, None)
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        name, start, start_fields = run
+        seconds = time.perf_counter() - start
+        fields = dict(start_fields, **fields)
+        METRICS.observe("teq3_stage_seconds", seconds, stage=name)
+        if error:
+            METRICS.inc("teq3_stage_errors_total", stage=name)
+            fields["error"] = True
+        if self.trace is not None:
+            self.trace.add_stage(name, seconds, **fields)
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, **kwargs):
+        self._start(self.STAGES.get(_class_name(serialized)), run_id, parent_run_id)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=True)
+
+    def on_retriever_start(self, serialized, query, *, run_id, parent_run_id=None, **kwargs):
+        self._start(self.STAGES.get(_class_name(serialized), "retrieve"), run_id, parent_run_id)
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._end(run_id, documents=len(documents))
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=True)
+
+    def _llm_start(self, run_id, parent_run_id, prompt_tokens, kwargs):
+        params = kwargs.get("invocation_params") or {}
+        model = params.get("model") or params.get("model_name") or "unknown"
+        purpose = self._ancestor_stage(parent_run_id) or "chain"
+        self._parents[run_id] = parent_run_id
+        self._runs[run_id] = (f"{purpose}.llm", time.perf_counter(),
+                              {"model": model, "estimated_prompt_tokens": prompt_tokens})
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, **kwargs):
+        tokens = sum(message_tokens(batch) for batch in messages)
+        self._llm_start(run_id, parent_run_id, tokens, kwargs)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs):
+        self._llm_start(run_id, parent_run_id, sum(count_tokens(prompt) for prompt in prompts), kwargs)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        run = self._runs.get(run_id)
+        if run is None:
+            return
+        name, _, fields = run
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        model = (response.llm_output or {}).get("model_name") or fields["model"]
+        prompt_tokens = usage.get("prompt_tokens") or fields.pop("estimated_prompt_tokens")
+        completion_tokens = usage.get("completion_tokens") or sum(
+            count_tokens(generation.text) for generations in response.generations for generation in generations
+        )
+        fields.pop("estimated_prompt_tokens", None)
+        fields["model"] = model
+        stage_name = name.split(".")[0]
+        METRICS.inc("teq3_llm_calls_total", stage=stage_name, model=model)
+        METRICS.inc("teq3_llm_tokens_total", prompt_tokens, stage=stage_name, model=model, direction="prompt")
+        METRICS.inc("teq3_llm_tokens_total", completion_tokens, stage=stage_name, model=model, direction="completion")
+        self._end(run_id, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                  token_source="usage" if usage else "estimate")
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        run = self._runs.get(run_id)
+        if run is not None:
+            run[2].pop("estimated_prompt_tokens", None)
+        self._end(run_id, error=True)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per log record, including any `extra` fields"""
+
+    RESERVED = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "thread": record.threadName
+        }
+        for key, value in vars(record).items():
+            if key not in self.RESERVED:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(log_format=LOG_FORMAT, level=LOG_LEVEL):
+    """Send the app's logs to stderr as text or JSON lines; safe to call on every rerun"""
+    root = logging.getLogger()
+    if any(getattr(handler, "_teq3", False) for handler in root.handlers):
+        return
+    handler = logging.StreamHandler()
+    handler._teq3 = True
+    if log_format == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    root.addHandler(handler)
+    root.setLevel(level)
+
+
+class SamplingProfiler:
+    """Samples every thread's Python stack at a fixed interval
+
+    Cheap enough to leave on under load; `folded()` gives stack counts in
+    the folded format read by flamegraph.pl and speedscope, `top()` the
+    functions most often on top of a stack.
+    """
+
+    def __init__(self, interval=0.005, max_depth=64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = 0
+        self._stacks = Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    @staticmethod
+    def _frame_label(frame):
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: re.sub(r"[_-]?\d+$", "", thread.name) for thread in threading.enumerate()}
+            sampled = []
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    stack.append(self._frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, "thread"))
+                sampled.append(";".join(reversed(stack)))
+            with self._lock:
+                self.samples += 1
+                self._stacks.update(sampled)
+
+    def folded(self):
+        with self._lock:
+            return "".join(f"{stack} {n}\n" for stack, n in self._stacks.most_common())
+
+    def top(self, n=20):
+        """(function, share of samples) for the functions most often running"""
+        leaves = Counter()
+        with self._lock:
+            for stack, hits in self._stacks.items():
+                leaves[stack.rsplit(";", 1)[-1]] += hits
+            samples = self.samples
+        return [(function, hits / samples) for function, hits in leaves.most_common(n)] if samples else []
+
+    def dump(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.folded())
+        logger.info("profile: %d samples written to %s", self.samples, path)
+
+
+_profiler = None
+_profiler_lock = threading.Lock()
+
+
+def start_profiler():
+    """Start the shared profiler if TEQ3_PROFILE is set; its stacks are written on exit"""
+    global _profiler
+    with _profiler_lock:
+        if _profiler is None and PROFILE_ENABLED:
+            _profiler = SamplingProfiler(PROFILE_INTERVAL).start()
+            atexit.register(_profiler.dump, PROFILE_PATH)
+            logger.info("sampling profiler on, every %.1f ms", PROFILE_INTERVAL * 1000)
+        return _profiler
+
+
+def profiler():
+    """The running profiler, or None"""
+    return _profiler
+
+
+def profile_report(query):
+    """(status, content type, body) of the running profiler for a /debug/profile request"""
+    running = profiler()
+    if running is None:
+        return 404, "application/json", json.dumps({"error": "profiler is off; set TEQ3_PROFILE=1"})
+    if query.get("format") == "top":
+        return 200, "application/json", json.dumps({"samples": running.samples, "top": running.top()})
+    return 200, "text/plain; charset=utf-8", running.folded()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    # path -> function of the query parameters returning (status, content type, body)
+    routes = {}
+
+    def do_GET(self):
+        path, _, query = self.path.partition("?")
+        route = self.routes.get(path)
+        if route is None:
+            self.send_error(404)
+            return
+        status, content_type, body = route(dict(parse_qsl(query)))
+        body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_metrics_servers = {}
+_metrics_lock = threading.Lock()
+
+
+def serve_metrics(port, host=METRICS_HOST, routes=None):
+    """Serve /metrics, and any extra `routes`, from a background thread
+
+    Listens on localhost unless TEQ3_METRICS_HOST says otherwise, apart
+    from the public API, since stats and profiles describe the deployment.
+    Calling it again for a port already being served (e.g. after a cached
+    resource is rebuilt) returns the running server with the new routes.
+    """
+    handler_routes = {
+        "/metrics": lambda query: (200, PROMETHEUS_CONTENT_TYPE, METRICS.render()),
+        **(routes or {})
+    }
+    with _metrics_lock:
+        server, thread = _metrics_servers.get((host, port), (None, None))
+        # A server that was shut down and closed is replaced
+        if server is not None and server.socket.fileno() != -1 and thread.is_alive():
+            server.RequestHandlerClass.routes = handler_routes
+            return server
+        handler = type("MetricsHandler", (_MetricsHandler,), {"routes": handler_routes})
+        server = ThreadingHTTPServer((host, port), handler)
+        thread = threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True)
+        thread.start()
+        _metrics_servers[(host, port)] = (server, thread)
+    logger.info("metrics on http://%s:%d/metrics", host, port)
+    return server
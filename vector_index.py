@@ -0,0 +1,325 @@
+"""Quantized FAISS indexes and a memory-mapped, compressed chunk store for large corpora
+
+Small corpora keep an exact flat index. Past `flat_max` chunks the index
+is HNSW over 8-bit scalar-quantized vectors (4x smaller than float32,
+no training beyond value ranges), and past `hnsw_max` it is IVF with
+product quantization (about 16x smaller), trained on a sample.
+
+Chunk texts live in one file of zlib-compressed blocks, memory-mapped
+read-only and decompressed one block at a time on lookup. Every process
+that opens the same snapshot shares its pages through the OS page cache
+instead of holding its own copy of every chunk as Python objects.
+"""
+import json
+import math
+import mmap
+import os
+import time
+import zlib
+from collections.abc import Mapping
+from functools import lru_cache
+
+import faiss
+import numpy as np
+from langchain.docstore.base import Docstore
+from langchain.docstore.document import Document
+
+DOCS_FILE = "docs.bin"
+OFFSETS_FILE = "docs.offsets.npy"
+ROW_IDS_FILE = "docs.row_ids.npy"
+SORTED_IDS_FILE = "docs.sorted_ids.npy"
+SORTED_ROWS_FILE = "docs.sorted_rows.npy"
+DOCSTORE_META_FILE = "docs.json"
+
+# Vectors sampled to train IVF centroids, PQ codebooks and SQ ranges
+TRAIN_SAMPLE = 100_000
+# Vectors added to an index per call
+ADD_BATCH = 65_536
+
+
+def pq_subquantizers(dimension):
+    """Largest divisor of `dimension` up to dimension / 4, i.e. one byte per 4+ dimensions"""
+    for m in range(max(dimension // 4, 1), 0, -1):
+        if dimension % m == 0:
+            return m
+    return 1
+
+
+def ivf_pq_spec(count, dimension):
+    """IVF + PQ factory string with about 4 * sqrt(n) inverted lists, a power of two
+
+    Lists are capped so each gets the ~39 training vectors FAISS asks for.
+    """
+    nlist = 2 ** int(round(math.log2(4 * math.sqrt(count))))
+    while nlist > 1 and nlist * 39 > min(count, TRAIN_SAMPLE):
+        nlist //= 2
+    return f"IVF{nlist},PQ{pq_subquantizers(dimension)}"
+
+
+def choose_index_spec(count, dimension, flat_max=10_000, hnsw_max=250_000):
+    """FAISS index factory string for a corpus of `count` vectors"""
+    if count <= flat_max:
+        return "Flat"
+    if count <= hnsw_max:
+        return "HNSW32_SQ8"
+    return ivf_pq_spec(count, dimension)
+
+
+def build_vector_index(vectors, spec, seed=0):
+    """Train (on a sample, if needed) and fill an index of the given factory spec"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    index = faiss.index_factory(vectors.shape[1], spec)
+    if not index.is_trained:
+        sample = vectors
+        if len(vectors) > TRAIN_SAMPLE:
+            rows = np.random.default_rng(seed).choice(len(vectors), TRAIN_SAMPLE, replace=False)
+            sample = vectors[np.sort(rows)]
+        index.train(np.ascontiguousarray(sample))
+    # In slices, so vectors memory-mapped from a spool are paged in a piece at a time
+    for start in range(0, len(vectors), ADD_BATCH):
+        index.add(np.ascontiguousarray(vectors[start:start + ADD_BATCH]))
+    return index
+
+
+def set_search_params(index, ef_search=None, nprobe=None):
+    """Recall/latency knobs: HNSW's efSearch and IVF's nprobe; ignored by other index types"""
+    if ef_search and hasattr(index, "hnsw"):
+        index.hnsw.efSearch = ef_search
+    if nprobe:
+        try:
+            faiss.extract_index_ivf(index).nprobe = nprobe
+        except RuntimeError:
+            pass
+
+
+def index_kind(index):
+    """"hnsw", "ivf" or "flat", for picking which search parameter to sweep"""
+    if hasattr(index, "hnsw"):
+        return "hnsw"
+    try:
+        faiss.extract_index_ivf(index)
+        return "ivf"
+    except RuntimeError:
+        return "flat"
+
+
+class DocstoreWriter:
+    """Append documents, in FAISS row order, to a new compressed store
+
+    Only the current block and the ids are held in memory, so a store can
+    be written while its chunks are still streaming in.
+    """
+
+    def __init__(self, path, block_size=32, level=6):
+        self.path = path
+        self.block_size = block_size
+        self.level = level
+        self._file = open(os.path.join(path, DOCS_FILE), "wb")
+        self._offsets = [0]
+        self._lines = []
+        self.ids = []
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, doc_id, document, digest):
+        """`doc_id` is an ASCII string such as the chunk ids from `ingest.chunk_ids`"""
+        self._lines.append(json.dumps({"id": doc_id, "text": document.page_content, "metadata": document.metadata,
+                                       "hash": digest}))
+        self.ids.append(doc_id)
+        if len(self._lines) == self.block_size:
+            self._flush()
+
+    def _flush(self):
+        self._file.write(zlib.compress("\n".join(self._lines).encode("utf-8"), self.level))
+        self._offsets.append(self._file.tell())
+        self._lines = []
+
+    def close(self):
+        """Write the last block and the offset and id arrays"""
+        if self._lines:
+            self._flush()
+        self._file.close()
+        ids = self.ids
+        row_ids = np.array([doc_id.encode("ascii") for doc_id in ids], dtype=f"S{max(map(len, ids), default=1)}")
+        order = np.argsort(row_ids, kind="stable")
+        np.save(os.path.join(self.path, OFFSETS_FILE), np.array(self._offsets, dtype=np.uint64))
+        np.save(os.path.join(self.path, ROW_IDS_FILE), row_ids)
+        np.save(os.path.join(self.path, SORTED_IDS_FILE), row_ids[order])
+        np.save(os.path.join(self.path, SORTED_ROWS_FILE), order.astype(np.int64))
+        with open(os.path.join(self.path, DOCSTORE_META_FILE), "w", encoding="utf-8") as f:
+            json.dump({"block_size": self.block_size, "count": len(ids)}, f)
+
+
+def write_docstore(path, documents, ids, hashes, block_size=32, level=6):
+    """Write documents, in FAISS row order, with their ids and content hashes as a compressed store"""
+    writer = DocstoreWriter(path, block_size, level)
+    for doc_id, document, digest in zip(ids, documents, hashes):
+        writer.add(doc_id, document, digest)
+    writer.close()
+
+
+class VectorSpool:
+    """Append-only float32 vector file, read back as a memory-mapped array"""
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self.dimension = None
+        self._file = open(path, "wb")
+
+    def append(self, vectors):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if not len(vectors):
+            return
+        if self.dimension is None:
+            self.dimension = vectors.shape[1]
+        self._file.write(vectors.tobytes())
+        self.count += len(vectors)
+
+    def close(self):
+        """The spooled vectors, memory-mapped (None if there are none)"""
+        self._file.close()
+        if not self.count:
+            return None
+        return np.memmap(self.path, dtype=np.float32, mode="r", shape=(self.count, self.dimension))
+
+
+class RowIds(Mapping):
+    """FAISS row -> chunk id, read from the store's memory-mapped id array"""
+
+    def __init__(self, row_ids):
+        self._row_ids = row_ids
+
+    def __getitem__(self, row):
+        if not 0 <= row < len(self._row_ids):
+            raise KeyError(row)
+        return self._row_ids[row].decode("ascii")
+
+    def __len__(self):
+        return len(self._row_ids)
+
+    def __iter__(self):
+        return iter(range(len(self._row_ids)))
+
+
+class CompressedDocstore(Docstore):
+    """Read-only docstore over a `write_docstore` directory
+
+    Only the block offsets and id arrays are touched to find a chunk, and
+    only its block is decompressed; recently used blocks are kept decoded.
+    """
+
+    def __init__(self, path, cache_blocks=256):
+        with open(os.path.join(path, DOCSTORE_META_FILE), encoding="utf-8") as f:
+            meta = json.load(f)
+        self.path = path
+        self.block_size = meta["block_size"]
+        with open(os.path.join(path, DOCS_FILE), "rb") as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+        self._offsets = np.load(os.path.join(path, OFFSETS_FILE), mmap_mode="r")
+        self._sorted_ids = np.load(os.path.join(path, SORTED_IDS_FILE), mmap_mode="r")
+        self._sorted_rows = np.load(os.path.join(path, SORTED_ROWS_FILE), mmap_mode="r")
+        self.index_to_docstore_id = RowIds(np.load(os.path.join(path, ROW_IDS_FILE), mmap_mode="r"))
+        self._block = lru_cache(maxsize=cache_blocks)(self._read_block)
+
+    def __len__(self):
+        return len(self.index_to_docstore_id)
+
+    def _read_block(self, block):
+        start, end = int(self._offsets[block]), int(self._offsets[block + 1])
+        return zlib.decompress(self._data[start:end]).decode("utf-8").split("\n")
+
+    def record(self, row):
+        """Stored record (id, text, metadata, hash) of a FAISS row"""
+        return json.loads(self._block(row // self.block_size)[row % self.block_size])
+
+    def document(self, row):
+        record = self.record(row)
+        return Document(page_content=record["text"], metadata=record["metadata"])
+
+    def row(self, doc_id):
+        """FAISS row of a chunk id, or None"""
+        key = doc_id.encode("ascii")
+        position = int(np.searchsorted(self._sorted_ids, key))
+        if position < len(self._sorted_ids) and self._sorted_ids[position] == key:
+            return int(self._sorted_rows[position])
+        return None
+
+    def search(self, search):
+        row = self.row(search)
+        if row is None:
+            return f"ID {search} not found."
+        return self.document(row)
+
+    def nbytes(self):
+        """Bytes on disk: compressed texts plus the id and offset arrays"""
+        arrays = (self._offsets, self._sorted_ids, self._sorted_rows, self.index_to_docstore_id._row_ids)
+        return len(self._data) + sum(array.nbytes for array in arrays)
+
+
+def _timed_search(index, queries, k):
+    """(neighbor rows, per-query seconds), one query at a time as the retriever does"""
+    rows = np.empty((len(queries), k), dtype=np.int64)
+    seconds = []
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        rows[i] = index.search(query[None, :], k)[1][0]
+        seconds.append(time.perf_counter() - start)
+    return rows, seconds
+
+
+def recall_at_k(found, truth):
+    k = truth.shape[1]
+    return float(np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)]))
+
+
+def recall_report(vectors, queries, k=10, specs=("HNSW32_SQ8",), ef_searches=(16, 32, 64, 128),
+                  nprobes=(1, 4, 16, 64)):
+    """Recall@k and per-query latency of each index spec against the exact flat index
+
+    HNSW specs are swept over `ef_searches` and IVF specs over `nprobes`.
+    Returns one dict per (spec, setting), the exact index first.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    flat = faiss.IndexFlatL2(vectors.shape[1])
+    flat.add(vectors)
+    truth, seconds = _timed_search(flat, queries, k)
+    rows = [_report_row("Flat", None, 0.0, flat, 1.0, seconds)]
+
+    for spec in specs:
+        start = time.perf_counter()
+        index = build_vector_index(vectors, spec)
+        build_seconds = time.perf_counter() - start
+        kind = index_kind(index)
+        settings = {"hnsw": [("efSearch", value) for value in ef_searches],
+                    "ivf": [("nprobe", value) for value in nprobes]}.get(kind, [None])
+        for setting in settings:
+            if setting is not None:
+                set_search_params(index, **{"ef_search" if kind == "hnsw" else "nprobe": setting[1]})
+            found, seconds = _timed_search(index, queries, k)
+            rows.append(_report_row(spec, setting, build_seconds, index, recall_at_k(found, truth), seconds))
+    return rows
+
+
+def _report_row(spec, setting, build_seconds, index, recall, seconds):
+    ms = np.asarray(seconds) * 1000
+    return {
+        "spec": spec,
+        "setting": f"{setting[0]}={setting[1]}" if setting else "",
+        "recall": recall,
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "index_mb": len(faiss.serialize_index(index)) / 2 ** 20,
+        "build_seconds": build_seconds
+    }
+
+
+def format_recall_report(rows, k=10):
+    lines = [f"{'index':<18} {'setting':<12} {'recall@' + str(k):>9} {'p50 ms':>8} {'p95 ms':>8} "
+             f"{'size MB':>9} {'build s':>8}"]
+    for row in rows:
+        lines.append(f"{row['spec']:<18} {row['setting']:<12} {row['recall']:>9.3f} {row['p50_ms']:>8.3f} "
+                     f"{row['p95_ms']:>8.3f} {row['index_mb']:>9.2f} {row['build_seconds']:>8.1f}")
+    return "\n".join(lines)